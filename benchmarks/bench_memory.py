@@ -0,0 +1,95 @@
+# coding=utf-8
+"""
+Memory used by parsed servers, compared with the dict-backed layout
+ServerConfig had before it switched to __slots__.
+
+    python benchmarks/bench_memory.py --servers 100000
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from haproxy_objects import ServerConfig
+
+
+class LegacyServerConfig(object):
+    """
+    ServerConfig as it was laid out before: an instance __dict__ and its own
+    copy of the keywords list. Parsing is borrowed from ServerConfig.
+    """
+    set_value = ServerConfig.__dict__['set_value']
+
+    def __init__(self):
+        self.name = None
+        self.ip = None
+        self.port = 80
+        self.weight = 1
+        self.cookie = None
+        self.check_inter = 2000
+        self.check_fall = 3
+        self.max_connections = None
+        self.min_connections = None
+        self.backup = False
+        self.keywords = list(ServerConfig.keywords)
+        self._raw = None
+
+    @classmethod
+    def from_parts(cls, parts):
+        # it kept the joined server line
+        server = cls()
+        server._parse_parts(parts)
+        server._raw = ' '.join(parts)
+        return server
+
+    def __getattr__(self, name):
+        value = getattr(ServerConfig, name)
+        if hasattr(value, '__get__'):
+            value = value.__get__(self)
+
+        return value
+
+
+def server_lines(count):
+    for i in range(count):
+        yield 'srv%d 10.%d.%d.%d:8080 cookie c%d check inter 2000 fall 3 maxconn 100' % (
+            i, i >> 16 & 255, i >> 8 & 255, i & 255, i)
+
+
+def measure(server_class, count):
+    lines = list(server_lines(count))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    # parsed the way backends do, from the tokens of the server line
+    servers = []
+    for line in lines:
+        servers.append(server_class.from_parts(line.split()))
+
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--servers', type=int, default=100000)
+    args = parser.parse_args()
+
+    legacy = measure(LegacyServerConfig, args.servers)
+    current = measure(ServerConfig, args.servers)
+
+    print('servers: %d' % args.servers)
+    print('%-10s %12s %16s' % ('layout', 'total MiB', 'bytes/server'))
+    for name, used in (('dict', legacy), ('slots', current)):
+        print('%-10s %12.1f %16.0f' % (name, used / 1048576.0, used / float(args.servers)))
+
+    print('saved: %.0f%%' % (100.0 * (legacy - current) / legacy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# coding=utf-8
+"""
+Parse, render and export timings of Config on a synthetic config, with a
+saved baseline to spot regressions.
+
+    python benchmarks/bench_parse.py --backends 2000 --save-baseline
+    python benchmarks/bench_parse.py --backends 2000
+
+Every case is timed as the best of --repeat runs, then run once more under
+tracemalloc for its peak memory. Throughput is in config lines per second,
+the per-section cases count the lines of the sections they parse. A run is
+compared with the baseline file when it exists, the exit status is 1 when a
+case got slower or used more memory than --tolerance allows.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..'))
+
+from haproxy_objects import Config
+from synthetic import add_shape_arguments, shape_from_args, write_config
+
+
+def section_parts(path, part_name):
+    with open(path, 'r') as handler:
+        return [(parts, part_lines) for name, parts, part_lines in Config._iter_parts(handler) if name == part_name]
+
+
+def parse_sections(part_name, sections):
+    for parts, part_lines in sections:
+        Config._parse_part(part_name, parts, list(part_lines))
+
+
+def cases(path):
+    """
+    (name, function, lines) for every benchmarked operation.
+    """
+    config = Config.from_string(path)
+    with open(path, 'r') as handler:
+        lines = sum(1 for _ in handler)
+
+    yield 'Config.from_string', lambda: Config.from_string(path), lines
+    yield 'Config.from_string lazy', lambda: Config.from_string(path, lazy=True), lines
+    yield 'Config.to_string', config.to_string, lines
+    yield 'Config.__dict__', config.__dict__, lines
+
+    for part_name in ('frontend', 'backend'):
+        sections = section_parts(path, part_name)
+        count = sum(len(part_lines) + 1 for parts, part_lines in sections)
+        yield '%s from_string' % part_name, lambda p=part_name, s=sections: parse_sections(p, s), count
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def peak_memory(function):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+
+    finally:
+        tracemalloc.stop()
+
+
+def run(path, repeat):
+    results = {}
+    for name, function, lines in cases(path):
+        seconds = best_time(function, repeat)
+        results[name] = {
+            'seconds': seconds,
+            'lines_per_second': lines / seconds if seconds else 0.0,
+            'peak_bytes': peak_memory(function),
+        }
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the ratios against the baseline and return the regressed case names.
+    """
+    regressions = []
+
+    print('')
+    print('%-26s %10s %10s' % ('against baseline', 'time', 'memory'))
+    for name, result in sorted(results.items()):
+        previous = baseline['results'].get(name)
+        if previous is None:
+            print('%-26s %10s %10s' % (name, 'new', 'new'))
+            continue
+
+        time_ratio = result['seconds'] / previous['seconds'] if previous['seconds'] else 1.0
+        memory_ratio = result['peak_bytes'] / float(previous['peak_bytes']) if previous['peak_bytes'] else 1.0
+        regressed = time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+
+        print('%-26s %9.2fx %9.2fx%s' % (name, time_ratio, memory_ratio, '  REGRESSION' if regressed else ''))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_shape_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', default=os.path.join(BENCHMARKS_DIR, 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed slowdown or memory growth before a case counts as regressed')
+    args = parser.parse_args()
+
+    shape = shape_from_args(args)
+    fd, path = tempfile.mkstemp(suffix='.cfg')
+    os.close(fd)
+
+    try:
+        lines = write_config(path, **shape)
+        results = run(path, args.repeat)
+
+    finally:
+        os.unlink(path)
+
+    print('config: %d lines, %s' % (lines, ', '.join('%s=%d' % item for item in sorted(shape.items()))))
+    print('%-26s %10s %14s %10s' % ('case', 'ms', 'lines/s', 'peak MiB'))
+    for name, result in sorted(results.items()):
+        print('%-26s %10.2f %14.0f %10.1f' % (name, result['seconds'] * 1000, result['lines_per_second'],
+                                              result['peak_bytes'] / 1048576.0))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as handler:
+            json.dump({'shape': shape, 'python': platform.python_version(), 'results': results}, handler,
+                      indent=2, sort_keys=True)
+
+        print('baseline saved to %s' % args.baseline)
+        return
+
+    if not os.path.exists(args.baseline):
+        return
+
+    with open(args.baseline, 'r') as handler:
+        baseline = json.load(handler)
+
+    if baseline['shape'] != shape:
+        print('baseline was taken with another config shape (%s), not compared' %
+              ', '.join('%s=%d' % item for item in sorted(baseline['shape'].items())))
+        return
+
+    if compare(results, baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
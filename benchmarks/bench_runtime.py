@@ -0,0 +1,115 @@
+# coding=utf-8
+"""
+Bulk runtime commands against a local stand-in for the haproxy stats socket,
+one connection per command compared with pipelined pool sessions.
+
+    python benchmarks/bench_runtime.py --commands 5000
+"""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from haproxy_runtime import RuntimeClient, RuntimePool
+
+
+class StandInSocket(object):
+    """
+    Answers every command with an empty reply, like haproxy does for set
+    weight, in one-shot or interactive (prompt) mode.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connections = 0
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(path)
+        self._socket.listen(128)
+
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while True:
+            connection, _address = self._socket.accept()
+            self.connections += 1
+
+            thread = threading.Thread(target=self._handle, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, connection):
+        buffer = b''
+        interactive = False
+
+        while True:
+            data = connection.recv(65536)
+            if not data:
+                break
+
+            buffer += data
+            lines = buffer.split(b'\n')
+            buffer = lines.pop()
+
+            replies = []
+            for line in lines:
+                if line == b'prompt':
+                    interactive = True
+                    replies.append(b'\n> ')
+
+                elif line == b'quit':
+                    connection.close()
+                    return
+
+                elif interactive:
+                    replies.append(b'\n> ')
+
+                else:
+                    connection.sendall(b'\n')
+                    connection.close()
+                    return
+
+            connection.sendall(b''.join(replies))
+
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--commands', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--size', type=int, default=4)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'haproxy.sock')
+    StandInSocket(path)
+
+    commands = ['set weight app/srv%d %d' % (i, i % 256) for i in range(args.commands)]
+
+    client = RuntimeClient(path)
+    started = time.time()
+    client.execute_many(commands)
+    single = time.time() - started
+
+    pool = RuntimePool(path, size=args.size, batch_size=args.batch_size)
+    client = RuntimeClient(path, pool=pool)
+    started = time.time()
+    client.execute_many(commands)
+    pipelined = time.time() - started
+    pool.close()
+
+    print('commands: %d' % args.commands)
+    print('%-22s %10s %14s' % ('mode', 'seconds', 'commands/s'))
+    for name, seconds in (('connection/command', single), ('pooled, pipelined', pipelined)):
+        print('%-22s %10.3f %14.0f' % (name, seconds, args.commands / seconds))
+
+    print('speedup: %.1fx' % (single / pipelined))
+
+
+if __name__ == '__main__':
+    main()
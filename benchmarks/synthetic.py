@@ -0,0 +1,135 @@
+# coding=utf-8
+"""
+Generate synthetic haproxy configs of a given shape for the benchmarks.
+
+    python benchmarks/synthetic.py big.cfg --backends 5000 --servers 10
+
+Every frontend routes to its share of the backends through host, path
+prefix and path regex acls, every backend carries options, a cookie and
+servers with check, weight and maxconn settings. The output only depends on
+the parameters, so runs with the same parameters parse the same text.
+"""
+import argparse
+
+BACKEND_OPTIONS = ('httpchk GET /health', 'forwardfor', 'redispatch', 'httpclose', 'abortonclose', 'allbackups',
+                   'log-health-checks', 'tcp-smart-connect')
+FRONTEND_OPTIONS = ('httplog', 'dontlognull', 'forwardfor', 'http-server-close', 'contstats', 'tcplog',
+                    'log-separate-errors', 'splice-auto')
+
+DEFAULT_SHAPE = {
+    'frontends': 2,
+    'backends': 200,
+    'servers': 10,
+    'acls': 50,
+    'options': 4,
+}
+
+
+def _acl_line(frontend, i):
+    kind = i % 3
+    if kind == 0:
+        return 'acl a%d hdr(host) -i app%d-%d.example.com' % (i, frontend, i)
+
+    if kind == 1:
+        return 'acl a%d path_beg /svc%d/ /api/svc%d/' % (i, i, i)
+
+    return 'acl a%d path_reg ^/v[0-9]+/svc%d/.*$' % (i, i)
+
+
+def generate_lines(frontends=2, backends=200, servers=10, acls=50, options=4):
+    """
+    Yield the lines of a config with the given number of frontends, backends,
+    servers per backend, acls per frontend and options per section.
+    """
+    yield 'global'
+    yield '    log 127.0.0.1 local0 notice'
+    yield '    maxconn 50000'
+    yield '    user haproxy'
+    yield '    group haproxy'
+    yield '    daemon'
+    yield '    stats socket /var/run/haproxy.sock'
+    yield ''
+    yield 'defaults'
+    yield '    log global'
+    yield '    mode http'
+    yield '    retries 3'
+    yield '    contimeout 5000'
+    yield '    clitimeout 50000'
+    yield '    srvtimeout 50000'
+    yield '    option httplog'
+    yield ''
+
+    for f in range(frontends):
+        routed = range(f, backends, frontends)
+
+        yield 'frontend fe%d 0.0.0.0:%d' % (f, 8000 + f)
+        yield '    # generated frontend %d' % f
+        yield '    clitimeout 30000'
+        for i in range(options):
+            yield '    option %s' % FRONTEND_OPTIONS[i % len(FRONTEND_OPTIONS)]
+
+        for i in range(acls):
+            yield '    ' + _acl_line(f, i)
+
+        for i, backend in enumerate(routed):
+            if acls:
+                yield '    use_backend be%d if a%d' % (backend, i % acls)
+
+        if backends:
+            yield '    default_backend be%d' % f
+
+        yield ''
+
+    for b in range(backends):
+        yield 'backend be%d' % b
+        yield '    balance roundrobin'
+        yield '    cookie SRV insert indirect nocache'
+        yield '    maxconn 1000'
+        for i in range(options):
+            yield '    option %s' % BACKEND_OPTIONS[i % len(BACKEND_OPTIONS)]
+
+        for s in range(servers):
+            line = '    server be%d-s%d 10.%d.%d.%d:8080 cookie c%d check inter 2000 fall 3 weight %d maxconn 100' % (
+                b, s, b >> 8 & 255, b & 255, s & 255, s, 1 + s % 10)
+            if s and s == servers - 1:
+                line += ' backup'
+
+            yield line
+
+        yield ''
+
+
+def write_config(path, **shape):
+    """
+    Write a generated config to path and return its number of lines.
+    """
+    count = 0
+    with open(path, 'w') as handler:
+        for line in generate_lines(**shape):
+            handler.write(line)
+            handler.write('\n')
+            count += 1
+
+    return count
+
+
+def add_shape_arguments(parser):
+    for name, default in sorted(DEFAULT_SHAPE.items()):
+        parser.add_argument('--%s' % name, type=int, default=default)
+
+
+def shape_from_args(args):
+    return dict((name, getattr(args, name)) for name in DEFAULT_SHAPE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path')
+    add_shape_arguments(parser)
+    args = parser.parse_args()
+
+    print('%d lines written to %s' % (write_config(args.path, **shape_from_args(args)), args.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,476 @@
+# coding=utf-8
+import collections
+import ipaddress
+import re
+
+Request = collections.namedtuple('Request', ('host', 'path', 'src', 'method', 'headers'))
+Request.__new__.__defaults__ = (None, 'GET', None)
+Request.__doc__ = """
+A recorded request to route: host and path as sent, src the client address,
+headers a dict of the other headers with lower case names.
+"""
+
+# fetch method -> (fetched value, match)
+FETCH_METHODS = {
+    'path': ('path', 'str'),
+    'path_beg': ('path', 'beg'),
+    'path_end': ('path', 'end'),
+    'path_reg': ('path', 'reg'),
+    'path_sub': ('path', 'sub'),
+    'path_dir': ('path', 'dir'),
+    'url': ('url', 'str'),
+    'url_beg': ('url', 'beg'),
+    'url_end': ('url', 'end'),
+    'url_reg': ('url', 'reg'),
+    'url_sub': ('url', 'sub'),
+    'src': ('src', 'ip'),
+    'method': ('method', 'str'),
+}
+
+HEADER_MATCHES = {
+    'hdr': 'str',
+    'hdr_beg': 'beg',
+    'hdr_end': 'end',
+    'hdr_reg': 'reg',
+    'hdr_sub': 'sub',
+    'hdr_dom': 'dom',
+    'hdr_dir': 'dir',
+}
+
+HEADER_RE = re.compile(r'^(hdr(?:_[a-z]+)?)\(([^)]*)\)$')
+
+
+class AclCompileError(Exception):
+    pass
+
+
+def _fetch(request, key):
+    if key == 'host':
+        return request.host
+
+    if key == 'url':
+        return request.path
+
+    if key == 'path':
+        return request.path.partition('?')[0] if request.path is not None else None
+
+    if key == 'src':
+        return request.src
+
+    if key == 'method':
+        return request.method
+
+    return (request.headers or {}).get(key[4:])
+
+
+def parse_acl(method, value):
+    """
+    Split an acl into (fetched value, match, ignore case, patterns). The fetched
+    value is 'host', 'path', 'url', 'src', 'method' or 'hdr:<name>'.
+    """
+    match = HEADER_RE.match(method)
+    if match:
+        header = match.group(2).lower()
+        key = 'host' if header == 'host' else 'hdr:%s' % header
+        kind = HEADER_MATCHES.get(match.group(1))
+
+    elif method in FETCH_METHODS:
+        key, kind = FETCH_METHODS[method]
+
+    else:
+        raise AclCompileError('%s is not supported' % method)
+
+    if kind is None:
+        raise AclCompileError('%s is not supported' % method)
+
+    tokens = value.split()
+    icase = False
+    while tokens and tokens[0].startswith('-'):
+        flag = tokens.pop(0)
+
+        if flag == '--':
+            break
+
+        elif flag == '-i':
+            icase = True
+
+        elif flag == '-m' and tokens:
+            kind = tokens.pop(0)
+
+        elif flag == '-f':
+            raise AclCompileError('pattern files are not supported')
+
+    if kind not in ('str', 'beg', 'end', 'reg', 'sub', 'dom', 'dir', 'ip'):
+        raise AclCompileError('-m %s is not supported' % kind)
+
+    return key, kind, icase, tokens
+
+
+def parse_condition(tokens):
+    """
+    Turn use_backend condition tokens into a list of alternatives, each a list of
+    (acl name, negated) that must all hold. Anonymous acls are returned as
+    ('{method value}', negated) with their definition in the second list.
+    """
+    terms = [[]]
+    anonymous = []
+    tokens = list(tokens)
+    negate = False
+    i = 0
+
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+
+        if token in ('or', '||'):
+            terms.append([])
+
+        elif token == '&&':
+            continue
+
+        elif token == '!':
+            # haproxy also takes the negation as a word of its own
+            negate = not negate
+
+        else:
+            negated = negate != token.startswith('!')
+            negate = False
+            token = token.lstrip('!')
+
+            if token == '{':
+                end = tokens.index('}', i) if '}' in tokens[i:] else len(tokens)
+                body = tokens[i:end]
+                i = end + 1
+                if not body:
+                    continue
+
+                token = '{%s}' % ' '.join(body)
+                anonymous.append((token, body[0], ' '.join(body[1:])))
+
+            terms[-1].append((token, negated))
+
+    return [term for term in terms if term], anonymous
+
+
+class PrefixTrie(object):
+    """
+    The patterns of beg acls in a character trie, every node holding the acl
+    names of the patterns ending there under None. A value is matched by
+    walking it once, whatever the number of patterns. Suffixes are matched on
+    a trie of the reversed patterns with the reversed value.
+    """
+    __slots__ = ('root',)
+
+    def __init__(self):
+        self.root = {}
+        super(PrefixTrie, self).__init__()
+
+    def add(self, pattern, name):
+        node = self.root
+        for char in pattern:
+            node = node.setdefault(char, {})
+
+        node.setdefault(None, set()).add(name)
+
+    def match(self, value, matched):
+        """
+        Add the names of the patterns value starts with to matched.
+        """
+        node = self.root
+        names = node.get(None)
+        if names:
+            matched.update(names)
+
+        for char in value:
+            node = node.get(char)
+            if node is None:
+                return
+
+            names = node.get(None)
+            if names:
+                matched.update(names)
+
+
+class CompiledFrontend(object):
+    """
+    The acls and use_backend rules of a FrontendConfig compiled for fast
+    routing of many requests.
+
+    Exact matches are looked up in a hash set per fetched value, prefixes and
+    suffixes in a PrefixTrie per fetched value, so a request costs one walk
+    of the value instead of one comparison per pattern. Regexes are compiled
+    once, and the rules are indexed by their acls so only the rules whose
+    acls matched are tried. Routing results are memoized by the request
+    values the acls look at, recorded traffic repeats a lot.
+
+    use_backend rules are evaluated in config order and the first one that
+    holds takes the request. An unless rule holds when its condition does
+    not. Acls that can't be compiled (pattern files, unknown fetches,
+    invalid patterns) never match and are listed in unsupported.
+    """
+    memo_size = 100000
+
+    def __init__(self, frontend):
+        self.name = frontend.name
+        self.default_backend = frontend.default_backend or None
+        self.unsupported = {}
+
+        self._exact = {}
+        self._prefix = {}
+        self._suffix = {}
+        self._regexes = {}
+        self._scanned = []
+        self._fetches = set()
+        self._memo = {}
+
+        for name, acl in frontend.acl.items():
+            self._add_acl(name, acl['method'], acl['value'])
+
+        # (backend, unless, terms)
+        self.rules = []
+        for backend, keyword, conditions in frontend.iter_use_backend():
+            terms, anonymous = parse_condition(conditions)
+            for name, method, value in anonymous:
+                self._add_acl(name, method, value)
+
+            self.rules.append((backend, keyword == 'unless', terms))
+
+        self._fetches = tuple(sorted(self._fetches))
+        self._compile_regexes()
+        self._index_rules()
+        super(CompiledFrontend, self).__init__()
+
+    def _add_acl(self, name, method, value):
+        try:
+            key, kind, icase, patterns = parse_acl(method, value)
+
+        except AclCompileError as e:
+            self.unsupported[name] = str(e)
+            return
+
+        self._fetches.add(key)
+        if icase:
+            patterns = [pattern.lower() for pattern in patterns]
+
+        if kind == 'str':
+            index = self._exact.setdefault((key, icase), {})
+            for pattern in patterns:
+                index.setdefault(pattern, set()).add(name)
+
+        elif kind == 'beg':
+            trie = self._prefix.setdefault((key, icase), PrefixTrie())
+            for pattern in patterns:
+                trie.add(pattern, name)
+
+        elif kind == 'end':
+            trie = self._suffix.setdefault((key, icase), PrefixTrie())
+            for pattern in patterns:
+                trie.add(pattern[::-1], name)
+
+        elif kind == 'reg':
+            for pattern in patterns:
+                self._regexes.setdefault((key, icase), []).append((pattern, name))
+
+        elif kind == 'ip':
+            try:
+                networks = [ipaddress.ip_network(pattern, strict=False) for pattern in patterns]
+            except ValueError as e:
+                self.unsupported[name] = 'invalid network: %s' % e
+                return
+
+            self._scanned.append((key, False, lambda value, networks=networks: _in_networks(value, networks), name))
+
+        else:
+            test = {'sub': _sub_match, 'dom': _dom_match, 'dir': _dir_match}[kind]
+            self._scanned.append((key, icase, lambda value, test=test, patterns=patterns: test(value, patterns), name))
+
+    def _compile_regexes(self):
+        # the regexes on one value are also joined into one, most requests
+        # match none of them and are turned down by a single search
+        self._regex_groups = []
+
+        for (key, icase), patterns in sorted(self._regexes.items()):
+            flags = re.IGNORECASE if icase else 0
+            tests = []
+            for pattern, name in patterns:
+                try:
+                    tests.append((re.compile(pattern, flags).search, name))
+                except re.error as e:
+                    self.unsupported[name] = 'invalid regex %s: %s' % (pattern, e)
+
+            try:
+                combined = re.compile('|'.join('(?:%s)' % pattern for pattern, name in patterns), flags).search
+            except re.error:
+                # back references or inline flags don't survive the join
+                combined = None
+
+            self._regex_groups.append((key, combined, tests))
+
+    def _values(self, request):
+        return dict((key, _fetch(request, key)) for key in self._fetches)
+
+    def matched_acls(self, request, values=None):
+        """
+        The names of the acls request matches, predefined ones included.
+        """
+        if values is None:
+            values = self._values(request)
+
+        matched = set(('TRUE', 'HTTP'))
+        if request.method:
+            matched.add('METH_%s' % request.method.upper())
+
+        for (key, icase), index in self._exact.items():
+            value = values[key]
+            if value is not None:
+                names = index.get(value.lower() if icase else value)
+                if names:
+                    matched.update(names)
+
+        for table, beginning in ((self._prefix, True), (self._suffix, False)):
+            for (key, icase), trie in table.items():
+                value = values[key]
+                if value is None:
+                    continue
+
+                if icase:
+                    value = value.lower()
+
+                trie.match(value if beginning else value[::-1], matched)
+
+        for key, combined, tests in self._regex_groups:
+            value = values[key]
+            if value is None or combined is not None and combined(value) is None:
+                continue
+
+            for test, name in tests:
+                if name not in matched and test(value):
+                    matched.add(name)
+
+        for key, icase, test, name in self._scanned:
+            if name in matched:
+                continue
+
+            value = values[key]
+            if value is not None and test(value.lower() if icase else value):
+                matched.add(name)
+
+        return matched
+
+    def _index_rules(self):
+        # an if rule can only hold when the first acl of one of its terms that
+        # is not negated matched, unless rules and rules with a term without
+        # one are always tried
+        self._always = []
+        self._anchored = {}
+
+        for i, (backend, unless, terms) in enumerate(self.rules):
+            if unless:
+                self._always.append(i)
+                continue
+
+            anchors = set()
+            for term in terms:
+                positive = [name for name, negated in term if not negated]
+                if not positive:
+                    anchors = None
+                    break
+
+                anchors.add(positive[0])
+
+            if not terms or anchors is None:
+                self._always.append(i)
+            else:
+                for name in anchors:
+                    self._anchored.setdefault(name, []).append(i)
+
+    def route(self, request):
+        """
+        The backend request is sent to, None when no rule matches and there is
+        no default_backend.
+        """
+        values = self._values(request)
+        key = tuple([values[fetch] for fetch in self._fetches]) + (request.method,)
+
+        backend = self._memo.get(key, self)
+        if backend is not self:
+            return backend
+
+        matched = self.matched_acls(request, values)
+        candidates = set(self._always)
+        for name in matched:
+            candidates.update(self._anchored.get(name, ()))
+
+        backend = self.default_backend
+        for i in sorted(candidates):
+            rule_backend, unless, terms = self.rules[i]
+            if not terms:
+                holds = not unless
+            else:
+                holds = any(all((name in matched) != negated for name, negated in term) for term in terms) != unless
+
+            if holds:
+                backend = rule_backend
+                break
+
+        if len(self._memo) >= self.memo_size:
+            self._memo.clear()
+
+        self._memo[key] = backend
+        return backend
+
+    def route_many(self, requests):
+        route = self.route
+        return [route(request) for request in requests]
+
+    def hits(self, requests, counts=None):
+        """
+        Count the requests reaching every backend, None counting the ones no
+        backend takes. Pass the counts of a previous batch to add to them.
+        """
+        if counts is None:
+            counts = {}
+
+        route = self.route
+        for request in requests:
+            backend = route(request)
+            counts[backend] = counts.get(backend, 0) + 1
+
+        return counts
+
+
+def _in_networks(value, networks):
+    try:
+        address = ipaddress.ip_address(value)
+    except ValueError:
+        return False
+
+    return any(address in network for network in networks)
+
+
+def _sub_match(value, patterns):
+    return any(pattern in value for pattern in patterns)
+
+
+def _dom_match(value, patterns):
+    parts = re.split(r'[/?.:]', value)
+    for pattern in patterns:
+        pattern_parts = pattern.split('.')
+        for i in range(len(parts) - len(pattern_parts) + 1):
+            if parts[i:i + len(pattern_parts)] == pattern_parts:
+                return True
+
+    return False
+
+
+def _dir_match(value, patterns):
+    parts = [part for part in value.split('/') if part]
+    return any(pattern.strip('/') in parts for pattern in patterns)
+
+
+def compile_config(config):
+    """
+    A CompiledFrontend for every frontend of config, keyed by name.
+    """
+    return dict((name, CompiledFrontend(frontend)) for name, frontend in config.frontends.items())
+
@@ -0,0 +1,332 @@
+# coding=utf-8
+import bisect
+import collections
+import heapq
+import itertools
+import random
+import zlib
+from functools import reduce
+from math import gcd
+
+from haproxy_acl import Request
+
+BALANCE_ALGORITHMS = ('roundrobin', 'static-rr', 'leastconn', 'source', 'uri')
+HASH_TYPES = ('map-based', 'consistent')
+
+
+class BalanceError(Exception):
+    pass
+
+
+def _hash(key):
+    return zlib.crc32(key.encode('utf-8', 'replace'))
+
+
+def weighted_cycle(weights):
+    """
+    The server indexes of one round of weighted round robin, every server
+    appearing weight times (divided by the gcd of the weights), spread out
+    evenly rather than in runs: the n-th turn of a server comes at
+    (n + 0.5) / weight of the round.
+    """
+    divisor = reduce(gcd, [weight for weight in weights if weight], 0) or 1
+    turns = []
+    for i, weight in enumerate(weights):
+        weight //= divisor
+        turns.extend(((n + 0.5) / weight, i) for n in range(weight))
+
+    turns.sort()
+    return [i for position, i in turns]
+
+
+def synthetic_requests(count, keys=10000, skew=1.0, seed=0):
+    """
+    count Requests over keys distinct clients and paths, their popularity
+    following a zipf law of exponent skew (0 for uniform).
+    """
+    rng = random.Random(seed)
+    weights = [1.0 / (rank ** skew) for rank in range(1, keys + 1)]
+    ranks = rng.choices(range(keys), weights=weights, k=count)
+
+    clients = ['10.%d.%d.%d' % (rank >> 16 & 255, rank >> 8 & 255, rank & 255) for rank in range(keys)]
+    paths = ['/item/%d?session=%d' % (rank, rank % 97) for rank in range(keys)]
+    return [Request('app.example.com', paths[rank], clients[rank]) for rank in ranks]
+
+
+class BalanceReport(object):
+    """
+    Requests sent to every server by a simulation, with the share of every
+    server and the imbalance: the highest ratio of a server's requests to the
+    requests its weight entitles it to, 1.0 being a perfect spread.
+    """
+    def __init__(self, counts, weights, unrouted=0):
+        self.counts = counts
+        self.weights = weights
+        self.unrouted = unrouted
+        super(BalanceReport, self).__init__()
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def share(self):
+        total = self.total
+        return dict((name, count / float(total) if total else 0.0) for name, count in self.counts.items())
+
+    @property
+    def imbalance(self):
+        total = self.total
+        total_weight = sum(self.weights.values())
+        if not total or not total_weight:
+            return None
+
+        return max(self.counts.get(name, 0) / (total * weight / float(total_weight))
+                   for name, weight in self.weights.items() if weight)
+
+    def __dict__(self):
+        return {
+            'requests': self.total,
+            'unrouted': self.unrouted,
+            'counts': dict(self.counts),
+            'share': self.share(),
+            'imbalance': self.imbalance,
+        }
+
+    def iter_lines(self):
+        share = self.share()
+        yield '%-32s %8s %12s %8s' % ('server', 'weight', 'requests', 'share')
+        for name in sorted(self.counts, key=lambda name: -self.counts[name]):
+            yield '%-32s %8s %12s %7.2f%%' % (name, self.weights.get(name, 0), self.counts[name], share[name] * 100)
+
+        if self.unrouted:
+            yield '%-32s %8s %12s' % ('(no server)', '', self.unrouted)
+
+        if self.imbalance is not None:
+            yield 'imbalance %.3f' % self.imbalance
+
+    def to_string(self):
+        return '\n'.join(self.iter_lines()) + '\n'
+
+
+class BalanceSimulator(object):
+    """
+    Predict how a backend spreads requests over its servers.
+
+    balance (the backend's by default) is one of BALANCE_ALGORITHMS, source
+    and uri hash the client address or the path before '?' with crc32,
+    map-based over a table of the server weights or consistent on a ring of
+    points_per_weight points per weight unit. The config does not keep
+    hash-type, so pass hash_type, map-based like haproxy by default.
+
+    Servers disabled, listed in down or of weight 0 take no requests. Backup
+    servers only take requests when no other server can, the first one alone
+    unless the backend has option allbackups. weights overrides the weight
+    of servers by name, to try a change before making it.
+
+    Requests are haproxy_acl Requests. Work is done per distinct key for
+    the hash algorithms and on a precomputed weighted cycle for round robin,
+    so millions of requests take seconds.
+    """
+    points_per_weight = 16
+
+    def __init__(self, backend, balance=None, hash_type='map-based', down=(), weights=None):
+        self.backend = backend
+        self.balance = (balance or backend.balance or 'roundrobin').split()[0]
+        self.hash_type = hash_type
+        self.down = frozenset(down)
+        self.weights = dict(weights or {})
+
+        if self.balance not in BALANCE_ALGORITHMS:
+            raise BalanceError('balance %s is not supported' % self.balance)
+
+        if hash_type not in HASH_TYPES:
+            raise BalanceError('hash-type %s is not supported' % hash_type)
+
+        self.servers = self._eligible_servers()
+        self._cycle = None
+        self._ring = None
+        super(BalanceSimulator, self).__init__()
+
+    def _eligible_servers(self):
+        active = []
+        backups = []
+        for name, server in self.backend.server.items():
+            weight = self.weights.get(name, server.weight)
+            if server.disabled or name in self.down or not weight:
+                continue
+
+            (backups if server.backup else active).append((name, weight))
+
+        if active:
+            return active
+
+        if backups and 'allbackups' not in self.backend.option:
+            return backups[:1]
+
+        return backups
+
+    def without(self, name):
+        """
+        The same simulation with the server name down.
+        """
+        return self.__class__(self.backend, self.balance, self.hash_type, self.down | set([name]), self.weights)
+
+    def _weighted_cycle(self):
+        if self._cycle is None:
+            names = [name for name, weight in self.servers]
+            self._cycle = [names[i] for i in weighted_cycle([weight for name, weight in self.servers])]
+
+        return self._cycle
+
+    def _consistent_ring(self):
+        if self._ring is None:
+            points = []
+            for name, weight in self.servers:
+                for i in range(weight * self.points_per_weight):
+                    points.append((_hash('%s-%d' % (name, i)), name))
+
+            points.sort()
+            self._ring = ([point for point, name in points], [name for point, name in points])
+
+        return self._ring
+
+    def server_for_key(self, key):
+        """
+        The server a hashed key (client address or path) goes to.
+        """
+        if not self.servers:
+            return None
+
+        value = _hash(key)
+        if self.hash_type == 'consistent':
+            positions, names = self._consistent_ring()
+            return names[bisect.bisect_left(positions, value) % len(names)]
+
+        cycle = self._weighted_cycle()
+        return cycle[value % len(cycle)]
+
+    def _key(self, request):
+        if self.balance == 'source':
+            return request.src or ''
+
+        return (request.path or '').partition('?')[0]
+
+    def key_counts(self, requests):
+        """
+        Requests per hashed key, for source and uri.
+        """
+        key = self._key
+        return collections.Counter([key(request) for request in requests])
+
+    def simulate(self, requests, durations=None, interval=1.0):
+        """
+        A BalanceReport of requests. For leastconn the requests arrive every
+        interval and last their duration, from durations (a number or one
+        per request, 50 intervals by default).
+        """
+        requests = list(requests)
+        weights = dict(self.servers)
+        counts = dict((name, 0) for name in weights)
+
+        if not self.servers:
+            return BalanceReport(counts, weights, unrouted=len(requests))
+
+        if self.balance in ('roundrobin', 'static-rr'):
+            cycle = self._weighted_cycle()
+            rounds, rest = divmod(len(requests), len(cycle))
+            for name in cycle:
+                counts[name] += rounds
+
+            for name in cycle[:rest]:
+                counts[name] += 1
+
+        elif self.balance == 'leastconn':
+            counts = self._leastconn(len(requests), 50 * interval if durations is None else durations, interval)
+
+        else:
+            server_for_key = self.server_for_key
+            for key, count in self.key_counts(requests).items():
+                counts[server_for_key(key)] += count
+
+        return BalanceReport(counts, weights)
+
+    def _leastconn(self, count, durations, interval):
+        # servers are kept in a heap by (connections + 1) / weight with lazy
+        # removal of stale entries, ties go to the server used least recently
+        names = [name for name, weight in self.servers]
+        weights = [weight for name, weight in self.servers]
+        connections = [0] * len(names)
+        counts = [0] * len(names)
+        version = [0] * len(names)
+
+        servers = [(1.0 / weight, i, 0, i) for i, weight in enumerate(weights)]
+        heapq.heapify(servers)
+        push, pop, replace = heapq.heappush, heapq.heappop, heapq.heapreplace
+
+        # requests of the same duration end in the order they started, a fifo
+        # is enough to find the ones that ended
+        if isinstance(durations, (int, float)):
+            running = collections.deque()
+            durations = itertools.repeat(durations)
+            finish, end = running.append, running.popleft
+        else:
+            running = []
+            finish, end = (lambda item: push(running, item)), (lambda: pop(running))
+
+        for n, duration in zip(range(count), durations):
+            now = n * interval
+
+            while running and running[0][0] <= now:
+                i = end()[1]
+                connections[i] -= 1
+                version[i] += 1
+                push(servers, ((connections[i] + 1.0) / weights[i], n, version[i], i))
+
+            while servers[0][2] != version[servers[0][3]]:
+                pop(servers)
+
+            i = servers[0][3]
+            connections[i] += 1
+            counts[i] += 1
+            version[i] += 1
+            replace(servers, ((connections[i] + 1.0) / weights[i], n, version[i], i))
+            finish((now + duration, i))
+
+        return dict(zip(names, counts))
+
+    def remapped(self, requests, name):
+        """
+        What removing the server name changes for source and uri: keys and
+        requests that go to another server, the ones that were on name, which
+        have to move, counted apart. None for the other algorithms, which
+        don't tie requests to servers.
+        """
+        if self.balance not in ('source', 'uri'):
+            return None
+
+        after = self.without(name)
+        moved_keys = moved_requests = forced_keys = forced_requests = 0
+        total_keys = total_requests = 0
+
+        for key, count in self.key_counts(requests).items():
+            total_keys += 1
+            total_requests += count
+
+            before_server = self.server_for_key(key)
+            if before_server == after.server_for_key(key):
+                continue
+
+            moved_keys += 1
+            moved_requests += count
+            if before_server == name:
+                forced_keys += 1
+                forced_requests += count
+
+        return {
+            'keys': total_keys,
+            'requests': total_requests,
+            'moved_keys': moved_keys,
+            'moved_requests': moved_requests,
+            'forced_keys': forced_keys,
+            'forced_requests': forced_requests,
+        }
@@ -0,0 +1,158 @@
+# coding=utf-8
+import asyncio
+
+from haproxy_runtime import RuntimeApiError, parse_timeout
+
+
+def parse_address(address):
+    """
+    Split a stats socket address into ('unix', path) or ('tcp', (host, port)).
+    Addresses may carry the haproxy unix@, ipv4@ and ipv6@ prefixes.
+    """
+    prefix, _t, rest = address.partition('@')
+    if not _t:
+        prefix, rest = '', address
+
+    if prefix == 'unix' or (not prefix and (rest.startswith('/') or ':' not in rest)):
+        return 'unix', rest
+
+    if prefix not in ('', 'ipv4', 'ipv6'):
+        raise RuntimeApiError('Unsupported stats socket address %s' % address)
+
+    host, _t, port = rest.rpartition(':')
+    return 'tcp', (host.strip('[]'), int(port))
+
+
+class FleetResult(object):
+    """
+    replies - address -> reply text of the nodes that answered
+    errors - address -> exception of the nodes that failed or timed out
+    """
+    def __init__(self):
+        self.replies = {}
+        self.errors = {}
+        super(FleetResult, self).__init__()
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+class FleetClient(object):
+    """
+    Send the same runtime API command to many haproxy stats sockets at once,
+    with at most concurrency connections in flight and a timeout per node.
+    A failing node is reported in the result and does not stop the others.
+    """
+    def __init__(self, addresses, concurrency=50, timeout=10):
+        """
+        addresses - stats socket addresses, or a dict of address -> timeout in
+        seconds for nodes that need their own timeout
+        """
+        if isinstance(addresses, dict):
+            self.timeouts = dict(addresses)
+            self.addresses = list(addresses)
+        else:
+            self.timeouts = {}
+            self.addresses = list(addresses)
+
+        self.concurrency = concurrency
+        self.timeout = timeout
+        super(FleetClient, self).__init__()
+
+    @classmethod
+    def from_configs(cls, configs, **kwargs):
+        """
+        Build a client for the stats sockets of the given Config objects, using
+        their stats timeout. Every config must have its own address, configs
+        of several hosts sharing a unix socket path can't be told apart, give
+        them their ipv4@host:port stats socket instead.
+        """
+        addresses = {}
+        for config in configs:
+            stats = config.globals.stats
+            if stats['socket'] in addresses:
+                raise RuntimeApiError('Stats socket %s is used by several configs' % stats['socket'])
+
+            addresses[stats['socket']] = parse_timeout(stats.get('timeout', '10s'))
+
+        return cls(addresses, **kwargs)
+
+    async def _execute(self, address, command):
+        kind, target = parse_address(address)
+
+        if kind == 'unix':
+            reader, writer = await asyncio.open_unix_connection(target)
+        else:
+            reader, writer = await asyncio.open_connection(*target)
+
+        try:
+            writer.write(('%s\n' % command).encode('utf-8'))
+            await writer.drain()
+            data = await reader.read()
+
+        finally:
+            writer.close()
+
+        return data.decode('utf-8')
+
+    async def execute_async(self, command, expect_empty=False, addresses=None):
+        """
+        expect_empty - treat a non-empty reply as an error, as for the set
+        commands which answer nothing on success
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        result = FleetResult()
+
+        async def run(address):
+            async with semaphore:
+                try:
+                    reply = await asyncio.wait_for(self._execute(address, command),
+                                                   self.timeouts.get(address, self.timeout))
+                except Exception as e:
+                    # bad addresses and replies included, a node never stops the others
+                    result.errors[address] = e
+                    return
+
+            if expect_empty and reply.strip():
+                result.errors[address] = RuntimeApiError('%s: %s' % (command, reply.strip()))
+            else:
+                result.replies[address] = reply
+
+        await asyncio.gather(*[run(address) for address in addresses or self.addresses])
+        return result
+
+    def execute(self, command, expect_empty=False, addresses=None):
+        return asyncio.run(self.execute_async(command, expect_empty, addresses))
+
+    def show_info(self):
+        """
+        Return a FleetResult whose replies are dicts of the show info fields.
+        """
+        result = self.execute('show info')
+
+        for address, reply in result.replies.items():
+            info = {}
+            for line in reply.splitlines():
+                key, _t, value = line.partition(':')
+                if _t:
+                    info[key.strip()] = value.strip()
+
+            result.replies[address] = info
+
+        return result
+
+    def show_stat(self):
+        return self.execute('show stat')
+
+    def set_weight(self, backend, server, weight):
+        return self.execute('set weight %s/%s %s' % (backend, server, weight), expect_empty=True)
+
+    def set_server_state(self, backend, server, state):
+        if state not in ('ready', 'drain', 'maint'):
+            raise RuntimeApiError('Invalid server state %s' % state)
+
+        return self.execute('set server %s/%s state %s' % (backend, server, state), expect_empty=True)
+
+    def set_max_connections(self, backend, server, connections):
+        return self.execute('set maxconn server %s/%s %s' % (backend, server, connections), expect_empty=True)
@@ -0,0 +1,346 @@
+# coding=utf-8
+import asyncio
+import collections
+import heapq
+import random
+import re
+import time
+
+HTTP_METHODS = ('OPTIONS', 'GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'TRACE', 'PATCH', 'CONNECT')
+
+Transition = collections.namedtuple('Transition', ('section', 'server', 'address', 'up', 'time', 'reason'))
+Transition.__doc__ = """
+A server going down (up False) or back up, with the result of the check that
+made it change.
+"""
+
+
+def parse_httpchk(value):
+    """
+    Split the value of option httpchk into (method, uri, version), taking
+    '<method> <uri> <version>', '<uri>' and the '<uri> <method> <version>'
+    order of the defaults of this module. Escaped headers after the version
+    ("HTTP/1.1\\r\\nHost:\\ www") are unescaped. haproxy checks with
+    OPTIONS / HTTP/1.0 when nothing is given.
+    """
+    method, uri, version = 'OPTIONS', '/', 'HTTP/1.0'
+
+    for token in re.split(r'(?<!\\)\s+', (value or '').strip()):
+        if not token:
+            continue
+
+        if token.upper() in HTTP_METHODS:
+            method = token.upper()
+        elif token.startswith('HTTP/'):
+            version = token
+        else:
+            uri = token
+
+    return method, uri, version.replace('\\r\\n', '\r\n').replace('\\ ', ' ')
+
+
+def _has_no_body(method, status):
+    return method == 'HEAD' or 100 <= status < 200 or status in (204, 304)
+
+
+class ServerCheck(object):
+    """
+    The check of one server and its health: up until fall checks in a row
+    failed, then down until rise checks in a row passed.
+    """
+    __slots__ = ('section', 'server', 'host', 'port', 'request', 'keep_alive', 'inter', 'fall', 'rise', 'up',
+                 'successes', 'failures', 'checks', 'last_reason', 'connection')
+
+    def __init__(self, section, server, request, keep_alive, rise):
+        self.section = section
+        self.server = server.name
+        self.host = server.ip
+        self.port = int(server.port)
+        self.request = request
+        self.keep_alive = keep_alive
+        self.inter = (server.check_inter or 2000) / 1000.0
+        self.fall = server.check_fall or 3
+        self.rise = rise
+        self.up = True
+        self.successes = 0
+        self.failures = 0
+        self.checks = 0
+        self.last_reason = None
+        self.connection = None
+
+    @property
+    def address(self):
+        return '%s:%s' % (self.host, self.port)
+
+    def record(self, ok, reason):
+        """
+        Count a check result, True when the server changed state.
+        """
+        self.checks += 1
+        self.last_reason = reason
+
+        if ok:
+            self.successes += 1
+            self.failures = 0
+            if not self.up and self.successes >= self.rise:
+                self.up = True
+                return True
+        else:
+            self.failures += 1
+            self.successes = 0
+            if self.up and self.failures >= self.fall:
+                self.up = False
+                return True
+
+        return False
+
+    def close(self):
+        if self.connection is not None:
+            self.connection[1].close()
+            self.connection = None
+
+
+class HealthProber(object):
+    """
+    Check every server of a Config from outside haproxy, the way haproxy's own
+    checks would: HTTP checks with the request of option httpchk for http
+    sections that have it, TCP connects for the others. Disabled servers are
+    not checked.
+
+    Every server is checked every check inter and changes state after check
+    fall failures or rise successes, reported to callback(transition) and
+    kept in the last history_size transitions. First checks are spread over
+    one interval so that many servers don't all start at once, and spread is
+    the fraction of the interval later checks randomly move by.
+
+    At most concurrency checks are in flight. HTTP/1.1 checks keep their
+    connection open between checks when the server allows it; with many
+    servers mind the open files limit, or pass keep_alive=False.
+    """
+    def __init__(self, config, callback=None, concurrency=500, timeout=None, rise=2, spread=0.05, keep_alive=True,
+                 history_size=10000):
+        """
+        timeout - seconds a check may take, the server's interval by default
+        """
+        self.callback = callback
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.spread = spread
+        self.transitions = collections.deque(maxlen=history_size)
+        self.checks = []
+
+        for sections in (config.backends, config.listens):
+            for name, section in sections.items():
+                request = None
+                if section.mode == 'http' and 'httpchk' in section.option:
+                    request = parse_httpchk(section.option['httpchk'])
+
+                reuse = keep_alive and request is not None and request[2].startswith('HTTP/1.1')
+                for server in section.server.values():
+                    if not server.disabled and server.ip:
+                        self.checks.append(ServerCheck(name, server, request, reuse, rise))
+
+        self._semaphore = None
+        super(HealthProber, self).__init__()
+
+    def states(self):
+        """
+        (section, server) -> True for the servers that are up.
+        """
+        return dict(((check.section, check.server), check.up) for check in self.checks)
+
+    def _http_request(self, check):
+        method, uri, version = check.request
+        version, _t, headers = version.partition('\r\n')
+        lines = ['%s %s %s' % (method, uri, version)]
+        if headers:
+            lines.extend(headers.split('\r\n'))
+
+        if not check.keep_alive:
+            lines.append('Connection: close')
+
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _connect(self, check):
+        if check.connection is not None:
+            reader, writer = check.connection
+            check.connection = None
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+
+            writer.close()
+
+        reader, writer = await asyncio.open_connection(check.host, check.port)
+        return reader, writer, False
+
+    async def _http_check(self, check):
+        request = self._http_request(check)
+
+        reader, writer, reused = await self._connect(check)
+        try:
+            try:
+                writer.write(request)
+                await writer.drain()
+                head = await reader.readuntil(b'\r\n\r\n')
+
+            except (OSError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+
+                # the server closed the idle connection, try a new one
+                writer.close()
+                reader, writer, reused = await self._connect(check)
+                writer.write(request)
+                await writer.drain()
+                head = await reader.readuntil(b'\r\n\r\n')
+
+            status_line, _t, header_text = head.decode('latin-1').partition('\r\n')
+            parts = status_line.split(None, 2)
+            if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+                return False, 'invalid response %r' % status_line
+
+            headers = {}
+            for line in header_text.split('\r\n'):
+                key, _t, value = line.partition(':')
+                if _t:
+                    headers[key.strip().lower()] = value.strip().lower()
+
+            reusable = check.keep_alive and parts[0] == 'HTTP/1.1' and headers.get('connection') != 'close'
+            if 'content-length' in headers and headers.get('transfer-encoding') is None:
+                await reader.readexactly(int(headers['content-length']))
+            elif _has_no_body(check.request[0], int(parts[1])):
+                pass
+            else:
+                reusable = False
+
+            if reusable:
+                check.connection = (reader, writer)
+                writer = None
+
+            status = int(parts[1])
+            return 200 <= status < 400, 'HTTP %s' % status
+
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def _tcp_check(self, check):
+        reader, writer = await asyncio.open_connection(check.host, check.port)
+        writer.close()
+        return True, 'connected'
+
+    def _start(self):
+        # asyncio primitives belong to the loop they are first used on, every
+        # run gets its own
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def check(self, check):
+        """
+        Check one server now and record the result, returning the Transition
+        when its state changed.
+        """
+        if self._semaphore is None:
+            self._start()
+
+        async with self._semaphore:
+            timeout = self.timeout or check.inter
+            try:
+                if check.request is None:
+                    ok, reason = await asyncio.wait_for(self._tcp_check(check), timeout)
+                else:
+                    ok, reason = await asyncio.wait_for(self._http_check(check), timeout)
+
+            except asyncio.TimeoutError:
+                ok, reason = False, 'timeout'
+                check.close()
+
+            except (OSError, EOFError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+                ok, reason = False, '%s: %s' % (e.__class__.__name__, e)
+                check.close()
+
+        if not check.record(ok, reason):
+            return None
+
+        transition = Transition(check.section, check.server, check.address, check.up, time.time(), reason)
+        self.transitions.append(transition)
+        if self.callback is not None:
+            self.callback(transition)
+
+        return transition
+
+    async def run_once_async(self):
+        """
+        Check every server once, concurrently, and return the transitions.
+        """
+        self._start()
+        transitions = await asyncio.gather(*[self.check(check) for check in self.checks])
+        return [transition for transition in transitions if transition is not None]
+
+    def run_once(self):
+        async def run_once():
+            try:
+                return await self.run_once_async()
+            finally:
+                self.close()
+
+        return asyncio.run(run_once())
+
+    async def run_async(self, duration=None):
+        """
+        Check every server at its interval, for duration seconds or until
+        cancelled.
+        """
+        self._start()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        end = None if duration is None else start + duration
+
+        due = [(start + random.random() * check.inter, i) for i, check in enumerate(self.checks)]
+        heapq.heapify(due)
+        running = set()
+        busy = set()
+
+        def done(task, i):
+            running.discard(task)
+            busy.discard(i)
+
+        try:
+            while due:
+                when, i = due[0]
+                if end is not None and when >= end:
+                    break
+
+                delay = when - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                heapq.heappop(due)
+                check = self.checks[i]
+
+                # a check still running is not started again
+                if i not in busy:
+                    task = loop.create_task(self.check(check))
+                    running.add(task)
+                    busy.add(i)
+                    task.add_done_callback(lambda task, i=i: done(task, i))
+
+                interval = check.inter * (1 + self.spread * (2 * random.random() - 1))
+                heapq.heappush(due, (max(when + interval, loop.time()), i))
+
+            if running:
+                await asyncio.gather(*running)
+
+        finally:
+            for task in running:
+                task.cancel()
+
+            self.close()
+
+    def run(self, duration=None):
+        asyncio.run(self.run_async(duration))
+
+    def close(self):
+        for check in self.checks:
+            check.close()
+
+        self._semaphore = None
@@ -0,0 +1,401 @@
+# coding=utf-8
+import collections
+import gzip
+import os
+import re
+
+try:
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+except ImportError:
+    ProcessPoolExecutor = None
+
+from haproxy_objects import AttributeState
+from haproxy_stats import config_object
+
+HTTP_TIMERS = ('Tq', 'Tw', 'Tc', 'Tr', 'Tt')
+TCP_TIMERS = ('Tw', 'Tc', 'Tt')
+
+# the client address is left out, searching from the " [" of the date is much
+# faster than from the start of the line
+#
+# option httplog:
+# 10.0.1.2:33317 [06/Feb/2009:12:14:14.655] http-in static/srv1 10/0/30/69/109 200 2750 - - ---- ...
+HTTP_LINE_RE = re.compile(
+    r' \[[^\]]+\] (\S+) ([^/\s]+)/(\S+) (-?\d+)/(-?\d+)/(-?\d+)/(-?\d+)/\+?(-?\d+) (-?\d+) \+?(\d+) \S+ \S+ (\S{4}) ')
+
+# option tcplog:
+# 10.0.1.2:33313 [06/Feb/2009:12:12:51.443] fnt bck/srv1 0/0/5007 212 -- 0/0/0/0/3 0/0
+TCP_LINE_RE = re.compile(
+    r' \[[^\]]+\] (\S+) ([^/\s]+)/(\S+) (-?\d+)/(-?\d+)/\+?(-?\d+) \+?(\d+) (\S{2}) ')
+
+LogRecord = collections.namedtuple('LogRecord', ('mode', 'frontend', 'backend', 'server', 'Tq', 'Tw', 'Tc', 'Tr',
+                                                 'Tt', 'status', 'bytes', 'termination'))
+
+
+def parse_line(line):
+    """
+    The LogRecord of an HTTP or TCP log line, None for other lines. Timers
+    haproxy logs as -1 are None, as are the HTTP only fields of TCP lines.
+    """
+    match = HTTP_LINE_RE.search(line)
+    if match is not None:
+        frontend, backend, server, tq, tw, tc, tr, tt, status, size, termination = match.groups()
+        return LogRecord('http', frontend.rstrip('~'), backend, server, _timer(tq), _timer(tw), _timer(tc),
+                         _timer(tr), _timer(tt), int(status), int(size), termination)
+
+    match = TCP_LINE_RE.search(line)
+    if match is not None:
+        frontend, backend, server, tw, tc, tt, size, termination = match.groups()
+        return LogRecord('tcp', frontend.rstrip('~'), backend, server, None, _timer(tw), _timer(tc), None,
+                         _timer(tt), None, int(size), termination)
+
+    return None
+
+
+def _timer(value):
+    value = int(value)
+    return value if value >= 0 else None
+
+
+def open_log(path):
+    """
+    Open a log file for reading text, gzip compressed ones (.gz) included.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', errors='replace')
+
+    return open(path, 'r', errors='replace')
+
+
+def read_lines(path, start=0, end=None):
+    """
+    Yield the lines of path that start within the byte range [start, end), so
+    that ranges splitting a file share out its lines exactly once. Ranges of
+    gzip files are not supported, they are read whole.
+    """
+    if path.endswith('.gz') or (start == 0 and end is None):
+        with open_log(path) as handler:
+            for line in handler:
+                yield line
+        return
+
+    with open(path, 'rb') as handler:
+        position = start
+        if start:
+            handler.seek(start - 1)
+            position = start - 1 + len(handler.readline())
+
+        for line in handler:
+            if end is not None and position >= end:
+                break
+
+            position += len(line)
+            yield line.decode('utf-8', 'replace')
+
+
+def iter_records(lines):
+    """
+    Yield the LogRecord of every log line of lines, skipping the others.
+    """
+    for line in lines:
+        record = parse_line(line)
+        if record is not None:
+            yield record
+
+
+class LatencyHistogram(object):
+    """
+    Counts of millisecond values in buckets whose width grows with the value,
+    16 per power of two, so percentiles are within about 3% of the exact ones
+    whatever the range. Histograms merge by adding counts, which lets workers
+    build them apart.
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def __getstate__(self):
+        return self.counts, self.count, self.total, self.max
+
+    def __setstate__(self, state):
+        self.counts, self.count, self.total, self.max = state
+
+    @staticmethod
+    def bucket(value):
+        if value < 32:
+            return value
+
+        shift = value.bit_length() - 5
+        return (shift << 4) + (value >> shift)
+
+    @staticmethod
+    def bucket_value(bucket):
+        """
+        The middle of the values counted in bucket.
+        """
+        if bucket < 32:
+            return bucket
+
+        shift = (bucket >> 4) - 1
+        low = (bucket - (shift << 4)) << shift
+        return low + ((1 << shift) - 1) // 2
+
+    def add(self, value, count=1):
+        bucket = self.bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += count
+        self.total += value * count
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        counts = self.counts
+        for bucket, count in other.counts.items():
+            counts[bucket] = counts.get(bucket, 0) + count
+
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+
+        rank = max(1, int(round(self.count * percent / 100.0)))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.bucket_value(bucket), self.max)
+
+        return self.max
+
+    def mean(self):
+        return self.total / float(self.count) if self.count else None
+
+    def __dict__(self):
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max if self.count else None,
+        }
+
+
+class LogStats(AttributeState):
+    """
+    Requests, bytes, status codes, termination states and timer histograms
+    of the log lines of one frontend, backend or server.
+    """
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.status = {}
+        self.termination = {}
+        self.timers = dict((name, LatencyHistogram()) for name in HTTP_TIMERS)
+        super(LogStats, self).__init__()
+
+    def add(self, record):
+        self.requests += 1
+        self.bytes += record.bytes
+
+        if record.status is not None:
+            self.status[record.status] = self.status.get(record.status, 0) + 1
+
+        self.termination[record.termination] = self.termination.get(record.termination, 0) + 1
+
+        timers = self.timers
+        for name, value in zip(HTTP_TIMERS, record[4:9]):
+            if value is not None:
+                timers[name].add(value)
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.bytes += other.bytes
+
+        for code, count in other.status.items():
+            self.status[code] = self.status.get(code, 0) + count
+
+        for state, count in other.termination.items():
+            self.termination[state] = self.termination.get(state, 0) + count
+
+        for name, histogram in other.timers.items():
+            self.timers[name].merge(histogram)
+
+    def __dict__(self):
+        out = {
+            'requests': self.requests,
+            'bytes': self.bytes,
+            'status': dict(self.status),
+            'termination': dict(self.termination),
+        }
+        for name, histogram in self.timers.items():
+            out[name] = histogram.__dict__()
+
+        return out
+
+
+class LogAggregate(object):
+    """
+    LogStats per (frontend, backend, server) of parsed log lines, rolled up to
+    the (pxname, svname) keys of show stat by stats(): (frontend, 'FRONTEND'),
+    (backend, 'BACKEND') and (backend, server).
+    """
+    def __init__(self):
+        self.routes = {}
+        self.lines = 0
+        self.unparsed = 0
+        super(LogAggregate, self).__init__()
+
+    def add_lines(self, lines):
+        """
+        Parse and count lines. Timers are counted by their text while reading
+        and turned into histograms at the end, most lines repeat values.
+        """
+        counts = {}
+        http_search = HTTP_LINE_RE.search
+        tcp_search = TCP_LINE_RE.search
+        lines_count = 0
+        unparsed = 0
+
+        for line in lines:
+            lines_count += 1
+
+            match = http_search(line)
+            if match is not None:
+                frontend, backend, server, tq, tw, tc, tr, tt, status, size, termination = match.groups()
+                timers = (tq, tw, tc, tr, tt)
+
+            else:
+                match = tcp_search(line)
+                if match is None:
+                    unparsed += 1
+                    continue
+
+                frontend, backend, server, tw, tc, tt, size, termination = match.groups()
+                timers = ('-1', tw, tc, '-1', tt)
+                status = None
+
+            key = (frontend, backend, server)
+            route = counts.get(key)
+            if route is None:
+                route = counts[key] = [0, 0, {}, {}, {}, {}, {}, {}, {}]
+
+            route[0] += 1
+            route[1] += int(size)
+            route[2][status] = route[2].get(status, 0) + 1
+            route[3][termination] = route[3].get(termination, 0) + 1
+            for values, value in zip(route[4:], timers):
+                values[value] = values.get(value, 0) + 1
+
+        for (frontend, backend, server), route in counts.items():
+            stats = LogStats()
+            stats.requests, stats.bytes = route[0], route[1]
+            stats.status = dict((int(code), count) for code, count in route[2].items() if code is not None)
+            stats.termination = route[3]
+
+            for name, values in zip(HTTP_TIMERS, route[4:]):
+                histogram = stats.timers[name]
+                for value, count in values.items():
+                    value = int(value)
+                    if value >= 0:
+                        histogram.add(value, count)
+
+            key = (frontend.rstrip('~'), backend, server)
+            if key in self.routes:
+                self.routes[key].merge(stats)
+            else:
+                self.routes[key] = stats
+
+        self.lines += lines_count
+        self.unparsed += unparsed
+        return self
+
+    def merge(self, other):
+        for key, stats in other.routes.items():
+            mine = self.routes.get(key)
+            if mine is None:
+                mine = self.routes[key] = LogStats()
+
+            mine.merge(stats)
+
+        self.lines += other.lines
+        self.unparsed += other.unparsed
+        return self
+
+    def stats(self):
+        """
+        LogStats keyed by (pxname, svname) like StatSnapshot rows.
+        """
+        out = {}
+        for (frontend, backend, server), stats in self.routes.items():
+            for key in ((frontend, 'FRONTEND'), (backend, 'BACKEND'), (backend, server)):
+                total = out.get(key)
+                if total is None:
+                    total = out[key] = LogStats()
+
+                total.merge(stats)
+
+        return out
+
+    def join(self, config):
+        """
+        Yield (key, stats, obj) for every key of stats(), obj being the config
+        object with the same name as in StatSnapshot.join, or None.
+        """
+        for key, stats in self.stats().items():
+            yield key, stats, config_object(config, key)
+
+
+def _analyze_chunk(chunk):
+    path, start, end = chunk
+    return LogAggregate().add_lines(read_lines(path, start, end))
+
+
+def split_logs(paths, chunk_size=64 << 20):
+    """
+    (path, start, end) byte ranges of about chunk_size covering paths, gzip
+    files as a single range as they can't be read from an offset.
+    """
+    chunks = []
+    for path in paths:
+        size = os.path.getsize(path)
+        if path.endswith('.gz') or size <= chunk_size:
+            chunks.append((path, 0, None))
+            continue
+
+        for start in range(0, size, chunk_size):
+            chunks.append((path, start, min(start + chunk_size, size)))
+
+    return chunks
+
+
+def analyze_logs(paths, processes=None, chunk_size=64 << 20):
+    """
+    Parse log files, rotated and gzip compressed ones included, in a process
+    pool by chunks of the files and return their merged LogAggregate.
+    processes=1 parses in this process.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+
+    chunks = split_logs(paths, chunk_size)
+    aggregate = LogAggregate()
+
+    if ProcessPoolExecutor is None or processes == 1 or len(chunks) < 2:
+        for chunk in chunks:
+            aggregate.merge(_analyze_chunk(chunk))
+
+        return aggregate
+
+    with ProcessPoolExecutor(processes) as executor:
+        for future in as_completed([executor.submit(_analyze_chunk, chunk) for chunk in chunks]):
+            aggregate.merge(future.result())
+
+    return aggregate
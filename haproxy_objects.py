@@ -1,157 +1,1248 @@
 # coding=utf-8
+import abc
+import hashlib
+import io
 import os
+import pickle
+import re
+import struct
+import tempfile
+import time
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+
+PART_NAMES = ('global', 'defaults', 'listen', 'frontend', 'backend')
+PART_TABLES = {'listen': 'listens', 'frontend': 'frontends', 'backend': 'backends'}
+
+# Bump SNAPSHOT_VERSION whenever the attributes of the config classes change,
+# older snapshots are then ignored and the source is parsed again.
+SNAPSHOT_MAGIC = b'HPXSNAP'
+SNAPSHOT_VERSION = 4
+SNAPSHOT_HEADER = struct.Struct('>7sH20s')
+# stamped on snapshots of configs that differ from their source, no file hashes to it
+STALE_DIGEST = b'\0' * 20
+
+# the start of every line that Config._iter_parts would take for a section header
+PART_HEADER_RE = re.compile(r'^[^\S\n]*(?:%s)[^\n]*' % '|'.join(PART_NAMES), re.M)
 
 
 class ConfigIsInvalid(Exception):
     pass
 
 
-class Config(object):
+class ConfigChange(object):
+    """
+    One difference between two configs.
+
+    action - 'add', 'remove' or 'change'
+    section - 'global', 'defaults', 'frontend', 'backend' or 'listen'
+    name - the frontend, backend or listen name
+    server - the server name for changes of a server
+    field - the changed attribute, as named by the __dict__() exports
+    key - the entry of a dict attribute such as option, acl or use_backend
+    old, new - the values before and after, whole objects for added and
+    removed sections and servers
+    """
+    __slots__ = ('action', 'section', 'name', 'server', 'field', 'key', 'old', 'new')
+
+    def __init__(self, action, section, name=None, server=None, field=None, key=None, old=None, new=None):
+        self.action = action
+        self.section = section
+        self.name = name
+        self.server = server
+        self.field = field
+        self.key = key
+        self.old = old
+        self.new = new
+        super(ConfigChange, self).__init__()
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, ConfigChange) and self._values() == other._values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        path = '/'.join(str(part) for part in (self.section, self.name, self.server, self.field, self.key)
+                        if part is not None)
+        return '<ConfigChange %s %s %r -> %r>' % (self.action, path, self.old, self.new)
+
+
+def _diff_fields(changes, section, name, server, old_fields, new_fields):
+    for field in new_fields:
+        if field == 'server':
+            continue
+
+        old = old_fields.get(field)
+        new = new_fields[field]
+        if old == new:
+            continue
+
+        if isinstance(old, dict) and isinstance(new, dict):
+            for key in old:
+                if key not in new:
+                    changes.append(ConfigChange('remove', section, name, server, field, key, old=old[key]))
+
+            for key in new:
+                if key not in old:
+                    changes.append(ConfigChange('add', section, name, server, field, key, new=new[key]))
+
+                elif old[key] != new[key]:
+                    changes.append(ConfigChange('change', section, name, server, field, key, old[key], new[key]))
+
+        else:
+            changes.append(ConfigChange('change', section, name, server, field, old=old, new=new))
+
+
+def _diff_section(changes, section, name, old, new):
+    if old is new:
+        return
+
+    _diff_fields(changes, section, name, None, old.__dict__(), new.__dict__())
+
+    old_servers = getattr(old, 'server', None)
+    new_servers = getattr(new, 'server', None)
+    if old_servers is None or new_servers is None:
+        return
+
+    for server_name in old_servers:
+        if server_name not in new_servers:
+            changes.append(ConfigChange('remove', section, name, server_name, old=old_servers[server_name]))
+
+    for server_name in new_servers:
+        new_server = new_servers[server_name]
+        old_server = old_servers.get(server_name)
+
+        if old_server is None:
+            changes.append(ConfigChange('add', section, name, server_name, new=new_server))
+
+        elif old_server is not new_server:
+            _diff_fields(changes, section, name, server_name, old_server.__dict__(), new_server.__dict__())
+
+
+def write_lines(fp, lines):
+    """
+    Write lines separated by newlines to fp, without a trailing newline.
+    """
+    lines = iter(lines)
+
+    for line in lines:
+        fp.write(line)
+        break
+
+    for line in lines:
+        fp.write('\n')
+        fp.write(line)
+
+
+# acl names haproxy defines by itself
+PREDEFINED_ACLS = ('FALSE', 'HTTP', 'HTTP_1.0', 'HTTP_1.1', 'HTTP_CONTENT', 'HTTP_URL_ABS', 'HTTP_URL_SLASH',
+                   'HTTP_URL_STAR', 'LOCALHOST', 'METH_CONNECT', 'METH_DELETE', 'METH_GET', 'METH_HEAD',
+                   'METH_OPTIONS', 'METH_POST', 'METH_PUT', 'METH_TRACE', 'RDP_COOKIE', 'REQ_CONTENT', 'TRUE',
+                   'WAIT_END')
+
+
+def condition_acls(conditions):
+    """
+    The acl names a use_backend condition refers to, without negations,
+    operators and anonymous {} acls.
+    """
+    names = []
+    depth = 0
+
+    for token in conditions:
+        if token == '{':
+            depth += 1
+
+        elif token == '}':
+            depth -= 1
+
+        elif not depth and token not in ('or', '||', '&&'):
+            names.append(token.lstrip('!'))
+
+    return [name for name in names if name]
+
+
+class _LazySection(abc.ABC):
+    """
+    A section kept in a SectionTable before it is needed, turned into the
+    section object by load() on first access.
+    """
+    __slots__ = ()
+
+    @abc.abstractmethod
+    def load(self):
+        pass
+
+
+class _PickledSection(_LazySection):
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+        super(_PickledSection, self).__init__()
+
+    def load(self):
+        return pickle.loads(self.data)
+
+
+class _TextSection(_LazySection):
+    """
+    A section of a lazily loaded config, the text from its header up to the
+    next header, parsed on first access and copied through as it is when the
+    config is rendered before that.
+    """
+    __slots__ = ('config_class', 'text', 'start', 'end')
+
+    def __init__(self, config_class, text, start, end):
+        self.config_class = config_class
+        self.text = text
+        self.start = start
+        self.end = end
+        super(_TextSection, self).__init__()
+
+    def source_lines(self):
+        source = self.text[self.start:self.end]
+        if source.endswith('\n'):
+            source = source[:-1]
+
+        return source.split('\n')
+
+    def load(self):
+        for part_name, parts, part_lines in self.config_class._iter_parts(self.source_lines()):
+            return self.config_class._parse_part(part_name, parts, part_lines)
+
+
+class SectionTable(dict):
+    """
+    The frontends, backends or listens of a Config keyed by name. Every change
+    made through the dict is passed to the listeners as
+    listener(part_name, name, old, new), old or new being None when the section
+    is added or removed.
+
+    Sections may be stored lazily and are only loaded when read through
+    [], get(), values(), items() or pop(), which is why values() and items()
+    return lists.
+    """
+    def __init__(self, part_name, *args, **kwargs):
+        super(SectionTable, self).__init__()
+        self.part_name = part_name
+        self.listeners = []
+        self.update(*args, **kwargs)
+
+    def __reduce__(self):
+        return self.__class__, (self.part_name, dict(self))
+
+    def _notify(self, name, old, new):
+        for listener in self.listeners:
+            listener(self.part_name, name, old, new)
+
+    def _load(self, name, section):
+        if isinstance(section, _LazySection):
+            section = section.load()
+            super(SectionTable, self).__setitem__(name, section)
+
+        return section
+
+    def __getitem__(self, name):
+        return self._load(name, super(SectionTable, self).__getitem__(name))
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+
+        return default
+
+    def stored(self, name):
+        """
+        The section stored under name, without loading it if it is still lazy.
+        """
+        return super(SectionTable, self).__getitem__(name)
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def __setitem__(self, name, section):
+        # the replaced section is only loaded for the listeners
+        old = self.get(name) if self.listeners else None
+        super(SectionTable, self).__setitem__(name, section)
+        self._notify(name, old, section)
+
+    def __delitem__(self, name):
+        old = self[name]
+        super(SectionTable, self).__delitem__(name)
+        self._notify(name, old, None)
+
+    def pop(self, name, *default):
+        if name not in self:
+            return super(SectionTable, self).pop(name, *default)
+
+        old = self[name]
+        super(SectionTable, self).__delitem__(name)
+        self._notify(name, old, None)
+        return old
+
+    def popitem(self):
+        name, old = super(SectionTable, self).popitem()
+        old = self._load(name, old)
+        super(SectionTable, self).pop(name, None)
+        self._notify(name, old, None)
+        return name, old
+
+    def setdefault(self, name, section=None):
+        if name not in self:
+            self[name] = section
+
+        return self[name]
+
+    def update(self, *args, **kwargs):
+        for name, section in dict(*args, **kwargs).items():
+            self[name] = section
+
+    def clear(self):
+        while self:
+            self.popitem()
+
+    def copy(self):
+        return self.__class__(self.part_name, self)
+
+
+class RoutingGraph(object):
+    """
+    Which backends every frontend can send traffic to and which frontends refer
+    to every backend, through use_backend and default_backend. The graph is
+    built once and then follows the frontends and backends added to or
+    removed from the config. A frontend changed in place has to be passed to
+    refresh().
+
+    The sets returned by the queries are the graph's own, don't modify them.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.frontend_backends = {}
+        self.frontend_acls = {}
+        self.frontend_undefined_acls = {}
+        self.backend_frontends = {}
+        self.orphans = set()
+        self.undefined_backends = set()
+
+        for name in config.backends:
+            self._add_backend(name)
+
+        for name in config.frontends:
+            self._add_frontend(name, config.frontends[name])
+
+        config.frontends.listeners.append(self._on_change)
+        config.backends.listeners.append(self._on_change)
+        config.listens.listeners.append(self._on_change)
+        super(RoutingGraph, self).__init__()
+
+    def _is_defined(self, backend):
+        return backend in self.config.backends or backend in self.config.listens
+
+    def _add_backend(self, name):
+        self.undefined_backends.discard(name)
+        if not self.backend_frontends.get(name):
+            self.orphans.add(name)
+
+    def _remove_backend(self, name):
+        self.orphans.discard(name)
+        if self.backend_frontends.get(name) and not self._is_defined(name):
+            self.undefined_backends.add(name)
+
+    def _add_frontend(self, name, frontend):
+        backends = set(frontend.use_backend)
+        if frontend.default_backend:
+            backends.add(frontend.default_backend)
+
+        acls = set(frontend.acl)
+        undefined = set()
+        for conditions_list in frontend.use_backend.values():
+            for conditions in conditions_list:
+                for acl_name in condition_acls(conditions):
+                    if acl_name not in acls and acl_name not in PREDEFINED_ACLS:
+                        undefined.add(acl_name)
+
+        self.frontend_backends[name] = backends
+        self.frontend_acls[name] = acls
+        self.frontend_undefined_acls[name] = undefined
+
+        for backend in backends:
+            self.backend_frontends.setdefault(backend, set()).add(name)
+            self.orphans.discard(backend)
+            if not self._is_defined(backend):
+                self.undefined_backends.add(backend)
+
+    def _remove_frontend(self, name):
+        del self.frontend_acls[name]
+        del self.frontend_undefined_acls[name]
+
+        for backend in self.frontend_backends.pop(name):
+            frontends = self.backend_frontends[backend]
+            frontends.discard(name)
+
+            if not frontends:
+                del self.backend_frontends[backend]
+                self.undefined_backends.discard(backend)
+                if backend in self.config.backends:
+                    self.orphans.add(backend)
+
+    def _on_change(self, part_name, name, old, new):
+        if part_name == 'frontend':
+            if old is not None:
+                self._remove_frontend(name)
+
+            if new is not None:
+                self._add_frontend(name, new)
+
+        elif new is None:
+            if part_name == 'backend':
+                self._remove_backend(name)
+
+            elif self.backend_frontends.get(name) and not self._is_defined(name):
+                self.undefined_backends.add(name)
+
+        elif old is None:
+            if part_name == 'backend':
+                self._add_backend(name)
+
+            else:
+                self.undefined_backends.discard(name)
+
+    def refresh(self, name):
+        """
+        Re-read a frontend that was changed in place.
+        """
+        self._remove_frontend(name)
+        self._add_frontend(name, self.config.frontends[name])
+
+    def frontends_of(self, backend):
+        """
+        The frontends that can send traffic to backend.
+        """
+        return self.backend_frontends.get(backend, frozenset())
+
+    def backends_of(self, frontend):
+        return self.frontend_backends.get(frontend, frozenset())
+
+    def is_orphan(self, backend):
+        """
+        Whether backend is defined but no frontend refers to it.
+        """
+        return backend in self.orphans
+
+    def undefined_acls(self, frontend):
+        """
+        The acl names the use_backend rules of frontend use without defining them.
+        """
+        return self.frontend_undefined_acls.get(frontend, frozenset())
+
+
+class SectionCache(object):
+    """
+    Parsed sections keyed by a fingerprint of their source text, so re-reading a
+    config only runs from_string for the sections that changed since the last
+    load. Unchanged sections are handed back as the same objects, so a Config
+    loaded through a cache must not be modified in place.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._sections = {}
+        self._seen = {}
+
+    @staticmethod
+    def fingerprint(parts, part_lines):
+        text = ' '.join(parts) + '\n' + '\n'.join(part_lines)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        section = self._sections.get(key)
+
+        if section is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._seen[key] = section
+
+        return section
+
+    def put(self, key, section):
+        self._seen[key] = section
+
+    def sweep(self):
+        """
+        Forget the sections that were not part of the last load.
+        """
+        self._sections = self._seen
+        self._seen = {}
+
+
+class AttributeState(object):
+    """
+    Pickling of the classes whose __dict__ is taken by the export method. The
+    instance attributes are read through the __dict__ descriptor of this base,
+    which subclasses don't replace, object.__getstate__ is only there from
+    Python 3.11.
+    """
+    def __getstate__(self):
+        return dict(_instance_dict(self))
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
+_instance_dict = AttributeState.__dict__['__dict__'].__get__
+
+
+class Config(AttributeState):
     def __init__(self):
         self.globals = GlobalConfig()
         self.defaults = DefaultConfig()
-        self.frontends = {}
-        self.backends = {}
-        self.listens = {}
+        self.frontends = SectionTable('frontend')
+        self.backends = SectionTable('backend')
+        self.listens = SectionTable('listen')
+        # sha1 of the file bytes from_string parsed
+        self.source_digest = None
+        self._routes = None
         super(Config, self).__init__()
 
-    @classmethod
-    def _read_to_next_part(cls, lines):
-        _lines = []
-
-        i = 0
-        while i < len(lines):
-            line = lines[i].partition('#')[0].strip()
-            if line.startswith('global') or line.startswith('listen') or \
-                    line.startswith('defaults') or line.startswith('frontend') or \
-                    line.startswith('backend'):
-                break
-
-            if not line.startswith('#'):
-                _lines.append(line)
-            i += 1
+    def __getstate__(self):
+        state = super(Config, self).__getstate__()
+        state['_routes'] = None
+        return state
+
+    @property
+    def routes(self):
+        """
+        The RoutingGraph of this config, built on first use and then updated as
+        frontends and backends are added or removed.
+        """
+        if self._routes is None:
+            self._routes = RoutingGraph(self)
+
+        return self._routes
+
+    @classmethod
+    def _iter_parts(cls, lines):
+        """
+        Walk the lines once and yield (part_name, header_parts, part_lines) for
+        every section. part_lines are the comment-stripped lines of the section
+        body; anything between an unknown header and the next section is dropped.
+        """
+        part = None
+
+        for line in lines:
+            line = line.partition('#')[0].strip()
+
+            if line.startswith(PART_NAMES):
+                if part is not None:
+                    yield part
+
+                parts = line.split()
+                if parts[0] in PART_NAMES:
+                    part = (parts[0], parts, [])
+                else:
+                    part = None
+
+            elif part is not None:
+                part[2].append(line)
+
+        if part is not None:
+            yield part
+
+    @classmethod
+    def _parse_part(cls, part_name, parts, part_lines):
+        if part_name == 'global':
+            section = GlobalConfig()
+
+        elif part_name == 'defaults':
+            section = DefaultConfig()
+
+        else:
+            if part_name == 'listen':
+                section = ListenConfig()
+
+            elif part_name == 'frontend':
+                section = FrontendConfig()
+
+            else:
+                section = BackendConfig()
+
+            if part_name != 'backend' and len(parts) == 3:
+                part_lines.insert(0, 'bind %s' % parts[2])
+
+            section.name = parts[1]
+
+        section.from_string(part_lines)
+        return section
+
+    def _add_part(self, part_name, section):
+        if part_name == 'global':
+            self.globals = section
+
+        elif part_name == 'defaults':
+            self.defaults = section
+
+        elif part_name == 'listen':
+            self.listens[section.name] = section
+
+        elif part_name == 'frontend':
+            self.frontends[section.name] = section
+
+        elif part_name == 'backend':
+            self.backends[section.name] = section
+
+    @classmethod
+    def _iter_sections(cls, lines, cache=None):
+        for part_name, parts, part_lines in cls._iter_parts(lines):
+            if cache is None:
+                section = cls._parse_part(part_name, parts, part_lines)
+
+            else:
+                key = cache.fingerprint(parts, part_lines)
+                section = cache.get(key)
+
+                if section is None:
+                    section = cls._parse_part(part_name, parts, part_lines)
+                    cache.put(key, section)
+
+            yield part_name, section
+
+    @classmethod
+    def from_lines(cls, lines, cache=None):
+        c = cls()
+
+        for part_name, section in cls._iter_sections(lines, cache):
+            c._add_part(part_name, section)
+
+        if cache is not None:
+            cache.sweep()
+
+        return c
+
+    @classmethod
+    def from_text_lazy(cls, text):
+        """
+        Index the section headers of text in one scan and parse only global and
+        defaults, the frontends, backends and listens are parsed the first time
+        they are read from their table. Sections never read are rendered as
+        they are in text.
+        """
+        c = cls()
+        headers = [(match.start(), match.group().partition('#')[0].split())
+                   for match in PART_HEADER_RE.finditer(text)]
+        headers.append((len(text), None))
+
+        for i in range(len(headers) - 1):
+            start, parts = headers[i]
+            if parts[0] not in PART_NAMES:
+                continue
+
+            section = _TextSection(cls, text, start, headers[i + 1][0])
+            if parts[0] in ('global', 'defaults'):
+                c._add_part(parts[0], section.load())
+
+            else:
+                getattr(c, PART_TABLES[parts[0]])[parts[1]] = section
+
+        return c
+
+    @classmethod
+    def from_string(cls, filename, cache=None, lazy=False):
+        """
+        cache - a SectionCache shared between loads of the same file, only the
+        sections whose text changed since the previous load are parsed again
+        lazy - parse sections on first access, see from_text_lazy, the cache is
+        not used then
+        """
+        if not os.path.exists(filename):
+            raise ConfigIsInvalid('%s is not exist' % filename)
+
+        # the bytes are hashed as read, so the digest is the one of the text
+        # parsed even when the file changes meanwhile
+        with open(filename, 'rb') as handler:
+            data = handler.read()
+
+        with io.TextIOWrapper(io.BytesIO(data)) as handler:
+            if lazy:
+                c = cls.from_text_lazy(handler.read())
+            else:
+                c = cls.from_lines(handler, cache)
+
+        c.source_digest = hashlib.sha1(data).digest()
+        return c
+
+    @staticmethod
+    def _source_digest(source):
+        with open(source, 'rb') as handler:
+            return hashlib.sha1(handler.read()).digest()
+
+    def save_snapshot(self, path, source):
+        """
+        Store this config in a binary snapshot at path, stamped with the hash of
+        the source file. source is parsed again and the snapshot is only valid
+        while source holds this config: one edited since it was parsed, or a
+        file that changed since, gives a snapshot stamped as stale that
+        load_snapshot ignores. The snapshot is written to a temporary file
+        first, so readers never see a partial one.
+        """
+        parsed = self.from_string(source)
+        digest = STALE_DIGEST if self.diff(parsed) else parsed.source_digest
+
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, digest)
+        state = (self.globals, self.defaults, {})
+        for part_name, sections in (('frontend', self.frontends), ('backend', self.backends),
+                                    ('listen', self.listens)):
+            state[2][part_name] = [(name, pickle.dumps(section, pickle.HIGHEST_PROTOCOL))
+                                   for name, section in sections.items()]
+
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.snapshot-')
+
+        try:
+            with os.fdopen(fd, 'wb') as handler:
+                handler.write(header)
+                pickle.dump(state, handler, pickle.HIGHEST_PROTOCOL)
+                handler.flush()
+                os.fsync(handler.fileno())
+
+            os.replace(temp, path)
+
+        except:
+            os.unlink(temp)
+            raise
+
+    @classmethod
+    def load_snapshot(cls, path, source):
+        """
+        Load the config saved by save_snapshot, or parse source when the snapshot
+        is missing, was written by another snapshot version or the source changed
+        since. Frontends, backends and listens are stored one by one and only
+        unpickled when first read. Snapshots are pickles, only load the ones
+        written by yourself.
+        """
+        if not os.path.exists(source):
+            raise ConfigIsInvalid('%s is not exist' % source)
+
+        try:
+            with open(path, 'rb') as handler:
+                magic, version, digest = SNAPSHOT_HEADER.unpack(handler.read(SNAPSHOT_HEADER.size))
+
+                if magic == SNAPSHOT_MAGIC and version == SNAPSHOT_VERSION and digest == cls._source_digest(source):
+                    state = pickle.load(handler)
+
+                    c = cls()
+                    c.globals, c.defaults, parts = state
+                    for part_name, sections in (('frontend', c.frontends), ('backend', c.backends),
+                                                ('listen', c.listens)):
+                        for name, data in parts[part_name]:
+                            sections[name] = _PickledSection(data)
+
+                    c.source_digest = digest
+                    return c
+
+        except (OSError, struct.error, pickle.UnpicklingError, EOFError):
+            # a missing, truncated or corrupted snapshot, the source is parsed
+            pass
+
+        return cls.from_string(source)
+
+    @classmethod
+    def from_files(cls, paths):
+        """
+        Load a config split over several files or conf.d directories, see
+        ConfigLoader to keep the parsed files between loads.
+        """
+        return ConfigLoader(paths, cls).load()
+
+    @classmethod
+    def _iter_part_lines(cls, header, section):
+        yield header
+
+        empty = True
+        for line in section.iter_lines():
+            empty = False
+            yield '\t' + line
+
+        if empty:
+            yield '\t'
+
+        yield '\n'
+
+    def iter_lines(self, sort_sections=False):
+        """
+        Yield the rendered config line by line, without line endings.
+
+        sort_sections - render frontends, backends and listens ordered by name
+        instead of in the order they were added, so that configs holding the
+        same sections render the same text. What is inside a section keeps
+        its order, the order of use_backend rules and servers matters.
+        """
+        yield '# created by haproxy-tool'
+        yield ''
+
+        for line in self._iter_part_lines('global', self.globals):
+            yield line
+
+        for line in self._iter_part_lines('defaults', self.defaults):
+            yield line
+
+        for part_name in ('frontend', 'backend', 'listen'):
+            sections = getattr(self, PART_TABLES[part_name])
+
+            for name in (sorted(sections) if sort_sections else sections):
+                section = sections.stored(name)
+                if isinstance(section, _TextSection):
+                    lines = section.source_lines()
+                else:
+                    lines = self._iter_part_lines('%s %s' % (part_name, name), sections[name])
+
+                for line in lines:
+                    yield line
+
+    def to_string(self):
+        return '\n'.join(self.iter_lines())
+
+    def write(self, fp):
+        """
+        Stream the rendered config to a file like object, the written text is
+        the same as to_string().
+        """
+        write_lines(fp, self.iter_lines())
+
+    def save(self, filename, sort_sections=True):
+        """
+        Render the config next to filename and move it over filename only when
+        the text differs from what the file holds, so that the file is never
+        seen half written and is left untouched when nothing changed. The mode
+        of an existing file is kept.
+
+        Returns True when filename was written, which is when haproxy needs a
+        reload.
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, temp = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(filename))
+
+        try:
+            with os.fdopen(fd, 'w') as handler:
+                write_lines(handler, self.iter_lines(sort_sections))
+                handler.flush()
+
+                try:
+                    current = os.stat(filename)
+                except OSError:
+                    current = None
+
+                unchanged = current is not None and current.st_size == os.fstat(handler.fileno()).st_size and \
+                    self._source_digest(filename) == self._source_digest(temp)
+
+                # only a file that replaces filename has to reach the disk
+                if not unchanged:
+                    os.fsync(handler.fileno())
+
+            if unchanged:
+                os.unlink(temp)
+                return False
+
+            os.chmod(temp, current.st_mode & 0o7777 if current is not None else 0o644)
+            os.replace(temp, filename)
+            _fsync_directory(directory)
+
+        except:
+            if os.path.exists(temp):
+                os.unlink(temp)
+            raise
+
+        return True
+
+    def diff(self, other):
+        """
+        List the ConfigChange needed to turn this config into other. Sections and
+        servers are matched by name and only their fields are compared, sections
+        shared by both configs (as returned by a SectionCache) are skipped.
+        """
+        changes = []
+        _diff_section(changes, 'global', None, self.globals, other.globals)
+        _diff_section(changes, 'defaults', None, self.defaults, other.defaults)
+
+        for section, old_sections, new_sections in (('frontend', self.frontends, other.frontends),
+                                                    ('backend', self.backends, other.backends),
+                                                    ('listen', self.listens, other.listens)):
+            for name in old_sections:
+                if name not in new_sections:
+                    changes.append(ConfigChange('remove', section, name, old=old_sections[name]))
+
+            for name in new_sections:
+                if name not in old_sections:
+                    changes.append(ConfigChange('add', section, name, new=new_sections[name]))
+
+                else:
+                    _diff_section(changes, section, name, old_sections[name], new_sections[name])
+
+        return changes
+
+    def __dict__(self):
+        out = {
+            'global': self.globals.__dict__(),
+            'defaults': self.defaults.__dict__(),
+            'frontend': {},
+            'backend': {},
+            'listen': {}
+        }
+        for key in self.frontends:
+            out['frontend'][key] = self.frontends[key].__dict__()
+
+        for key in self.backends:
+            out['backend'][key] = self.backends[key].__dict__()
+
+        for key in self.listens:
+            out['listen'][key] = self.listens[key].__dict__()
+
+        return out
+
+
+# the ParseProfile that is recording, checked once per parsed section and server
+_profile = None
+
+
+class ParseProfile(object):
+    """
+    Counts and times of what the sections parse, per section class and per
+    directive keyword, with the keywords no directive handles. Recording is
+    enabled for the duration of a with block, or between enable() and
+    disable(), for every parse in the process:
+
+        with ParseProfile() as profile:
+            Config.from_string('haproxy.cfg')
+        print(profile.to_string())
+
+    The time of a section includes the time of its directives, the time of a
+    server directive includes the server keywords. Unknown server tokens
+    include the arguments of unknown keywords.
+    """
+    def __init__(self):
+        self.sections = {}
+        self.directives = {}
+        self.unknown = {}
+        self._previous = None
+        super(ParseProfile, self).__init__()
+
+    def enable(self):
+        global _profile
+        self._previous = _profile
+        _profile = self
+
+    def disable(self):
+        global _profile
+        _profile = self._previous
+        self._previous = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def _record(self, kind, key, seconds):
+        stats = self.directives.get((kind, key))
+        if stats is None:
+            stats = self.directives[(kind, key)] = [0, 0.0]
+
+        stats[0] += 1
+        stats[1] += seconds
+
+    def _record_unknown(self, kind, key):
+        self.unknown[(kind, key)] = self.unknown.get((kind, key), 0) + 1
+
+    def _timed(self, kind, key, handler):
+        clock = time.perf_counter
+
+        def timed(*args):
+            start = clock()
+            result = handler(*args)
+            self._record(kind, key, clock() - start)
+            return result
+
+        return timed
+
+    def parse_section(self, section, lines):
+        """
+        SectionConfig.from_string with recording.
+        """
+        kind = section.__class__.__name__
+        start = time.perf_counter()
+        section._parse_lines(lines, _ProfiledDirectives(self, kind, section.directives))
+
+        stats = self.sections.get(kind)
+        if stats is None:
+            stats = self.sections[kind] = [0, 0.0, 0]
+
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+        stats[2] += len(lines)
+
+    def parse_server(self, server, args, i):
+        """
+        ServerConfig._parse_directives with recording.
+        """
+        directives = _ProfiledDirectives(self, server.__class__.__name__, server.directives)
+        return server._parse_directives(args, i, directives)
+
+    def __dict__(self):
+        return {
+            'sections': dict((kind, {'count': count, 'seconds': seconds, 'lines': lines})
+                             for kind, (count, seconds, lines) in self.sections.items()),
+            'directives': dict(('%s %s' % key, {'count': count, 'seconds': seconds})
+                               for key, (count, seconds) in self.directives.items()),
+            'unknown': dict(('%s %s' % key, count) for key, count in self.unknown.items()),
+        }
+
+    def iter_lines(self):
+        yield '%-32s %10s %12s' % ('section', 'count', 'ms')
+        for kind, (count, seconds, lines) in sorted(self.sections.items(), key=lambda item: -item[1][1]):
+            yield '%-32s %10d %12.3f' % (kind, count, seconds * 1000)
+
+        yield ''
+        yield '%-32s %10s %12s' % ('directive', 'count', 'ms')
+        for key, (count, seconds) in sorted(self.directives.items(), key=lambda item: -item[1][1]):
+            yield '%-32s %10d %12.3f' % ('%s %s' % key, count, seconds * 1000)
+
+        if self.unknown:
+            yield ''
+            yield '%-32s %10s' % ('unknown', 'count')
+            for key, count in sorted(self.unknown.items(), key=lambda item: -item[1]):
+                yield '%-32s %10d' % ('%s %s' % key, count)
+
+    def to_string(self):
+        return '\n'.join(self.iter_lines())
+
+
+class _ProfiledDirectives(object):
+    """
+    A directives table as the parse loops see it while a ParseProfile records:
+    the handlers are timed and the unknown keywords counted.
+    """
+    __slots__ = ('profile', 'kind', 'directives')
+
+    def __init__(self, profile, kind, directives):
+        self.profile = profile
+        self.kind = kind
+        self.directives = directives
+
+    def get(self, key):
+        directive = self.directives.get(key)
+
+        if directive is None:
+            self.profile._record_unknown(self.kind, key)
+            return None
+
+        handler, arity = directive
+        return self.profile._timed(self.kind, key, handler), arity
+
+
+class SectionConfig(AttributeState):
+    """
+    Directives of a section are dispatched through the class level directives
+    table, keyword -> (handler, arity). handler(section, args) is called with the
+    tokens following the keyword once a line has at least arity of them, and
+    unknown keywords are ignored.
+    """
+    __slots__ = ()
+
+    directives = {}
+
+    @classmethod
+    def register_directive(cls, keyword, handler, arity=0):
+        if 'directives' not in vars(cls):
+            cls.directives = dict(cls.directives)
+
+        cls.directives[keyword] = (handler, arity)
+
+    def set_directive(self, key, args):
+        directive = self.directives.get(key)
+
+        if directive is not None:
+            handler, arity = directive
+            if len(args) < arity:
+                raise ConfigIsInvalid('%s config is invalid' % key)
+
+            handler(self, args)
+
+    def set_value(self, key, line):
+        self.set_directive(key, line.split())
+
+    def to_string(self):
+        return '\n'.join(self.iter_lines())
+
+    def write(self, fp):
+        write_lines(fp, self.iter_lines())
+
+    def from_string(self, lines):
+        if _profile is not None:
+            return _profile.parse_section(self, lines)
+
+        self._parse_lines(lines, self.directives)
+
+    def _parse_lines(self, lines, directives):
+        self._raw = lines
+
+        for line in lines:
+            parts = line.partition('#')[0].split()
+
+            if parts:
+                directive = directives.get(parts[0])
 
-        return _lines, i
+                if directive is not None:
+                    handler, arity = directive
+                    if len(parts) <= arity:
+                        raise ConfigIsInvalid('%s config is invalid' % parts[0])
 
-    @classmethod
-    def from_string(cls, filename):
-        if not os.path.exists(filename):
-            raise ConfigIsInvalid('%s is not exist' % filename)
+                    handler(self, parts[1:])
 
-        c = cls()
 
-        with open(filename, 'rb') as handler:
-            lines = handler.readlines()
+def _fsync_directory(directory):
+    # makes a rename into directory durable
+    fd = os.open(directory, os.O_RDONLY)
 
-            while lines:
-                line = lines[0].partition('#')[0].strip()
-                lines = lines[1:]
+    try:
+        os.fsync(fd)
 
-                if line and not line.startswith('#'):
-                    parts = line.split()
-                    part_name = parts[0]
+    finally:
+        os.close(fd)
 
-                    if part_name in ['global', 'defaults', 'listen', 'frontend', 'backend']:
-                        part_lines, _next_i = Config._read_to_next_part(lines)
 
-                        if part_name == 'global':
-                            c.globals = GlobalConfig()
-                            c.globals.from_string(part_lines)
+def _parse_file(config_class, filename, cache=None):
+    with open(filename, 'r') as handler:
+        parts = list(config_class._iter_sections(handler, cache))
 
-                        elif part_name == 'defaults':
-                            c.defaults = DefaultConfig()
-                            c.defaults.from_string(part_lines)
+    if cache is not None:
+        cache.sweep()
 
-                        elif part_name == 'listen':
-                            if len(parts) == 3:
-                                part_lines.insert(0, 'bind %s' % parts[2])
+    return parts
 
-                            l = ListenConfig()
-                            l.name = parts[1]
-                            l.from_string(part_lines)
-                            c.listens[parts[1]] = l
 
-                        elif part_name == 'frontend':
-                            if len(parts) == 3:
-                                part_lines.insert(0, 'bind %s' % parts[2])
+def _parse_file_cached(config_class, filename):
+    # the cache is returned with the sections in one pickle, so they stay the
+    # same objects when parsed in another process
+    cache = SectionCache()
+    return _parse_file(config_class, filename, cache), cache
 
-                            l = FrontendConfig()
-                            l.name = parts[1]
-                            l.from_string(part_lines)
-                            c.frontends[parts[1]] = l
 
-                        elif part_name == 'backend':
-                            l = BackendConfig()
-                            l.name = parts[1]
-                            l.from_string(part_lines)
-                            c.backends[parts[1]] = l
+class ConfigLoader(object):
+    """
+    Load a config split over several files and directories, in the order
+    haproxy reads them from several -f options: files as given, and the
+    non hidden *.cfg files of a directory in lexical order.
 
-                        lines = lines[_next_i:]
-                        continue
+    The sections parsed from every file are kept by (path, inode, mtime, size)
+    and a load only reads the files that changed since the previous one, in a
+    process pool when there are at least pool_threshold of them.
 
-        return c
+    With cache_sections every file also gets its own SectionCache, filled on
+    its first load, which runs in the pool as without it, and later loads of
+    a changed file only parse its changed sections again, in this process.
+    The first load costs a few percent more for the fingerprints, so only
+    cache sections with a loader that loads again, as ConfigWatcher does.
+    Sections of unchanged files are handed back as the same objects, so
+    configs loaded through a loader must not be modified in place.
+    """
+    def __init__(self, paths, config_class=Config, processes=None, pool_threshold=16, cache_sections=False):
+        if isinstance(paths, str):
+            paths = [paths]
 
-    def to_string(self):
-        lines = ['# created by haproxy-tool', '']
-        lines.append('global')
-        for line in self.globals.to_string().split('\n'):
-            lines.append('\t' + line)
+        self.paths = list(paths)
+        self.config_class = config_class
+        self.processes = processes
+        self.pool_threshold = pool_threshold
+        self.cache_sections = cache_sections
+        self._files = {}
+        self._caches = {}
+        super(ConfigLoader, self).__init__()
 
-        lines.append('\n')
+    def files(self):
+        for path in self.paths:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    filename = os.path.join(path, name)
+                    if name.endswith('.cfg') and not name.startswith('.') and os.path.isfile(filename):
+                        yield filename
 
-        lines.append('defaults')
-        for line in self.defaults.to_string().split('\n'):
-            lines.append('\t' + line)
+            elif os.path.exists(path):
+                yield path
 
-        lines.append('\n')
+            else:
+                raise ConfigIsInvalid('%s is not exist' % path)
 
-        for frontend_name in self.frontends:
-            lines.append('frontend %s' % frontend_name)
+    def stamp(self, filename):
+        stat = os.stat(filename)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
 
-            for line in self.frontends[frontend_name].to_string().split('\n'):
-                lines.append('\t' + line)
+    def _map(self, function, filenames):
+        if ProcessPoolExecutor is None or self.processes == 1 or len(filenames) < self.pool_threshold:
+            return [function(self.config_class, filename) for filename in filenames]
 
-            lines.append('\n')
+        with ProcessPoolExecutor(self.processes) as executor:
+            return list(executor.map(function, [self.config_class] * len(filenames), filenames))
 
-        for backend_name in self.backends:
-            lines.append('backend %s' % backend_name)
+    def _parse_files(self, filenames):
+        if not self.cache_sections:
+            return self._map(_parse_file, filenames)
 
-            for line in self.backends[backend_name].to_string().split('\n'):
-                lines.append('\t' + line)
+        first = [filename for filename in filenames if filename not in self._caches]
+        parsed = dict(zip(first, self._map(_parse_file_cached, first)))
 
-            lines.append('\n')
+        results = []
+        for filename in filenames:
+            if filename in parsed:
+                parts, self._caches[filename] = parsed[filename]
+            else:
+                parts = _parse_file(self.config_class, filename, self._caches[filename])
 
-        for listen_name in self.listens:
-            lines.append('listen %s' % listen_name)
+            results.append(parts)
 
-            for line in self.listens[listen_name].to_string().split('\n'):
-                lines.append('\t' + line)
+        return results
 
-            lines.append('\n')
+    def load(self):
+        filenames = list(self.files())
+        stamps = {}
+        changed = []
 
-        return '\n'.join(lines)
+        for filename in filenames:
+            stamps[filename] = self.stamp(filename)
 
-    def __dict__(self):
-        out = {
-            'global': dict(self.globals),
-            'defaults': dict(self.defaults),
-            'frontend': {},
-            'backend': {},
-            'listen': {}
-        }
-        for key in self.frontends:
-            out['frontend'][key] = dict(self.frontends[key])
+            cached = self._files.get(filename)
+            if cached is None or cached[0] != stamps[filename]:
+                changed.append(filename)
 
-        for key in self.backends:
-            out['backend'][key] = dict(self.backends[key])
+        for filename, parts in zip(changed, self._parse_files(changed)):
+            self._files[filename] = (stamps[filename], parts)
 
-        for key in self.listens:
-            out['listen'][key] = dict(self.listens[key])
+        for filename in list(self._files):
+            if filename not in stamps:
+                del self._files[filename]
+                self._caches.pop(filename, None)
 
-        return out
+        c = self.config_class()
+        for filename in filenames:
+            for part_name, section in self._files[filename][1]:
+                c._add_part(part_name, section)
+
+        return c
 
 
-class GlobalConfig(object):
+class GlobalConfig(SectionConfig):
     def __init__(self):
         # log <address> <facility> [<level> [<minlevel>]]
         self.log = {}
@@ -163,6 +1254,8 @@ class GlobalConfig(object):
         self.stats = {
             'socket': '/tmp/haproxy'
         }
+        # the bind options following the stats socket address, level admin, mode 600...
+        self.stats_socket_options = []
         self.number_processes = 5
         self.pid_file = '/var/run/haproxy.pid'
         self._raw = None
@@ -177,67 +1270,12 @@ class GlobalConfig(object):
             'daemon': self.daemon,
             'chroot': self.chroot,
             'stats': self.stats,
+            'stats_socket_options': self.stats_socket_options,
             'number_processes': self.number_processes,
             'pid_file': self.pid_file
         }
 
-    def set_value(self, key, line):
-        parts = line.split()
-
-        if key == 'log':
-            address = parts[0]
-            facility = parts[1]
-            try:
-                level = parts[2]
-            except:
-                level = None
-
-            try:
-                min_level = parts[3]
-            except:
-                min_level = None
-
-            self.set_log(address, facility, level, min_level)
-
-        elif key == 'maxconn':
-            self.set_max_connections(parts[0])
-
-        elif key == 'pidfile':
-            self.set_pid_file(parts[0])
-
-        elif key == 'daemon':
-            self.set_daemon(True)
-
-        elif key == 'user':
-            self.set_user(parts[0])
-
-        elif key == 'group':
-            self.set_group(parts[0])
-
-        elif key == 'chroot':
-            try:
-                chroot = parts[0]
-            except:
-                chroot = ''
-            self.set_chroot(chroot)
-
-        elif key == 'nbproc':
-            self.set_number_processes(parts[0])
-
-    def from_string(self, lines):
-        self._raw = lines
-        for line in lines:
-            line = line.partition('#')[0].strip()
-
-            if line and not line.startswith('#'):
-                parts = line.split()
-                key = parts[0]
-
-                self.set_value(key, ' '.join(parts[1:]))
-
-    def to_string(self):
-        lines = []
-
+    def iter_lines(self):
         for address in self.log:
             for facility in self.log[address]:
                 _log = 'log %s %s' % (address, facility)
@@ -245,26 +1283,27 @@ class GlobalConfig(object):
                     _log += ' %s' % self.log[address][facility].get('level', '')
                     _log += ' %s' % self.log[address][facility].get('min-level', '')
 
-                lines.append(_log.strip())
+                yield _log.strip()
 
-        lines.append('user %s' % self.user)
-        lines.append('group %s' % self.group)
-        lines.append('pidfile %s' % self.pid_file)
+        yield 'user %s' % self.user
+        yield 'group %s' % self.group
+        yield 'pidfile %s' % self.pid_file
 
         if self.max_connections:
-            lines.append('maxconn %s' % self.max_connections)
+            yield 'maxconn %s' % self.max_connections
 
         if self.daemon:
-            lines.append('daemon')
+            yield 'daemon'
 
         if self.chroot:
-            lines.append('chroot')
+            yield 'chroot'
 
-        lines.append('nbproc %s' % self.number_processes)
+        yield 'nbproc %s' % self.number_processes
         for t in self.stats:
-            lines.append('stats %s %s' % (t, self.stats[t]))
-
-        return '\n'.join(lines)
+            if t == 'socket' and self.stats_socket_options:
+                yield 'stats socket %s %s' % (self.stats[t], ' '.join(self.stats_socket_options))
+            else:
+                yield 'stats %s %s' % (t, self.stats[t])
 
     def set_log(self, address, facility, level=None, min_level=None):
         """
@@ -288,8 +1327,12 @@ class GlobalConfig(object):
         if min_level:
             self.log[address][facility]['min-level'] = min_level
 
-    def set_stats_socket(self, socket_path):
+    def set_stats_socket(self, socket_path, options=None):
+        """
+        options - the tokens following the address, e.g. ['level', 'admin', 'mode', '600']
+        """
         self.stats['socket'] = socket_path
+        self.stats_socket_options = list(options or [])
 
     def set_stats_timeout(self, timeout='10s'):
         """
@@ -302,7 +1345,10 @@ class GlobalConfig(object):
         """
         connections - By default, the stats socket is limited to 10 concurrent connections.
         """
-        self.stats['maxconn'] = connections
+        try:
+            self.stats['maxconn'] = int(connections)
+        except:
+            raise ConfigIsInvalid('Global stats maxconn config is invalid')
 
     def set_pid_file(self, filename):
         dir_name = os.path.dirname(filename)
@@ -347,8 +1393,30 @@ class GlobalConfig(object):
         """
         self.chroot = chroot
 
+    def _stats_directive(self, args):
+        if args[0] == 'socket':
+            self.set_stats_socket(args[1], args[2:])
+
+        elif args[0] == 'timeout':
+            self.set_stats_timeout(args[1])
+
+        elif args[0] == 'maxconn':
+            self.set_stats_max_connections(args[1])
+
+    directives = {
+        'log': (lambda self, args: self.set_log(*args[:4]), 2),
+        'maxconn': (lambda self, args: self.set_max_connections(args[0]), 1),
+        'pidfile': (lambda self, args: self.set_pid_file(args[0]), 1),
+        'daemon': (lambda self, args: self.set_daemon(True), 0),
+        'user': (lambda self, args: self.set_user(args[0]), 1),
+        'group': (lambda self, args: self.set_group(args[0]), 1),
+        'chroot': (lambda self, args: self.set_chroot(args[0] if args else ''), 0),
+        'nbproc': (lambda self, args: self.set_number_processes(args[0]), 1),
+        'stats': (_stats_directive, 2),
+    }
+
 
-class DefaultConfig(object):
+class DefaultConfig(SectionConfig):
     def __init__(self):
         self.log = {}
         self.option = {}
@@ -369,6 +1437,9 @@ class DefaultConfig(object):
             'mode': self.mode,
             'retries': self.retries,
             'max_connections': self.max_connections,
+            'client_timeout': self.client_timeout,
+            'server_timeout': self.server_timeout,
+            'connect_timeout': self.connect_timeout,
         }
 
     def set_log(self, address, facility, level=None, min_level=None):
@@ -439,65 +1510,10 @@ class DefaultConfig(object):
     def set_mode(self, value):
         self.mode = value
 
-    def set_value(self, key, line):
-        parts = line.split()
-
-        if key == 'log':
-            if len(parts) == 1:
-                self.set_log(parts[0], parts[0])
-
-            else:
-                address = parts[0]
-                facility = parts[1]
-                try:
-                    level = parts[2]
-                except:
-                    level = None
-
-                try:
-                    min_level = parts[3]
-                except:
-                    min_level = None
-
-                self.set_log(address, facility, level, min_level)
-
-        elif key == 'mode':
-            self.set_mode(parts[0])
-
-        elif key == 'maxconn':
-            self.set_max_connections(parts[0])
-
-        elif key == 'retries':
-            self.set_retries(parts[0])
-
-        elif key == 'option':
-            self.set_option(parts[0], parts[1:])
-
-        elif key == 'contimeout':
-            self.set_connect_timeout(parts[0])
-
-        elif key == 'clitimeout':
-            self.set_client_timeout(parts[0])
-
-        elif key == 'srvtimeout':
-            self.set_server_timeout(parts[0])
-
-    def from_string(self, lines):
-        self._raw = lines
-        for line in lines:
-            line = line.partition('#')[0].strip()
-
-            if line and not line.startswith('#'):
-                parts = line.split()
-                key = parts[0]
-
-                self.set_value(key, ' '.join(parts[1:]))
-
-    def to_string(self):
-        lines = []
+    def iter_lines(self):
         for address in self.log:
             if address == 'global':
-                lines.append('log global')
+                yield 'log global'
 
             else:
                 for facility in self.log[address]:
@@ -509,37 +1525,63 @@ class DefaultConfig(object):
                     if self.log[address][facility].get('min-level'):
                         line += ' %s' % self.log[address][facility]['min-level']
 
-                    lines.append(line)
+                    yield line
 
         if self.mode:
-            lines.append('mode %s' % self.mode)
+            yield 'mode %s' % self.mode
 
         if self.connect_timeout:
-            lines.append('timeout connect %s' % self.connect_timeout)
+            yield 'timeout connect %s' % self.connect_timeout
 
         if self.client_timeout:
-            lines.append('timeout client %s' % self.client_timeout)
+            yield 'timeout client %s' % self.client_timeout
 
         if self.server_timeout:
-            lines.append('timeout server %s' % self.server_timeout)
+            yield 'timeout server %s' % self.server_timeout
 
         for key in self.option:
             if self.option[key]:
-                lines.append('option %s %s' % (key, self.option[key]))
+                yield 'option %s %s' % (key, self.option[key])
 
             else:
-                lines.append('option %s' % key)
+                yield 'option %s' % key
 
         if self.retries:
-            lines.append('retries %s' % self.retries)
+            yield 'retries %s' % self.retries
 
         if self.max_connections:
-            lines.append('maxconn %s' % self.max_connections)
+            yield 'maxconn %s' % self.max_connections
 
-        return '\n'.join(lines)
+    def _log_directive(self, args):
+        if len(args) == 1:
+            self.set_log(args[0], args[0])
+
+        else:
+            self.set_log(*args[:4])
+
+    directives = {
+        'log': (_log_directive, 1),
+        'mode': (lambda self, args: self.set_mode(args[0]), 1),
+        'maxconn': (lambda self, args: self.set_max_connections(args[0]), 1),
+        'retries': (lambda self, args: self.set_retries(args[0]), 1),
+        'option': (lambda self, args: self.set_option(args[0], args[1:]), 1),
+        'contimeout': (lambda self, args: self.set_connect_timeout(args[0]), 1),
+        'clitimeout': (lambda self, args: self.set_client_timeout(args[0]), 1),
+        'srvtimeout': (lambda self, args: self.set_server_timeout(args[0]), 1),
+    }
 
 
 class ServerConfig(object):
+    """
+    Backends can hold a large number of servers, so servers keep their
+    attributes in slots and share the keyword list at class level. The source
+    line is not kept, only the tokens no directive handled, if any.
+    """
+    __slots__ = ('name', 'ip', 'port', 'weight', 'cookie', 'check_inter', 'check_fall',
+                 'max_connections', 'min_connections', 'backup', 'disabled', '_unparsed')
+
+    keywords = ('cookie', 'check', 'weight', 'maxconn', 'minconn', 'backup', 'disabled')
+
     def __init__(self):
         self.name = None
         self.ip = None
@@ -551,10 +1593,18 @@ class ServerConfig(object):
         self.max_connections = None
         self.min_connections = None
         self.backup = False
-        self.keywords = ['cookie', 'check', 'maxconn', 'minconn', 'backup']
-        self._raw = None
+        self.disabled = False
+        self._unparsed = None
         super(ServerConfig, self).__init__()
 
+    def __getstate__(self):
+        # a bare tuple keeps snapshots of large backends small and fast to load
+        return tuple([getattr(self, key) for key in self.__slots__])
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
     def __dict__(self):
         return {
             'name': self.name,
@@ -567,6 +1617,7 @@ class ServerConfig(object):
             'max_connections': self.max_connections,
             'min_connections': self.min_connections,
             'backup': self.backup,
+            'disabled': self.disabled,
         }
 
     def set_cookie(self, value):
@@ -603,54 +1654,130 @@ class ServerConfig(object):
     def set_backup(self, backup=True):
         self.backup = backup
 
-    def set_value(self, key, parts):
-        if key == 'cookie':
-            if parts and parts[0] not in self.keywords:
-                self.set_cookie(parts[0])
-                parts = parts[1:]
+    def set_disabled(self, disabled=True):
+        self.disabled = disabled
+
+    def set_weight(self, value):
+        try:
+            self.weight = int(value)
+
+        except:
+            raise ConfigIsInvalid('Server weight config is invalid')
+
+    @classmethod
+    def register_directive(cls, keyword, handler, arity=0):
+        """
+        handler(server, args, i) is called with the tokens of the server line and
+        the index following the keyword. It returns the index of the first token
+        it did not consume, or None when it consumed exactly arity tokens.
+        """
+        if 'directives' not in vars(cls):
+            cls.directives = dict(cls.directives)
+
+        cls.directives[keyword] = (handler, arity)
 
-        elif key == 'backup':
-            self.set_backup(True)
+    def _parse_directives(self, args, i, directives=None):
+        if directives is None:
+            if _profile is not None:
+                return _profile.parse_server(self, args, i)
 
-        elif key == 'minconn':
-            self.set_min_connections(parts[0])
-            parts = parts[1:]
+            directives = self.directives
 
-        elif key == 'maxconn':
-            self.set_max_connections(parts[0])
-            parts = parts[1:]
+        count = len(args)
+        unparsed = None
 
-        elif key == 'check':
-            while parts:
-                if parts[0] == 'inter':
-                    self.set_check_inter(parts[1])
-                    parts = parts[2:]
+        while i < count:
+            key = args[i]
+            i += 1
+            directive = directives.get(key)
 
-                elif parts[0] == 'fall':
-                    self.set_check_fall(parts[1])
-                    parts = parts[2:]
+            if directive is None:
+                if unparsed is None:
+                    unparsed = []
 
-                else:
-                    break
+                unparsed.append(key)
+                continue
+
+            handler, arity = directive
+            if count - i < arity:
+                raise ConfigIsInvalid('Server %s config is invalid' % key)
+
+            end = handler(self, args, i)
+            i = i + arity if end is None else end
+
+        self._unparsed = tuple(unparsed) if unparsed else None
+        return i
+
+    def set_value(self, key, parts):
+        directive = self.directives.get(key)
+
+        if directive is not None:
+            handler, arity = directive
+            if len(parts) < arity:
+                raise ConfigIsInvalid('Server %s config is invalid' % key)
+
+            handler(self, parts, 0)
 
     def from_string(self, value):
-        self._raw = value
-        _config = value.split()
+        self._parse_parts(value.split())
 
-        self.name = _config[0]
-        ip_and_port = _config[1]
+    @classmethod
+    def from_parts(cls, parts):
+        server = cls()
+        server._parse_parts(parts)
+        return server
+
+    @property
+    def _raw(self):
+        # the server line rebuilt from the parsed fields, what no directive
+        # handled comes last
+        raw = self.to_string()[len('server '):]
+        if self._unparsed:
+            raw += ' ' + ' '.join(self._unparsed)
+
+        return raw
+
+    def _parse_parts(self, parts):
+        self.name = parts[0]
+        ip_and_port = parts[1]
         if ':' not in ip_and_port:
             ip_and_port = '%s:80' % ip_and_port
 
         self.ip, _t, self.port = ip_and_port.partition(':')
         self.port = int(self.port)
 
-        _config = _config[2:]
+        self._parse_directives(parts, 2)
 
-        while _config:
-            key = _config[0]
-            _config = _config[1:]
-            self.set_value(key, _config)
+    def _cookie_directive(self, args, i):
+        if i < len(args) and args[i] not in self.keywords:
+            self.set_cookie(args[i])
+            i += 1
+
+        return i
+
+    def _check_directive(self, args, i):
+        while i < len(args) and args[i] in ('inter', 'fall'):
+            value = args[i + 1] if i + 1 < len(args) else None
+
+            if args[i] == 'inter':
+                self.set_check_inter(value)
+
+            else:
+                self.set_check_fall(value)
+
+            i += 2
+
+        return i
+
+    directives = {
+        'cookie': (_cookie_directive, 0),
+        'check': (_check_directive, 0),
+        'backup': (lambda self, args, i: self.set_backup(True), 0),
+        'disabled': (lambda self, args, i: self.set_disabled(True), 0),
+        'weight': (lambda self, args, i: self.set_weight(args[i]), 1),
+        'minconn': (lambda self, args, i: self.set_min_connections(args[i]), 1),
+        'maxconn': (lambda self, args, i: self.set_max_connections(args[i]), 1),
+    }
 
     def to_string(self):
         output = 'server %s %s:%s weight %s' % (self.name, self.ip, self.port, self.weight)
@@ -676,10 +1803,233 @@ class ServerConfig(object):
         if self.backup:
             output += ' backup'
 
+        if self.disabled:
+            output += ' disabled'
+
         return output
 
 
-class ListenConfig(object):
+def _restore_server_table(cls, servers, by_address, by_cookie, indexed):
+    table = cls()
+    dict.update(table, servers)
+    table.by_address = by_address
+    table.by_cookie = by_cookie
+    table._indexed = indexed
+    return table
+
+
+class ServerTable(dict):
+    """
+    The servers of a backend or listen keyed by name, which also indexes them
+    by 'ip:port' and by cookie. The indexes follow every change made through
+    the dict, a server whose ip, port or cookie is changed in place has to be
+    passed to reindex().
+    """
+    def __init__(self, *args, **kwargs):
+        super(ServerTable, self).__init__()
+        self.by_address = {}
+        self.by_cookie = {}
+        self._indexed = {}
+        self.update(*args, **kwargs)
+
+    def __reduce__(self):
+        # the indexes are stored as they are instead of being rebuilt on load
+        return _restore_server_table, (self.__class__, dict(self), self.by_address, self.by_cookie, self._indexed)
+
+    def _add_index(self, name, server):
+        address = '%s:%s' % (server.ip, server.port)
+        self.by_address.setdefault(address, {})[name] = server
+
+        if server.cookie:
+            self.by_cookie.setdefault(server.cookie, {})[name] = server
+
+        self._indexed[name] = (address, server.cookie)
+
+    def _remove_index(self, name):
+        address, cookie = self._indexed.pop(name)
+
+        for index, key in ((self.by_address, address), (self.by_cookie, cookie)):
+            servers = index.get(key)
+            if servers is not None:
+                servers.pop(name, None)
+                if not servers:
+                    del index[key]
+
+    def reindex(self, name):
+        self._remove_index(name)
+        self._add_index(name, self[name])
+
+    def find_by_address(self, address):
+        """
+        The servers listening on address, an 'ip:port' string.
+        """
+        return list(self.by_address.get(address, {}).values())
+
+    def find_by_cookie(self, cookie):
+        return list(self.by_cookie.get(cookie, {}).values())
+
+    def __setitem__(self, name, server):
+        if name in self:
+            self._remove_index(name)
+
+        super(ServerTable, self).__setitem__(name, server)
+        self._add_index(name, server)
+
+    def __delitem__(self, name):
+        super(ServerTable, self).__delitem__(name)
+        self._remove_index(name)
+
+    def pop(self, name, *default):
+        if name in self:
+            self._remove_index(name)
+
+        return super(ServerTable, self).pop(name, *default)
+
+    def popitem(self):
+        name, server = super(ServerTable, self).popitem()
+        self._remove_index(name)
+        return name, server
+
+    def setdefault(self, name, server=None):
+        if name not in self:
+            self[name] = server
+
+        return self[name]
+
+    def update(self, *args, **kwargs):
+        for name, server in dict(*args, **kwargs).items():
+            self[name] = server
+
+    def clear(self):
+        super(ServerTable, self).clear()
+        self.by_address.clear()
+        self.by_cookie.clear()
+        self._indexed.clear()
+
+    def copy(self):
+        return self.__class__(self)
+
+
+class ServerGroupConfig(SectionConfig):
+    """
+    Server handling shared by the sections holding servers, backend and listen.
+    """
+    def set_server(self, value):
+        server = ServerConfig()
+        server.from_string(value)
+        self.add_server(server)
+
+    def add_server(self, server):
+        if server.name:
+            self.server[server.name] = server
+
+    def add_servers(self, servers):
+        """
+        servers - ServerConfig objects or server lines without the server keyword
+        """
+        for server in servers:
+            if not isinstance(server, ServerConfig):
+                server = ServerConfig.from_parts(server.split())
+
+            self.add_server(server)
+
+    def remove_servers(self, names):
+        for name in names:
+            self.server.pop(name, None)
+
+    # attributes update_servers sets through the ServerConfig setters, which check their values
+    server_setters = {
+        'weight': 'set_weight',
+        'cookie': 'set_cookie',
+        'check_inter': 'set_check_inter',
+        'check_fall': 'set_check_fall',
+        'max_connections': 'set_max_connections',
+        'min_connections': 'set_min_connections',
+        'backup': 'set_backup',
+        'disabled': 'set_disabled',
+    }
+
+    def update_servers(self, updates):
+        """
+        updates - server name -> {attribute: value}, the attributes being the keys
+        of ServerConfig.__dict__(). A server is only changed when all of its
+        values are valid; renamed servers and new ip, port or cookie values are
+        reindexed in the server table.
+        """
+        for name, attributes in updates.items():
+            server = self.server[name]
+
+            for attribute in attributes:
+                if attribute not in self.server_setters and attribute not in ('name', 'ip', 'port'):
+                    raise ConfigIsInvalid('Server %s config is invalid' % attribute)
+
+            new_name = attributes.get('name', name)
+            if not new_name:
+                raise ConfigIsInvalid('Server name config is invalid')
+
+            if new_name != name and new_name in self.server:
+                raise ConfigIsInvalid('Server %s already exists' % new_name)
+
+            updated = ServerConfig()
+            updated.__setstate__(server.__getstate__())
+            for attribute, value in attributes.items():
+                setter = self.server_setters.get(attribute)
+                if setter is not None:
+                    getattr(updated, setter)(value)
+
+                elif attribute == 'port':
+                    try:
+                        updated.port = int(value)
+                    except:
+                        raise ConfigIsInvalid('Server port config is invalid')
+
+                else:
+                    setattr(updated, attribute, value)
+
+            # the server keeps its identity, only its values change
+            server.__setstate__(updated.__getstate__())
+
+            if new_name != name:
+                self.server.pop(name)
+                self.server[new_name] = server
+
+            elif 'ip' in attributes or 'port' in attributes or 'cookie' in attributes:
+                self.server.reindex(name)
+
+    def replace_servers(self, servers):
+        """
+        Make servers the whole server list. Servers that render the same as the
+        current ones are kept, so only the changed servers are touched.
+        """
+        current = self.server
+        wanted = {}
+
+        for server in servers:
+            if not isinstance(server, ServerConfig):
+                server = ServerConfig.from_parts(server.split())
+
+            wanted[server.name] = server
+
+        self.remove_servers([name for name in current if name not in wanted])
+
+        for name, server in wanted.items():
+            existing = current.get(name)
+            if existing is None or existing.to_string() != server.to_string():
+                current[name] = server
+
+    def find_server(self, address):
+        """
+        The first server listening on address, an 'ip:port' string, or None.
+        """
+        servers = self.server.find_by_address(address)
+        return servers[0] if servers else None
+
+    def find_server_by_cookie(self, cookie):
+        servers = self.server.find_by_cookie(cookie)
+        return servers[0] if servers else None
+
+
+class ListenConfig(ServerGroupConfig):
     def __init__(self):
         self.name = None
         self.ip = '*'
@@ -691,7 +2041,7 @@ class ListenConfig(object):
         }
         self.max_connections = None
         self.retries = None
-        self.server = {}
+        self.server = ServerTable()
         self.cookie_name = None
         self.cookie_insert = False
         self.cookie_rewrite = False
@@ -728,7 +2078,7 @@ class ListenConfig(object):
             'connect_timeout': self.connect_timeout
         }
         for key in self.server:
-            out['server'][key] = dict(self.server[key])
+            out['server'][key] = self.server[key].__dict__()
 
         return out
 
@@ -808,74 +2158,19 @@ class ListenConfig(object):
         except:
             raise ConfigIsInvalid('Default srvtimeout config is invalid')
 
-    def set_server(self, value):
-        server = ServerConfig()
-        server.from_string(value)
-
-        if server.name:
-            self.server[server.name] = server
-
-    def set_value(self, key, line):
-        parts = line.split()
-
-        if key == 'bind':
-            self.set_bind(parts[0])
-
-        elif key == 'cookie':
-            self.set_cookie(parts)
-
-        elif key == 'balance':
-            self.set_balance(parts[0])
-
-        elif key == 'maxconn':
-            self.set_max_connections(parts[0])
-
-        elif key == 'retries':
-            self.set_retries(parts[0])
-
-        elif key == 'option':
-            self.set_option(parts[0], parts[1:])
-
-        elif key == 'retries':
-            self.set_retries(parts[0])
-
-        elif key == 'contimeout':
-            self.set_connect_timeout(parts[0])
-
-        elif key == 'clitimeout':
-            self.set_client_timeout(parts[0])
-
-        elif key == 'srvtimeout':
-            self.set_server_timeout(parts[0])
-
-        elif key == 'server':
-            self.set_server(line)
-
-    def from_string(self, lines):
-        self._raw = lines
-        for line in lines:
-            line = line.partition('#')[0].strip()
-
-            if line and not line.startswith('#'):
-                parts = line.split()
-                key = parts[0]
-
-                self.set_value(key, ' '.join(parts[1:]))
-
-    def to_string(self):
-        lines = []
-        lines.append('bind %s:%s' % (self.ip, self.port))
-        lines.append('balance %s' % self.balance)
-        lines.append('mode %s' % self.mode)
+    def iter_lines(self):
+        yield 'bind %s:%s' % (self.ip, self.port)
+        yield 'balance %s' % self.balance
+        yield 'mode %s' % self.mode
 
         if self.connect_timeout:
-            lines.append('timeout connect %s' % self.connect_timeout)
+            yield 'timeout connect %s' % self.connect_timeout
 
         if self.client_timeout:
-            lines.append('timeout client %s' % self.client_timeout)
+            yield 'timeout client %s' % self.client_timeout
 
         if self.server_timeout:
-            lines.append('timeout server %s' % self.server_timeout)
+            yield 'timeout server %s' % self.server_timeout
 
         if self.cookie_name:
             cookie_define = 'cookie %s' % self.cookie_name
@@ -898,24 +2193,35 @@ class ListenConfig(object):
             if self.cookie_maxlife:
                 cookie_define += ' maxlife %s' % self.cookie_maxlife
 
-            lines.append(cookie_define)
+            yield cookie_define
 
         if self.max_connections:
-            lines.append('maxconn %s' % self.max_connections)
+            yield 'maxconn %s' % self.max_connections
 
         for key in self.option:
             line = 'option %s' % key
             if self.option[key]:
                 line += ' %s' % self.option[key]
-            lines.append(line)
+            yield line
 
         for server_name in self.server:
-            lines.append(self.server[server_name].to_string())
-
-        return '\n'.join(lines)
-
-
-class FrontendConfig(object):
+            yield self.server[server_name].to_string()
+
+    directives = {
+        'bind': (lambda self, args: self.set_bind(args[0]), 1),
+        'cookie': (lambda self, args: self.set_cookie(args), 1),
+        'balance': (lambda self, args: self.set_balance(args[0]), 1),
+        'maxconn': (lambda self, args: self.set_max_connections(args[0]), 1),
+        'retries': (lambda self, args: self.set_retries(args[0]), 1),
+        'option': (lambda self, args: self.set_option(args[0], args[1:]), 1),
+        'contimeout': (lambda self, args: self.set_connect_timeout(args[0]), 1),
+        'clitimeout': (lambda self, args: self.set_client_timeout(args[0]), 1),
+        'srvtimeout': (lambda self, args: self.set_server_timeout(args[0]), 1),
+        'server': (lambda self, args: self.add_server(ServerConfig.from_parts(args)), 2),
+    }
+
+
+class FrontendConfig(SectionConfig):
     def __init__(self):
         self.name = None
         self.ip = '*'
@@ -923,6 +2229,10 @@ class FrontendConfig(object):
         self.acl = {}
         self.option = {}
         self.use_backend = {}
+        # (backend, keyword, conditions) in config order, keyword being 'if',
+        # 'unless' or None. use_backend groups the same conditions by backend
+        # and is the form exported by __dict__
+        self.use_backend_rules = []
         self.default_backend = None
         self._raw = None
         self.client_timeout = 60000
@@ -942,74 +2252,64 @@ class FrontendConfig(object):
             'max_connections': self.max_connections
         }
 
-    def to_string(self):
-        lines = []
-
-        lines.append('bind %s:%s' % (self.ip, self.port))
+    def iter_lines(self):
+        yield 'bind %s:%s' % (self.ip, self.port)
         if self.client_timeout:
-            lines.append('timeout client %s' % self.client_timeout)
+            yield 'timeout client %s' % self.client_timeout
 
         if self.max_connections:
-            lines.append('maxconn %s' % self.max_connections)
+            yield 'maxconn %s' % self.max_connections
 
         for acl_name in self.acl:
-            lines.append('acl %s %s %s' % (acl_name, self.acl[acl_name]['method'], self.acl[acl_name]['value']))
+            yield 'acl %s %s %s' % (acl_name, self.acl[acl_name]['method'], self.acl[acl_name]['value'])
 
         for key in self.option:
             line = 'option %s' % key
             if self.option[key]:
                 line += ' %s' % self.option[key]
-            lines.append(line)
-
-        for backend_name in self.use_backend:
-            for conditions in self.use_backend[backend_name]:
-                lines.append('use_backend %s if %s' % (backend_name, ' '.join(conditions)))
-
-        lines.append('default_backend %s' % self.default_backend)
+            yield line
 
-        return '\n'.join(lines)
-
-    def from_string(self, lines):
-        self._raw = lines
-        for line in lines:
-            line = line.partition('#')[0].strip()
-
-            if line and not line.startswith('#'):
-                parts = line.split()
-                key = parts[0]
-
-                self.set_value(key, ' '.join(parts[1:]))
-
-    def set_value(self, key, line):
-        parts = line.split()
-
-        if key == 'bind':
-            self.set_bind(parts[0])
-
-        elif key == 'option':
-            self.set_option(parts[0], parts[1:])
+        for backend_name, keyword, conditions in self.iter_use_backend():
+            if keyword and conditions:
+                yield 'use_backend %s %s %s' % (backend_name, keyword, ' '.join(conditions))
+            else:
+                yield 'use_backend %s' % backend_name
 
-        elif key == 'clitimeout':
-            self.set_client_timeout(parts[0])
+        yield 'default_backend %s' % self.default_backend
 
-        elif key == 'use_backend':
-            self.set_use_backend(parts)
+    def iter_use_backend(self):
+        """
+        Yield (backend, keyword, conditions) for the use_backend rules in the
+        order haproxy evaluates them, keyword being 'if', 'unless' or None.
+        When use_backend was changed without use_backend_rules, its rules are
+        yielded grouped by backend as if rules.
+        """
+        grouped = {}
+        for backend_name, keyword, conditions in self.use_backend_rules:
+            grouped.setdefault(backend_name, []).append(conditions)
 
-        elif key == 'acl':
-            self.set_acl(parts)
+        if grouped == self.use_backend:
+            for rule in self.use_backend_rules:
+                yield rule
 
-        elif key == 'default_backend':
-            self.set_default_backend(parts[0])
+        else:
+            for backend_name in self.use_backend:
+                for conditions in self.use_backend[backend_name]:
+                    yield backend_name, 'if' if conditions else None, conditions
 
     def set_default_backend(self, name):
         self.default_backend = name
 
     def set_use_backend(self, parts):
         backend_name = parts[0]
+        keyword = parts[1] if len(parts) > 1 and parts[1] in ('if', 'unless') else None
+        conditions = parts[2:]
+
         if backend_name not in self.use_backend:
             self.use_backend[backend_name] = []
 
-        self.use_backend[backend_name].append(parts[2:])
+        self.use_backend[backend_name].append(conditions)
+        self.use_backend_rules.append((backend_name, keyword, conditions))
 
     def set_acl(self, parts):
         acl_name = parts[0]
@@ -1045,8 +2345,17 @@ class FrontendConfig(object):
 
         self.option[key] = value
 
+    directives = {
+        'bind': (lambda self, args: self.set_bind(args[0]), 1),
+        'option': (lambda self, args: self.set_option(args[0], args[1:]), 1),
+        'clitimeout': (lambda self, args: self.set_client_timeout(args[0]), 1),
+        'use_backend': (lambda self, args: self.set_use_backend(args), 1),
+        'acl': (lambda self, args: self.set_acl(args), 2),
+        'default_backend': (lambda self, args: self.set_default_backend(args[0]), 1),
+    }
+
 
-class BackendConfig(object):
+class BackendConfig(ServerGroupConfig):
     def __init__(self):
         self.name = None
         self.mode = 'http'
@@ -1063,7 +2372,7 @@ class BackendConfig(object):
         self.cookie_rewrite = False
         self.cookie_maxidle = None
         self.cookie_maxlife = None
-        self.server = {}
+        self.server = ServerTable()
         self.server_timeout = 3000
         self.connect_timeout = 3000
         self._raw = None
@@ -1089,7 +2398,7 @@ class BackendConfig(object):
             'server': {}
         }
         for key in self.server:
-            out['server'][key] = dict(self.server[key])
+            out['server'][key] = self.server[key].__dict__()
 
         return out
 
@@ -1154,76 +2463,26 @@ class BackendConfig(object):
         except:
             raise ConfigIsInvalid('Default srvtimeout config is invalid')
 
-    def set_server(self, value):
-        server = ServerConfig()
-        server.from_string(value)
-
-        if server.name:
-            self.server[server.name] = server
-
-    def set_value(self, key, line):
-        parts = line.split()
-
-        if key == 'balance':
-            self.set_balance(parts[0])
-
-        elif key == 'maxconn':
-            self.set_max_connections(parts[0])
-
-        elif key == 'retries':
-            self.set_retries(parts[0])
-
-        elif key == 'option':
-            self.set_option(parts[0], parts[1:])
-
-        elif key == 'retries':
-            self.set_retries(parts[0])
-
-        elif key == 'contimeout':
-            self.set_connect_timeout(parts[0])
-
-        elif key == 'srvtimeout':
-            self.set_server_timeout(parts[0])
-
-        elif key == 'server':
-            self.set_server(line)
-
-        elif key == 'cookie':
-            self.set_cookie(parts)
-
-    def from_string(self, lines):
-        self._raw = lines
-
-        for line in lines:
-            line = line.partition('#')[0].strip()
-
-            if line and not line.startswith('#'):
-                parts = line.split()
-                key = parts[0]
-
-                self.set_value(key, ' '.join(parts[1:]))
-
-    def to_string(self):
-        lines = []
-        lines.append('balance %s' % self.balance)
-        lines.append('mode %s' % self.mode)
+    def iter_lines(self):
+        yield 'balance %s' % self.balance
+        yield 'mode %s' % self.mode
         if self.connect_timeout:
-            lines.append('timeout connect %s' % self.connect_timeout)
+            yield 'timeout connect %s' % self.connect_timeout
 
         if self.server_timeout:
-            lines.append('timeout server %s' % self.server_timeout)
+            yield 'timeout server %s' % self.server_timeout
 
         for key in self.option:
             line = 'option %s' % key
             if self.option[key]:
                 line += ' %s' % self.option[key]
-            lines.append(line)
+            yield line
 
         if self.max_connections:
-            lines.append('maxconn %s' % self.max_connections)
+            yield 'maxconn %s' % self.max_connections
 
         if self.retries:
-            lines.append('retries %s' % self.retries)
+            yield 'retries %s' % self.retries
 
         if self.cookie_name:
             cookie_define = 'cookie %s' % self.cookie_name
@@ -1246,10 +2505,18 @@ class BackendConfig(object):
             if self.cookie_maxlife:
                 cookie_define += ' maxlife %s' % self.cookie_maxlife
 
-            lines.append(cookie_define)
+            yield cookie_define
 
         for server_name in self.server:
-            lines.append(self.server[server_name].to_string())
-
-        return '\n'.join(lines)
-
+            yield self.server[server_name].to_string()
+
+    directives = {
+        'balance': (lambda self, args: self.set_balance(args[0]), 1),
+        'maxconn': (lambda self, args: self.set_max_connections(args[0]), 1),
+        'retries': (lambda self, args: self.set_retries(args[0]), 1),
+        'option': (lambda self, args: self.set_option(args[0], args[1:]), 1),
+        'contimeout': (lambda self, args: self.set_connect_timeout(args[0]), 1),
+        'srvtimeout': (lambda self, args: self.set_server_timeout(args[0]), 1),
+        'server': (lambda self, args: self.add_server(ServerConfig.from_parts(args)), 2),
+        'cookie': (lambda self, args: self.set_cookie(args), 1),
+    }
@@ -0,0 +1,266 @@
+# coding=utf-8
+import subprocess
+import threading
+import time
+
+
+class ReloadError(Exception):
+    pass
+
+
+def command_reload(command, timeout=60):
+    """
+    A reload hook running command, a string run through the shell or an
+    argument list, that raises ReloadError when it fails.
+    """
+    def reload():
+        try:
+            result = subprocess.run(command, shell=isinstance(command, str), stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, timeout=timeout)
+
+        except (OSError, subprocess.SubprocessError) as e:
+            raise ReloadError('%s: %s' % (command, e))
+
+        if result.returncode != 0:
+            raise ReloadError('%s exited with %d: %s' % (command, result.returncode,
+                                                        result.stdout.decode('utf-8', 'replace').strip()))
+
+    return reload
+
+
+class ReloadScheduler(object):
+    """
+    Save a Config and reload haproxy once for a burst of changes instead of
+    once per change.
+
+    Changes are made inside edit(), or reported with changed() when the config
+    is modified elsewhere. The config is saved once no change came for window
+    seconds, but at the latest max_delay seconds after the first pending change,
+    and haproxy is reloaded only when the saved text differs from the file.
+    Two reloads are at least min_interval seconds apart. After a failed save
+    or reload nothing is tried again for max(min_interval, window) seconds,
+    doubled after every further failure up to max_delay, so a broken config
+    does not run the reload command on every poll.
+
+    reload - a callable, or a command for command_reload(), None to only save
+    clock - returns the current time in seconds, time.monotonic by default
+
+    poll() does what is due and suits callers with their own loop, start()
+    runs a thread doing it.
+    """
+    def __init__(self, config, filename, reload=None, window=0.5, min_interval=5, max_delay=30,
+                 clock=time.monotonic, sort_sections=True):
+        if min_interval > max_delay:
+            raise ValueError('min_interval %s is greater than max_delay %s' % (min_interval, max_delay))
+
+        if reload is not None and not callable(reload):
+            reload = command_reload(reload)
+
+        self.config = config
+        self.filename = filename
+        self.reload = reload
+        self.window = window
+        self.min_interval = min_interval
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sort_sections = sort_sections
+
+        self.saves = 0
+        self.reloads = 0
+        # failed flushes in a row
+        self.failures = 0
+        self.last_error = None
+
+        self._condition = threading.Condition(threading.RLock())
+        self._first_change = None
+        self._last_change = None
+        self._last_reload = None
+        self._reload_pending = False
+        self._retry_at = None
+        self._flushing = False
+        self._thread = None
+        self._running = False
+        super(ReloadScheduler, self).__init__()
+
+    def edit(self):
+        """
+        A context manager holding the config for a change, which is scheduled
+        when the block ends:
+
+            with scheduler.edit() as config:
+                config.backends['app'].update_servers({'app1': {'weight': 0}})
+        """
+        return _Edit(self)
+
+    def changed(self):
+        """
+        Schedule a save for a change made to the config.
+        """
+        with self._condition:
+            now = self.clock()
+            if self._first_change is None:
+                self._first_change = now
+
+            self._last_change = now
+            self._condition.notify_all()
+
+    @property
+    def pending(self):
+        return self._first_change is not None or self._reload_pending
+
+    def due(self):
+        """
+        The time of the next save, None when nothing is pending.
+        """
+        with self._condition:
+            if not self.pending:
+                return None
+
+            if self._first_change is None:
+                # only a failed reload is left to retry
+                due = self.clock()
+            else:
+                due = min(self._last_change + self.window, self._first_change + self.max_delay)
+
+            if self._last_reload is not None:
+                due = max(due, self._last_reload + self.min_interval)
+
+            if self._retry_at is not None:
+                due = max(due, self._retry_at)
+
+            return due
+
+    def poll(self):
+        """
+        Save and reload if it is due, returns what flush() returned or None
+        when nothing was due.
+        """
+        with self._condition:
+            due = self.due()
+            if due is None or due > self.clock():
+                return None
+
+        return self.flush()
+
+    def flush(self):
+        """
+        Save now and reload if the file changed, whatever the window. Returns
+        True when haproxy was reloaded.
+
+        The config is saved holding the lock edits take, the reload runs
+        without it so edits are not blocked while haproxy reloads. Flushes
+        run one at a time.
+        """
+        with self._condition:
+            while self._flushing:
+                self._condition.wait()
+
+            self._flushing = True
+
+        try:
+            with self._condition:
+                if self.config.save(self.filename, self.sort_sections):
+                    self._reload_pending = True
+
+                self._first_change = None
+                self._last_change = None
+
+                self.saves += 1
+                if not self._reload_pending:
+                    self._succeeded()
+                    return False
+
+            if self.reload is not None:
+                # the reload is retried on the next flush when it fails
+                self.reload()
+
+            with self._condition:
+                self._reload_pending = False
+                self._last_reload = self.clock()
+                self.reloads += 1
+                self._succeeded()
+                return True
+
+        except Exception:
+            with self._condition:
+                self.failures += 1
+                backoff = max(self.min_interval, self.window) * 2 ** (self.failures - 1)
+                self._retry_at = self.clock() + min(backoff, max(self.max_delay, self.min_interval, self.window))
+            raise
+
+        finally:
+            with self._condition:
+                self._flushing = False
+                self._condition.notify_all()
+
+    def _succeeded(self):
+        self.failures = 0
+        self._retry_at = None
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='haproxy-reload')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, flush=True):
+        """
+        Stop the thread, saving the pending changes first when flush is set.
+        """
+        with self._condition:
+            thread = self._thread
+            self._running = False
+            self._thread = None
+            self._condition.notify_all()
+
+        if thread is not None:
+            thread.join()
+
+        if flush and self.pending:
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+
+                due = self.due()
+                if due is None:
+                    self._condition.wait()
+                    continue
+
+                delay = due - self.clock()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+            try:
+                self.flush()
+                self.last_error = None
+
+            except Exception as e:
+                # due() holds the retry back
+                self.last_error = e
+
+
+class _Edit(object):
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        super(_Edit, self).__init__()
+
+    def __enter__(self):
+        self.scheduler._condition.acquire()
+        return self.scheduler.config
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.scheduler.changed()
+
+        finally:
+            self.scheduler._condition.release()
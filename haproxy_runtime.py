@@ -0,0 +1,395 @@
+# coding=utf-8
+import socket
+import threading
+
+
+TIME_UNITS = {
+    'us': 0.000001,
+    'ms': 0.001,
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400
+}
+
+
+class RuntimeApiError(Exception):
+    pass
+
+
+class RuntimeConnectionLost(RuntimeApiError):
+    """
+    The session was closed by haproxy before any reply came, the commands were
+    not run and can be sent again on a new session.
+    """
+
+
+def parse_timeout(value):
+    """
+    Convert a haproxy time value to seconds, values without a unit are
+    milliseconds.
+    """
+    value = str(value).strip()
+
+    for unit in ('us', 'ms', 's', 'm', 'h', 'd'):
+        if value.endswith(unit) and value[:-len(unit)].isdigit():
+            return int(value[:-len(unit)]) * TIME_UNITS[unit]
+
+    try:
+        return int(value) * TIME_UNITS['ms']
+    except ValueError:
+        raise RuntimeApiError('Invalid timeout %s' % value)
+
+
+class RuntimeSession(object):
+    """
+    A persistent stats socket connection in interactive mode. Every reply is
+    followed by the prompt, so commands can be written in batches and their
+    replies read back in order.
+    """
+    prompt = b'\n> '
+
+    def __init__(self, socket_path, timeout=10):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._socket = None
+        self._buffer = bytearray()
+        super(RuntimeSession, self).__init__()
+
+    def open(self):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(self.timeout)
+
+        try:
+            self._socket.connect(self.socket_path)
+            self._socket.sendall(b'prompt\n')
+            self._read_reply()
+
+        except (socket.error, RuntimeApiError) as e:
+            self.close()
+            raise RuntimeApiError('%s: %s' % (self.socket_path, e))
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._socket.sendall(b'quit\n')
+            except socket.error:
+                pass
+
+            self._socket.close()
+            self._socket = None
+            del self._buffer[:]
+
+    @property
+    def closed(self):
+        return self._socket is None
+
+    def _read_reply(self):
+        start = 0
+
+        while True:
+            index = self._buffer.find(self.prompt, start)
+            if index != -1:
+                reply = bytes(self._buffer[:index])
+                del self._buffer[:index + len(self.prompt)]
+                return reply.decode('utf-8')
+
+            start = max(len(self._buffer) - len(self.prompt) + 1, 0)
+            chunk = self._socket.recv(65536)
+            if not chunk:
+                raise RuntimeApiError('%s: connection closed' % self.socket_path)
+
+            self._buffer.extend(chunk)
+
+    def execute_many(self, commands):
+        """
+        Write all commands at once and return their replies in the same order.
+        """
+        if not commands:
+            return []
+
+        if self._socket is None:
+            raise RuntimeConnectionLost('%s: session is closed' % self.socket_path)
+
+        replies = []
+        try:
+            self._socket.sendall(''.join('%s\n' % command for command in commands).encode('utf-8'))
+            for _command in commands:
+                replies.append(self._read_reply())
+
+            return replies
+
+        except Exception as e:
+            # the rest of the stream can't be trusted after any failure
+            lost = not replies and not self._buffer and not isinstance(e, socket.timeout)
+            self.close()
+
+            if lost and isinstance(e, RuntimeApiError):
+                raise RuntimeConnectionLost(str(e))
+
+            if lost and isinstance(e, socket.error):
+                raise RuntimeConnectionLost('%s: %s' % (self.socket_path, e))
+
+            if isinstance(e, RuntimeApiError):
+                raise
+
+            raise RuntimeApiError('%s: %s' % (self.socket_path, e))
+
+
+class RuntimePool(object):
+    """
+    Interactive sessions to one stats socket, shared between threads. At most
+    size sessions are open at the same time. Idle sessions stay open and
+    hold their stats socket slot, so size should stay well below the stats
+    maxconn of the socket (10 by default) to leave room for operators and
+    other tools, a few sessions are enough to pipeline thousands of
+    commands.
+    """
+    def __init__(self, socket_path, size=4, timeout=10, batch_size=100):
+        self.socket_path = socket_path
+        self.size = size
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._available = threading.Semaphore(size)
+        super(RuntimePool, self).__init__()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        A pool on the stats socket of config, of 4 sessions by default and
+        always leaving at least one slot of the stats maxconn free.
+        """
+        stats = config.globals.stats
+        kwargs.setdefault('size', max(1, min(4, int(stats.get('maxconn', 10)) - 1)))
+        kwargs.setdefault('timeout', parse_timeout(stats.get('timeout', '10s')))
+        return cls(stats['socket'], **kwargs)
+
+    def acquire(self):
+        return self._acquire()[0]
+
+    def _acquire(self):
+        """
+        (session, True when it is an idle session opened earlier)
+        """
+        self._available.acquire()
+
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+
+        try:
+            return self._open(), False
+        except Exception:
+            self._available.release()
+            raise
+
+    def _open(self):
+        session = RuntimeSession(self.socket_path, self.timeout)
+        session.open()
+        return session
+
+    def release(self, session):
+        # sessions closed by a failure are dropped
+        if not session.closed:
+            with self._lock:
+                self._idle.append(session)
+
+        self._available.release()
+
+    def execute_many(self, commands):
+        """
+        Pipeline the commands on one session, batch_size commands at a time,
+        and return the replies in the same order.
+        """
+        session, reused = self._acquire()
+        replies = []
+
+        try:
+            for i in range(0, len(commands), self.batch_size):
+                batch = commands[i:i + self.batch_size]
+                try:
+                    replies.extend(session.execute_many(batch))
+
+                except RuntimeConnectionLost:
+                    if i or not reused:
+                        raise
+
+                    # an idle session haproxy closed after the stats timeout,
+                    # the commands did not run, try once on a new session
+                    session = self._open()
+                    replies.extend(session.execute_many(batch))
+
+        finally:
+            self.release(session)
+
+        return replies
+
+    def execute(self, command):
+        return self.execute_many([command])[0]
+
+    def close(self):
+        with self._lock:
+            sessions, self._idle = self._idle, []
+
+        for session in sessions:
+            session.close()
+
+
+class RuntimeClient(object):
+    """
+    Apply server changes through the haproxy runtime API on the stats socket,
+    without reloading haproxy. When a config is given, the servers it holds
+    are kept in sync with the commands that succeeded.
+    """
+    def __init__(self, socket_path, timeout=10, config=None, pool=None):
+        """
+        pool - a RuntimePool for the same socket, commands are then pipelined on
+        its sessions instead of opening a connection for each of them
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.config = config
+        self.pool = pool
+        super(RuntimeClient, self).__init__()
+
+    @classmethod
+    def from_config(cls, config, pool=None):
+        stats = config.globals.stats
+        return cls(stats['socket'], parse_timeout(stats.get('timeout', '10s')), config, pool)
+
+    def execute(self, command):
+        """
+        Send one command and return the response text.
+        """
+        if self.pool is not None:
+            return self.pool.execute(command)
+
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+
+        try:
+            connection.connect(self.socket_path)
+            connection.sendall(('%s\n' % command).encode('utf-8'))
+
+            chunks = []
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+
+                chunks.append(chunk)
+
+        except socket.error as e:
+            raise RuntimeApiError('%s: %s' % (self.socket_path, e))
+
+        finally:
+            connection.close()
+
+        return b''.join(chunks).decode('utf-8')
+
+    def execute_many(self, commands):
+        if self.pool is not None:
+            return self.pool.execute_many(commands)
+
+        return [self.execute(command) for command in commands]
+
+    def _set(self, command):
+        response = self.execute(command).strip()
+        if response:
+            raise RuntimeApiError('%s: %s' % (command, response))
+
+    def _find_server(self, backend, server):
+        if self.config is None:
+            return None
+
+        for sections in (self.config.backends, self.config.listens):
+            if backend in sections:
+                return sections[backend].server.get(server)
+
+        return None
+
+    def _sync(self, backend, server, field, value):
+        server_config = self._find_server(backend, server)
+
+        if server_config is not None:
+            if field == 'weight':
+                server_config.set_weight(value)
+
+            elif field == 'max_connections':
+                server_config.set_max_connections(value)
+
+            elif field == 'disabled':
+                server_config.set_disabled(value)
+
+    def set_weight(self, backend, server, weight):
+        self._set('set weight %s/%s %s' % (backend, server, weight))
+        self._sync(backend, server, 'weight', weight)
+
+    def set_max_connections(self, backend, server, connections):
+        self._set('set maxconn server %s/%s %s' % (backend, server, connections))
+        self._sync(backend, server, 'max_connections', connections)
+
+    def set_server_state(self, backend, server, state):
+        """
+        state - ready, drain or maint, servers in maint are written as disabled
+        """
+        if state not in ('ready', 'drain', 'maint'):
+            raise RuntimeApiError('Invalid server state %s' % state)
+
+        self._set('set server %s/%s state %s' % (backend, server, state))
+        self._sync(backend, server, 'disabled', state == 'maint')
+
+    def disable_server(self, backend, server):
+        self._set('disable server %s/%s' % (backend, server))
+        self._sync(backend, server, 'disabled', True)
+
+    def enable_server(self, backend, server):
+        self._set('enable server %s/%s' % (backend, server))
+        self._sync(backend, server, 'disabled', False)
+
+    @classmethod
+    def _change_command(cls, change):
+        if change.action != 'change' or change.server is None or change.section not in ('backend', 'listen'):
+            return None
+
+        if change.field == 'weight':
+            return 'set weight %s/%s %s' % (change.name, change.server, change.new)
+
+        if change.field == 'max_connections' and change.new:
+            return 'set maxconn server %s/%s %s' % (change.name, change.server, change.new)
+
+        if change.field == 'disabled':
+            return '%s server %s/%s' % ('disable' if change.new else 'enable', change.name, change.server)
+
+        return None
+
+    def apply(self, changes):
+        """
+        Apply the server weight, maxconn and disabled changes of a Config.diff()
+        at runtime, and return the changes that still need a reload, including
+        the ones haproxy refused.
+        """
+        pending = []
+        commands = []
+        applied = []
+
+        for change in changes:
+            command = self._change_command(change)
+
+            if command is None:
+                pending.append(change)
+
+            else:
+                commands.append(command)
+                applied.append(change)
+
+        for change, reply in zip(applied, self.execute_many(commands)):
+            if reply.strip():
+                pending.append(change)
+
+            else:
+                self._sync(change.name, change.server, change.field, change.new)
+
+        return pending
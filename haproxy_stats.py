@@ -0,0 +1,136 @@
+# coding=utf-8
+import csv
+import time
+from array import array
+
+
+RATE_FIELDS = ('stot', 'bin', 'bout', 'ereq', 'econ', 'eresp')
+
+
+def _numeric_column(values):
+    try:
+        return array('q', map(int, values))
+    except ValueError:
+        pass
+
+    try:
+        return array('q', [int(value) if value else 0 for value in values])
+    except ValueError:
+        return None
+
+
+def config_object(config, key):
+    """
+    The FrontendConfig, BackendConfig, ListenConfig or ServerConfig of config
+    for a (pxname, svname) key as haproxy names them, svname being FRONTEND,
+    BACKEND or the server name. None when the config does not define it.
+    """
+    proxy, name = key
+
+    if name == 'FRONTEND':
+        return config.frontends.get(proxy) or config.listens.get(proxy)
+
+    if name == 'BACKEND':
+        return config.backends.get(proxy) or config.listens.get(proxy)
+
+    section = config.backends.get(proxy) or config.listens.get(proxy)
+    return section.server.get(name) if section is not None else None
+
+
+class StatSnapshot(object):
+    """
+    The output of show stat stored by column, rows are addressed by their
+    (pxname, svname) key through index. Numeric fields are arrays of integers
+    with empty values read as 0, the other fields tuples of strings.
+    """
+    def __init__(self, fields, columns, timestamp=None):
+        """
+        fields - the CSV header
+        columns - field -> values of every row
+        """
+        self.fields = fields
+        self.columns = columns
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.keys = list(zip(columns.get('pxname', ()), columns.get('svname', ())))
+        self.index = dict((key, i) for i, key in enumerate(self.keys))
+        super(StatSnapshot, self).__init__()
+
+    @classmethod
+    def from_csv(cls, text, timestamp=None):
+        lines = text.splitlines()
+        if not lines:
+            return cls([], {}, timestamp)
+
+        fields = lines[0].lstrip('# ').rstrip(',').split(',')
+        body = [line for line in lines[1:] if line]
+        widths = set(line.count(',') for line in body)
+
+        if len(widths) == 1 and '"' not in text:
+            # every row has the same layout, cut the columns out of one flat list
+            width = widths.pop() + 1
+            values = ','.join(body).split(',')
+            raw_columns = [tuple(values[i::width]) for i in range(min(width, len(fields)))]
+
+        else:
+            raw_columns = list(zip(*csv.reader(body)))
+
+        columns = {}
+        for field, values in zip(fields, raw_columns):
+            column = _numeric_column(values)
+            columns[field] = values if column is None else column
+
+        return cls(fields, columns, timestamp)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def column(self, field):
+        return self.columns[field]
+
+    def get(self, key, field):
+        return self.columns[field][self.index[key]]
+
+    def row(self, key):
+        i = self.index[key]
+        return dict((field, self.columns[field][i]) for field in self.fields if field in self.columns)
+
+    def rates(self, previous, fields=RATE_FIELDS):
+        """
+        Per second rates of counter fields since a previous snapshot, as field ->
+        array of floats in the order of keys. The default fields give the
+        request, byte and error rates. Rows missing from the previous snapshot
+        rate 0, counters that went down (after a reload) count from 0.
+        """
+        elapsed = float(self.timestamp - previous.timestamp)
+        if elapsed <= 0:
+            raise ValueError('The previous snapshot is not older than this one')
+
+        if previous.keys == self.keys:
+            positions = None
+        else:
+            positions = [previous.index.get(key) for key in self.keys]
+
+        rates = {}
+        for field in fields:
+            if field not in self.columns or field not in previous.columns:
+                continue
+
+            current = self.columns[field]
+            before = previous.columns[field]
+
+            if positions is None:
+                pairs = zip(current, before)
+            else:
+                pairs = ((value, value if i is None else before[i]) for value, i in zip(current, positions))
+
+            rates[field] = array('d', [(value - last if value >= last else value) / elapsed
+                                       for value, last in pairs])
+
+        return rates
+
+    def join(self, config):
+        """
+        Yield (key, obj) for every row, see config_object().
+        """
+        for key in self.keys:
+            yield key, config_object(config, key)
@@ -0,0 +1,355 @@
+# coding=utf-8
+import asyncio
+import errno
+import os
+import re
+import socket
+import time
+from array import array
+
+from haproxy_logs import LatencyHistogram
+
+# haproxy_logs.HTTP_LINE_RE and TCP_LINE_RE on bytes, keeping backend, Tr, Tt,
+# status and bytes read
+HTTP_DATAGRAM_RE = re.compile(
+    br' \[[^\]]+\] \S+ ([^/\s]+)/\S+ -?\d+/-?\d+/-?\d+/(-?\d+)/\+?(-?\d+) (-?\d+) \+?(\d+) ')
+TCP_DATAGRAM_RE = re.compile(
+    br' \[[^\]]+\] \S+ ([^/\s]+)/\S+ -?\d+/-?\d+/\+?(-?\d+) \+?(\d+) ')
+
+# buckets of LatencyHistogram up to about 17 minutes, longer values count in the last one
+HISTOGRAM_BUCKETS = LatencyHistogram.bucket(1 << 20) + 1
+OTHER_KEY = b'__other__'
+
+
+def parse_log_address(address):
+    """
+    Split a log target of GlobalConfig.log into ('unix', path) or
+    ('udp', (host, port)), the port defaulting to 514.
+    """
+    prefix, _t, rest = address.partition('@')
+    if not _t:
+        prefix, rest = '', address
+
+    if prefix == 'unix' or (not prefix and rest.startswith('/')):
+        return 'unix', rest
+
+    if prefix not in ('', 'udp', 'udp4', 'udp6', 'ipv4', 'ipv6'):
+        raise ValueError('Unsupported log address %s' % address)
+
+    if rest.startswith('['):
+        host, _t, port = rest[1:].partition(']')
+        port = port.lstrip(':')
+    elif rest.count(':') == 1:
+        host, _t, port = rest.partition(':')
+    else:
+        host, port = rest, ''
+
+    return 'udp', (host, int(port) if port else 514)
+
+
+class RollingStats(object):
+    """
+    Counters of one backend over the last slots periods of slot_seconds, and
+    histograms of Tr and Tt over the current and the previous window of
+    slots * slot_seconds. Everything is allocated up front, the memory used
+    does not grow with the traffic.
+    """
+    __slots__ = ('requests', 'errors', 'bytes', 'tr', 'tt')
+
+    def __init__(self, slots):
+        self.requests = array('q', bytes(8 * slots))
+        self.errors = array('q', bytes(8 * slots))
+        self.bytes = array('q', bytes(8 * slots))
+        # [current, previous]
+        self.tr = [array('q', bytes(8 * HISTOGRAM_BUCKETS)), array('q', bytes(8 * HISTOGRAM_BUCKETS))]
+        self.tt = [array('q', bytes(8 * HISTOGRAM_BUCKETS)), array('q', bytes(8 * HISTOGRAM_BUCKETS))]
+
+    def clear_slot(self, slot):
+        self.requests[slot] = 0
+        self.errors[slot] = 0
+        self.bytes[slot] = 0
+
+    def rotate_histograms(self):
+        for histograms in (self.tr, self.tt):
+            previous = histograms.pop()
+            previous[:] = array('q', bytes(8 * HISTOGRAM_BUCKETS))
+            histograms.insert(0, previous)
+
+
+def _percentiles(histograms, percents):
+    counts = [current + previous for current, previous in zip(*histograms)]
+    total = sum(counts)
+    out = dict(('p%d' % percent, None) for percent in percents)
+    if not total:
+        return out
+
+    for percent in percents:
+        rank = max(1, int(round(total * percent / 100.0)))
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                out['p%d' % percent] = LatencyHistogram.bucket_value(bucket)
+                break
+
+    return out
+
+
+class SyslogReceiver(object):
+    """
+    Receive haproxy logs sent over syslog to a UDP or UNIX datagram socket and
+    keep rolling per backend counters and latency histograms.
+
+    Datagrams are read in batches of up to batch_size each time the socket is
+    readable, into one reused buffer and parsed as bytes. At most max_keys
+    backends are tracked, the others are counted together under
+    '__other__', so neither the memory nor the work per datagram grows with
+    what is received.
+
+    received, unparsed and full_batches count datagrams, datagrams that are
+    not haproxy log lines and reads that found batch_size datagrams waiting,
+    a sign the receiver is close to falling behind. The kernel drops what
+    does not fit in its receive buffer, sized by rcvbuf, see dropped().
+    """
+    def __init__(self, address, slots=60, slot_seconds=1.0, max_keys=1000, batch_size=256, rcvbuf=8 << 20,
+                 clock=time.monotonic):
+        self.address = address
+        self.slots = slots
+        self.slot_seconds = slot_seconds
+        self.max_keys = max_keys
+        self.batch_size = batch_size
+        self.rcvbuf = rcvbuf
+        self.clock = clock
+
+        self.received = 0
+        self.unparsed = 0
+        self.full_batches = 0
+
+        self.keys = {}
+        self._socket = None
+        self._path = None
+        self._loop = None
+        self._buffer = bytearray(65536)
+        self._slot = None
+        self._window = None
+        super(SyslogReceiver, self).__init__()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        A receiver bound to the first log target of the global section.
+        """
+        for address in config.globals.log:
+            if address not in ('stdout', 'stderr'):
+                return cls(address, **kwargs)
+
+        raise ValueError('The global section has no log target')
+
+    def open(self, replace=False):
+        """
+        Bind the socket and return its address. An existing UNIX socket path,
+        such as the /dev/log of the system logger, is only replaced with
+        replace=True, otherwise FileExistsError is raised. The replaced socket
+        is not restored by close().
+        """
+        kind, address = parse_log_address(self.address)
+
+        if kind == 'unix':
+            if os.path.lexists(address):
+                if not replace:
+                    raise FileExistsError(errno.EEXIST, 'Log socket already exists', address)
+
+                os.unlink(address)
+
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+            self._socket = socket.socket(family, socket.SOCK_DGRAM)
+
+        try:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        except OSError:
+            pass
+
+        try:
+            self._socket.bind(address)
+        except OSError:
+            self._socket.close()
+            self._socket = None
+            raise
+
+        if kind == 'unix':
+            # only the path this receiver created is removed by close()
+            self._path = address
+
+        self._socket.setblocking(False)
+        return self._socket.getsockname()
+
+    async def start(self, replace=False):
+        """
+        Open the socket, see open(), and start reading it on the running event
+        loop.
+        """
+        if self._socket is None:
+            self.open(replace)
+
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._socket.fileno(), self._read)
+
+    def close(self):
+        if self._socket is not None:
+            if self._loop is not None:
+                self._loop.remove_reader(self._socket.fileno())
+                self._loop = None
+
+            self._socket.close()
+            self._socket = None
+
+        if self._path is not None:
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+
+            self._path = None
+
+    def _read(self):
+        recv_into = self._socket.recv_into
+        view = memoryview(self._buffer)
+        datagrams = []
+
+        for _ in range(self.batch_size):
+            try:
+                size = recv_into(self._buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+
+            datagrams.append(bytes(view[:size]))
+        else:
+            self.full_batches += 1
+
+        view.release()
+        if datagrams:
+            self.add_datagrams(datagrams)
+
+    def dropped(self):
+        """
+        The datagrams the kernel dropped because the receive buffer was full,
+        read from /proc/net/udp. None for UNIX sockets or without /proc.
+        """
+        if self._socket is None or self._socket.family == socket.AF_UNIX:
+            return None
+
+        inode = str(os.fstat(self._socket.fileno()).st_ino)
+        for table in ('/proc/net/udp', '/proc/net/udp6'):
+            try:
+                with open(table) as handler:
+                    next(handler)
+                    for line in handler:
+                        fields = line.split()
+                        if fields[9] == inode:
+                            return int(fields[-1])
+            except (OSError, IndexError, ValueError, StopIteration):
+                continue
+
+        return None
+
+    def _advance(self, now):
+        slot = int(now / self.slot_seconds)
+        window = slot // self.slots
+
+        if self._slot is None:
+            self._slot, self._window = slot, window
+            return slot % self.slots
+
+        if slot != self._slot:
+            # clear the slots skipped since the last datagram, at most all of them
+            for skipped in range(self._slot + 1, min(slot, self._slot + self.slots) + 1):
+                for stats in self.keys.values():
+                    stats.clear_slot(skipped % self.slots)
+
+            self._slot = slot
+
+        if window != self._window:
+            for _ in range(min(window - self._window, 2)):
+                for stats in self.keys.values():
+                    stats.rotate_histograms()
+
+            self._window = window
+
+        return slot % self.slots
+
+    def _stats(self, backend):
+        stats = self.keys.get(backend)
+        if stats is None:
+            if len(self.keys) >= self.max_keys - 1 and backend != OTHER_KEY:
+                return self._stats(OTHER_KEY)
+
+            stats = self.keys[backend] = RollingStats(self.slots)
+
+        return stats
+
+    def add_datagrams(self, datagrams):
+        """
+        Count a batch of syslog datagrams (bytes) received now.
+        """
+        slot = self._advance(self.clock())
+        http_search = HTTP_DATAGRAM_RE.search
+        tcp_search = TCP_DATAGRAM_RE.search
+        bucket = LatencyHistogram.bucket
+        last = HISTOGRAM_BUCKETS - 1
+        keys = self.keys
+
+        for datagram in datagrams:
+            match = http_search(datagram)
+            if match is not None:
+                backend, tr, tt, status, size = match.groups()
+            else:
+                match = tcp_search(datagram)
+                if match is None:
+                    self.unparsed += 1
+                    continue
+
+                backend, tt, size = match.groups()
+                tr = status = None
+
+            stats = keys.get(backend)
+            if stats is None:
+                stats = self._stats(backend)
+
+            stats.requests[slot] += 1
+            stats.bytes[slot] += int(size)
+            if status is not None and status[:1] == b'5':
+                stats.errors[slot] += 1
+
+            if tr is not None and tr[:1] != b'-':
+                stats.tr[0][min(bucket(int(tr)), last)] += 1
+
+            if tt[:1] != b'-':
+                stats.tt[0][min(bucket(int(tt)), last)] += 1
+
+        self.received += len(datagrams)
+
+    def snapshot(self, percents=(50, 90, 99)):
+        """
+        backend -> requests, errors (5xx) and bytes over the last slots periods
+        with the request rate per second, and the Tr and Tt percentiles.
+        """
+        if self._slot is not None:
+            self._advance(self.clock())
+
+        seconds = float(self.slots * self.slot_seconds)
+        out = {}
+        for backend, stats in self.keys.items():
+            name = backend.decode('utf-8', 'replace')
+            requests = sum(stats.requests)
+            out[name] = {
+                'requests': requests,
+                'rate': requests / seconds,
+                'errors': sum(stats.errors),
+                'bytes': sum(stats.bytes),
+                'Tr': _percentiles(stats.tr, percents),
+                'Tt': _percentiles(stats.tt, percents),
+            }
+
+        return out
@@ -0,0 +1,330 @@
+# coding=utf-8
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+from haproxy_objects import Config, ConfigChange, ConfigIsInvalid, ConfigLoader
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """
+    The few inotify calls a watcher needs, through ctypes. Raises OSError
+    where inotify is not available.
+    """
+    def __init__(self):
+        name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(name, use_errno=True)
+
+        try:
+            self._add_watch = libc.inotify_add_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.watches = {}
+        super(Inotify, self).__init__()
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch %s failed' % path)
+
+        self.watches[wd] = path
+        return wd
+
+    def read(self, timeout=None):
+        """
+        The (directory, name, mask) of the events arriving within timeout
+        seconds, waiting forever when timeout is None.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((self.watches.get(wd), os.fsdecode(name), mask))
+
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class ConfigWatcher(object):
+    """
+    Keep a Config up to date with its files, for a single file or anything
+    ConfigLoader loads. Changes are seen through inotify on Linux, by polling
+    every poll_interval seconds elsewhere or with use_inotify=False.
+
+    A burst of events is coalesced until no new one came for delay seconds,
+    at most max_delay seconds for files that keep changing, then the config
+    is loaded again, parsing only the sections whose text
+    changed. callback(config, changes) receives the new config and a
+    ConfigChange for every section that was added, removed or changed, with
+    the old and new section objects. Unchanged sections are the same objects
+    in both configs, so don't modify them in place.
+
+    A load failing on an invalid config keeps the previous config, the error is
+    kept in last_error.
+    """
+    def __init__(self, paths, callback, delay=0.1, poll_interval=1.0, use_inotify=True, config_class=Config,
+                 max_delay=2.0):
+        if isinstance(paths, str):
+            paths = [paths]
+
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.loader = ConfigLoader(self.paths, config_class, cache_sections=True)
+        self.config = self.loader.load()
+        self.last_error = None
+
+        self._stamps = self._current_stamps()
+        self._inotify = None
+        self._names = {}
+        self._links = {}
+        self._running = False
+        self._thread = None
+
+        if use_inotify:
+            try:
+                self._inotify = Inotify()
+                self._watch()
+            except OSError:
+                self.close()
+
+        super(ConfigWatcher, self).__init__()
+
+    def _watch(self):
+        # the directories are watched, files are often replaced by a rename
+        for path in self.paths:
+            if os.path.isdir(path):
+                directory, name = path, None
+            else:
+                directory, name = os.path.split(path)
+
+            if directory not in self._names:
+                self._inotify.add_watch(directory)
+                self._names[directory] = set()
+
+            if self._names[directory] is not None:
+                if name is None:
+                    self._names[directory] = None
+                else:
+                    self._names[directory].add(name)
+
+            self._watch_links(directory, [name] if name is not None else os.listdir(directory))
+
+    def _watch_links(self, directory, names):
+        # Kubernetes ConfigMap volumes link every file through ..data, which
+        # an update swaps atomically, the files themselves get no event
+        links = self._links.setdefault(directory, set())
+        for name in names:
+            path = os.path.join(directory, name)
+            if not os.path.islink(path):
+                continue
+
+            target = os.readlink(path)
+            if not os.path.isabs(target):
+                first = target.split(os.sep, 1)[0]
+                if first not in ('', '.', '..'):
+                    links.add(first)
+
+    def _relevant(self, directory, name):
+        if name in self._links.get(directory, ()):
+            return True
+
+        names = self._names.get(directory, ())
+        if names is None:
+            return name.endswith('.cfg') and not name.startswith('.')
+
+        return name in names
+
+    def _current_stamps(self):
+        stamps = {}
+        for filename in self.loader.files():
+            try:
+                stamps[filename] = self.loader.stamp(filename)
+            except OSError:
+                pass
+
+        return stamps
+
+    @property
+    def uses_inotify(self):
+        return self._inotify is not None
+
+    def _wait(self, timeout):
+        """
+        Wait up to timeout seconds for a change, True when one came.
+        """
+        if self._inotify is None:
+            deadline = None if timeout is None else time.monotonic() + timeout
+
+            while True:
+                try:
+                    stamps = self._current_stamps()
+                except ConfigIsInvalid:
+                    # a path is missing for now, wait for it to come back
+                    stamps = None
+
+                if stamps is not None and stamps != self._stamps:
+                    return True
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+
+                time.sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+
+        # events on other files of the directories don't end the wait
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            events = self._inotify.read(timeout)
+            if any(self._relevant(directory, name) for directory, name, mask in events):
+                break
+
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return False
+
+        # coalesce the burst, other files of the directories don't extend it
+        start = time.monotonic()
+        quiet = start + self.delay
+        end = start + max(self.max_delay, self.delay)
+        while True:
+            timeout = min(quiet, end) - time.monotonic()
+            if timeout <= 0:
+                return True
+
+            events = self._inotify.read(timeout)
+            if any(self._relevant(directory, name) for directory, name, mask in events):
+                quiet = time.monotonic() + self.delay
+
+    def check(self, timeout=0):
+        """
+        Wait up to timeout seconds for changes (None waits until there are),
+        reload and call the callback. Returns the list of ConfigChange, empty
+        when nothing changed.
+        """
+        if not self._wait(timeout):
+            return []
+
+        if self._inotify is None and self.delay:
+            time.sleep(self.delay)
+
+        # the stamps are taken before loading, so that a config failing to load
+        # is not seen as changed again on every poll
+        try:
+            self._stamps = self._current_stamps()
+        except ConfigIsInvalid:
+            pass
+
+        try:
+            config = self.loader.load()
+
+        except (ConfigIsInvalid, OSError) as e:
+            self.last_error = e
+            return []
+
+        changes = diff_sections(self.config, config)
+        self.config = config
+        self.last_error = None
+
+        if changes:
+            self.callback(config, changes)
+
+        return changes
+
+    def run(self):
+        self._running = True
+        while self._running:
+            self.check(self.poll_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self.run, name='haproxy-watch')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+def diff_sections(old, new):
+    """
+    A ConfigChange for every section of new that is not the same object as
+    in old, with the whole old and new sections. global and defaults sections
+    that are not in the files are compared by their text.
+    """
+    changes = []
+
+    for section, attribute in (('global', 'globals'), ('defaults', 'defaults')):
+        old_section = getattr(old, attribute)
+        new_section = getattr(new, attribute)
+
+        if old_section is not new_section and old_section.to_string() != new_section.to_string():
+            changes.append(ConfigChange('change', section, old=old_section, new=new_section))
+
+    for section, old_sections, new_sections in (('frontend', old.frontends, new.frontends),
+                                                ('backend', old.backends, new.backends),
+                                                ('listen', old.listens, new.listens)):
+        for name in old_sections:
+            if name not in new_sections:
+                changes.append(ConfigChange('remove', section, name, old=old_sections[name]))
+
+        for name in new_sections:
+            if name not in old_sections:
+                changes.append(ConfigChange('add', section, name, new=new_sections[name]))
+
+            elif old_sections[name] is not new_sections[name]:
+                changes.append(ConfigChange('change', section, name, old=old_sections[name], new=new_sections[name]))
+
+    return changes
@@ -0,0 +1,166 @@
+# coding=utf-8
+import os
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+# the modules live at the top of the repository, which is not installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StatsSocketStandIn(object):
+    """
+    A stats socket answering the runtime API commands the tools send, on a
+    UNIX path or on ('127.0.0.1', 0) for TCP. Connections get one reply and
+    are closed, unless they start with prompt, as haproxy does. The set
+    commands answer nothing for the servers given as 'backend/server' and
+    'No such server.' for the others. A reply of None hangs up without
+    answering.
+    """
+    def __init__(self, address, servers=('app/app1', 'app/app2')):
+        self.servers = set(servers)
+        self.commands = []
+        self.connections = 0
+        self.delay = 0
+        self._open = set()
+        self._lock = threading.Lock()
+
+        stand_in = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                stand_in._serve(self.request, self.rfile)
+
+        if isinstance(address, str):
+            base = socketserver.ThreadingUnixStreamServer
+        else:
+            base = socketserver.ThreadingTCPServer
+
+        class Server(base):
+            daemon_threads = True
+            block_on_close = False
+
+        self._server = Server(address, Handler)
+        self.address = self._server.server_address
+        if not isinstance(self.address, str):
+            self.address = 'ipv4@%s:%d' % self.address
+
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        super(StatsSocketStandIn, self).__init__()
+
+    def reply(self, command):
+        words = command.split()
+        if command == 'show info':
+            return 'Name: HAProxy\nVersion: 2.8.0\nPid: 1\n'
+
+        if words[:1] in (['set'], ['disable'], ['enable']):
+            target = [word for word in words if '/' in word]
+            if target and target[0] in self.servers:
+                return ''
+
+            return 'No such server.\n'
+
+        return 'Unknown command.\n'
+
+    def _serve(self, connection, rfile):
+        with self._lock:
+            self.connections += 1
+            self._open.add(connection)
+
+        interactive = False
+        try:
+            for line in rfile:
+                command = line.decode('utf-8').strip()
+                if command == 'quit':
+                    break
+
+                if command == 'prompt':
+                    interactive = True
+                    connection.sendall(b'\n> ')
+                    continue
+
+                with self._lock:
+                    self.commands.append(command)
+
+                if self.delay:
+                    time.sleep(self.delay)
+
+                reply = self.reply(command)
+                if reply is None:
+                    break
+
+                reply = reply.encode('utf-8')
+                if not interactive:
+                    connection.sendall(reply)
+                    break
+
+                connection.sendall(reply + b'\n> ')
+
+        except OSError:
+            pass
+
+        finally:
+            with self._lock:
+                self._open.discard(connection)
+
+    def drop(self):
+        """
+        Close the open connections, as haproxy does after the stats timeout.
+        """
+        with self._lock:
+            connections = list(self._open)
+
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        deadline = time.monotonic() + 5
+        while self._open and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeClock(object):
+    """
+    Stands in for time.monotonic in the clock arguments, time only passes when
+    a test moves now.
+    """
+    def __init__(self):
+        self.now = 1000.0
+        super(FakeClock, self).__init__()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def socket_dir():
+    # short, UNIX socket paths are limited to about 100 bytes
+    path = tempfile.mkdtemp(prefix='hap')
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@pytest.fixture
+def stats_socket(socket_dir):
+    stand_in = StatsSocketStandIn(os.path.join(socket_dir, 'stats.sock'))
+    yield stand_in
+    stand_in.close()
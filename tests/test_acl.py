@@ -0,0 +1,125 @@
+# coding=utf-8
+import pytest
+
+from haproxy_acl import CompiledFrontend, PrefixTrie, Request, compile_config, parse_condition
+from haproxy_objects import Config
+
+CONFIG = """
+frontend web
+    bind :80
+    acl is_api path_beg /api/ /v2/api/
+    acl is_static path_end .css .js
+    acl is_admin hdr(host) -i admin.example.com
+    acl is_report path_reg ^/reports/[0-9]+$
+    acl office src 10.0.0.0/8 192.168.1.1
+    acl is_post method POST
+    acl bad_net src not-a-network
+    use_backend admin if is_admin office
+    use_backend admin_denied if is_admin
+    use_backend static if is_static or { path_beg /assets/ }
+    use_backend reports if is_report ! is_post
+    use_backend api if is_api
+    use_backend legacy unless is_api || is_static
+    default_backend app
+
+frontend internal
+    bind :8080
+    acl is_health path /health
+    use_backend health if is_health
+    default_backend ops
+"""
+
+
+@pytest.fixture
+def frontend():
+    config = Config.from_lines(CONFIG.splitlines())
+    return CompiledFrontend(config.frontends['web'])
+
+
+def _route(frontend, path, host='www.example.com', src='203.0.113.5', method='GET'):
+    return frontend.route(Request(host, path, src, method))
+
+
+def test_parse_condition():
+    assert parse_condition(['is_api', 'is_static']) == ([[('is_api', False), ('is_static', False)]], [])
+    assert parse_condition(['!', 'is_api', 'or', 'is_static']) == ([[('is_api', True)], [('is_static', False)]], [])
+    assert parse_condition(['!is_api', '||', 'a', '&&', 'b']) == ([[('is_api', True)], [('a', False), ('b', False)]],
+                                                                  [])
+    assert parse_condition(['!', '{', 'path_beg', '/x', '}', 'a']) == \
+        ([[('{path_beg /x}', True), ('a', False)]], [('{path_beg /x}', 'path_beg', '/x')])
+
+
+def test_prefix_trie():
+    trie = PrefixTrie()
+    trie.add('/api', 'api')
+    trie.add('/api/v2', 'v2')
+    trie.add('/b', 'b')
+
+    matched = set()
+    trie.match('/api/v2/users', matched)
+    assert matched == set(['api', 'v2'])
+
+    matched = set()
+    trie.match('/ap', matched)
+    assert not matched
+
+
+def test_exact_beg_end_reg_and_ip(frontend):
+    assert _route(frontend, '/api/users') == 'api'
+    assert _route(frontend, '/v2/api/users') == 'api'
+    assert _route(frontend, '/site.css?v=3') == 'static'
+    assert _route(frontend, '/reports/42') == 'reports'
+    assert _route(frontend, '/', host='ADMIN.example.com', src='10.1.2.3') == 'admin'
+    assert _route(frontend, '/', host='admin.example.com', src='192.168.1.1') == 'admin'
+    assert _route(frontend, '/', host='admin.example.com', src='192.168.1.2') == 'admin_denied'
+
+
+def test_anonymous_acl(frontend):
+    assert _route(frontend, '/assets/logo.png') == 'static'
+    assert '{path_beg /assets/}' in frontend.matched_acls(Request('www.example.com', '/assets/a'))
+
+
+def test_negation(frontend):
+    # is_post negated with a separate !, the api rule then takes nothing
+    assert _route(frontend, '/reports/42', method='POST') == 'legacy'
+
+
+def test_unless_and_default_backend(frontend):
+    assert _route(frontend, '/home') == 'legacy'
+
+    config = Config.from_lines(CONFIG.splitlines())
+    internal = compile_config(config)['internal']
+    assert internal.route(Request('ops', '/health')) == 'health'
+    assert internal.route(Request('ops', '/metrics')) == 'ops'
+
+
+def test_rules_in_config_order(frontend):
+    # both admin rules hold for the office, the first one wins
+    assert _route(frontend, '/', host='admin.example.com', src='10.0.0.1') == 'admin'
+    # is_api holds, legacy is only taken unless is_api
+    assert _route(frontend, '/api/x', src='10.0.0.1') == 'api'
+
+
+def test_unsupported_acls(frontend):
+    assert 'bad_net' in frontend.unsupported
+    assert _route(frontend, '/home', src='not-a-network') == 'legacy'
+
+
+def test_memoized_results_are_the_same(frontend):
+    requests = [Request('www.example.com', path, src, method)
+                for path in ('/api/a', '/site.js', '/reports/1', '/home', '/assets/x')
+                for src in ('10.0.0.1', '203.0.113.5')
+                for method in ('GET', 'POST')]
+
+    first = frontend.route_many(requests)
+    assert frontend._memo
+    assert frontend.route_many(requests) == first
+
+    unmemoized = CompiledFrontend(Config.from_lines(CONFIG.splitlines()).frontends['web'])
+    unmemoized.memo_size = 0
+    assert unmemoized.route_many(requests) == first
+
+    counts = frontend.hits(requests)
+    assert sum(counts.values()) == len(requests)
+    assert counts['api'] == 4
+    assert frontend.hits(requests, counts)['api'] == 8
@@ -0,0 +1,152 @@
+# coding=utf-8
+import random
+
+import pytest
+
+from haproxy_acl import Request
+from haproxy_balance import BalanceError, BalanceSimulator, synthetic_requests, weighted_cycle
+from haproxy_objects import Config
+
+CONFIG = """
+backend app
+    balance roundrobin
+    server app1 10.0.0.1:80 weight 1
+    server app2 10.0.0.2:80 weight 2
+    server app3 10.0.0.3:80 weight 3
+    server off 10.0.0.4:80 weight 5 disabled
+    server zero 10.0.0.5:80 weight 0
+    server spare1 10.0.0.6:80 weight 1 backup
+    server spare2 10.0.0.7:80 weight 1 backup
+
+backend spares
+    balance roundrobin
+    option allbackups
+    server spare1 10.0.0.6:80 weight 1 backup
+    server spare2 10.0.0.7:80 weight 3 backup
+"""
+
+
+@pytest.fixture
+def config():
+    return Config.from_lines(CONFIG.splitlines())
+
+
+def _requests(count):
+    return [Request('app.example.com', '/', '10.0.0.1')] * count
+
+
+def _reference_leastconn(weights, durations, interval=1.0):
+    # every server scanned at every request: fewest (connections + 1) / weight,
+    # then the one whose count changed least recently
+    connections = [0] * len(weights)
+    stamps = list(range(len(weights)))
+    counts = [0] * len(weights)
+    running = []
+
+    for n, duration in enumerate(durations):
+        now = n * interval
+        for item in sorted(running):
+            if item[0] <= now:
+                running.remove(item)
+                connections[item[1]] -= 1
+                stamps[item[1]] = n
+
+        i = min(range(len(weights)), key=lambda i: ((connections[i] + 1.0) / weights[i], stamps[i], i))
+        connections[i] += 1
+        counts[i] += 1
+        stamps[i] = n
+        running.append((now + duration, i))
+
+    return counts
+
+
+def test_weighted_cycle():
+    assert sorted(weighted_cycle([2, 4, 6])) == [0, 1, 1, 2, 2, 2]
+    assert weighted_cycle([0, 1]) == [1]
+
+    cycle = weighted_cycle([1, 3])
+    assert cycle.count(1) == 3
+    # the light server is not at either end of the round
+    assert cycle.index(0) not in (0, len(cycle) - 1)
+
+
+def test_roundrobin_follows_the_weights(config):
+    simulator = BalanceSimulator(config.backends['app'])
+    assert [name for name, weight in simulator.servers] == ['app1', 'app2', 'app3']
+
+    report = simulator.simulate(_requests(600))
+    assert report.counts == {'app1': 100, 'app2': 200, 'app3': 300}
+    assert report.imbalance == 1.0
+
+    report = simulator.simulate(_requests(7))
+    assert sum(report.counts.values()) == 7
+    assert max(report.counts.values()) - min(report.counts.values()) <= 3
+
+    override = BalanceSimulator(config.backends['app'], weights={'app1': 3, 'app3': 0})
+    assert override.simulate(_requests(600)).counts == {'app1': 360, 'app2': 240}
+
+
+def test_backups(config):
+    down = BalanceSimulator(config.backends['app'], down=['app1', 'app2', 'app3'])
+    assert down.simulate(_requests(10)).counts == {'spare1': 10}
+
+    spares = BalanceSimulator(config.backends['spares'])
+    assert spares.simulate(_requests(400)).counts == {'spare1': 100, 'spare2': 300}
+
+    nothing = BalanceSimulator(config.backends['spares'], down=['spare1', 'spare2'])
+    report = nothing.simulate(_requests(5))
+    assert report.counts == {}
+    assert report.unrouted == 5
+    assert nothing.server_for_key('10.0.0.1') is None
+
+
+@pytest.mark.parametrize('durations', [50.0, 2.5, 'random'])
+def test_leastconn_matches_a_full_scan(config, durations):
+    simulator = BalanceSimulator(config.backends['app'], balance='leastconn')
+    if durations == 'random':
+        rng = random.Random(3)
+        durations = [rng.expovariate(1 / 20.0) for _ in range(2000)]
+        per_request = durations
+    else:
+        per_request = [durations] * 2000
+
+    report = simulator.simulate(_requests(2000), durations=durations)
+    expected = _reference_leastconn([1, 2, 3], per_request)
+    assert [report.counts[name] for name in ('app1', 'app2', 'app3')] == expected
+
+
+def test_leastconn_spreads_long_requests_by_weight(config):
+    report = BalanceSimulator(config.backends['app'], balance='leastconn').simulate(_requests(6000))
+
+    assert report.imbalance < 1.05
+
+
+@pytest.mark.parametrize('balance', ['source', 'uri'])
+def test_consistent_hash_only_moves_the_keys_of_the_removed_server(config, balance):
+    simulator = BalanceSimulator(config.backends['app'], balance=balance, hash_type='consistent')
+    requests = synthetic_requests(5000, keys=1000, seed=4)
+
+    keys = simulator.key_counts(requests)
+    remapped = simulator.remapped(requests, 'app2')
+    on_app2 = sum(1 for key in keys if simulator.server_for_key(key) == 'app2')
+
+    assert remapped['keys'] == len(keys)
+    assert remapped['requests'] == 5000
+    assert remapped['moved_keys'] == remapped['forced_keys'] == on_app2 > 0
+    assert remapped['moved_requests'] == remapped['forced_requests']
+
+    map_based = BalanceSimulator(config.backends['app'], balance=balance).remapped(requests, 'app2')
+    assert map_based['moved_keys'] > map_based['forced_keys']
+
+
+def test_remapped_is_none_without_hashing(config):
+    simulator = BalanceSimulator(config.backends['app'])
+    assert simulator.remapped(synthetic_requests(10), 'app1') is None
+
+
+def test_unsupported_algorithms(config):
+    with pytest.raises(BalanceError):
+        BalanceSimulator(config.backends['app'], balance='first')
+
+    with pytest.raises(BalanceError):
+        BalanceSimulator(config.backends['app'], balance='source', hash_type='jump')
@@ -0,0 +1,95 @@
+# coding=utf-8
+import asyncio
+import os
+
+import pytest
+from conftest import StatsSocketStandIn
+
+from haproxy_fleet import FleetClient, parse_address
+from haproxy_objects import Config
+from haproxy_runtime import RuntimeApiError
+
+
+@pytest.fixture
+def nodes(socket_dir):
+    stand_ins = [StatsSocketStandIn(os.path.join(socket_dir, 'node%d.sock' % i)) for i in range(2)]
+    stand_ins.append(StatsSocketStandIn(('127.0.0.1', 0)))
+    yield stand_ins
+    for stand_in in stand_ins:
+        stand_in.close()
+
+
+def test_parse_address():
+    assert parse_address('/run/haproxy.sock') == ('unix', '/run/haproxy.sock')
+    assert parse_address('unix@/run/haproxy.sock') == ('unix', '/run/haproxy.sock')
+    assert parse_address('ipv4@10.0.0.1:9999') == ('tcp', ('10.0.0.1', 9999))
+    assert parse_address('ipv6@[::1]:9999') == ('tcp', ('::1', 9999))
+
+    with pytest.raises(RuntimeApiError):
+        parse_address('abns@haproxy:1')
+
+
+def test_every_node_answers(nodes):
+    client = FleetClient([node.address for node in nodes])
+    result = client.show_info()
+
+    assert result.ok
+    assert sorted(result.replies) == sorted(node.address for node in nodes)
+    assert all(info['Name'] == 'HAProxy' for info in result.replies.values())
+
+    result = client.set_weight('app', 'app1', 0)
+    assert result.ok
+    assert all(node.commands == ['show info', 'set weight app/app1 0'] for node in nodes)
+
+
+def test_failing_nodes_do_not_stop_the_others(nodes, socket_dir):
+    nodes[0].servers = set()
+    nodes[1].delay = 2
+    missing = os.path.join(socket_dir, 'missing.sock')
+    client = FleetClient(dict([(node.address, 10) for node in nodes] + [(missing, 10)]), timeout=10)
+    client.timeouts[nodes[1].address] = 0.2
+
+    result = client.set_weight('app', 'app1', 0)
+
+    assert list(result.replies) == [nodes[2].address]
+    assert sorted(result.errors) == sorted([nodes[0].address, nodes[1].address, missing])
+    assert 'No such server' in str(result.errors[nodes[0].address])
+    assert isinstance(result.errors[nodes[1].address], asyncio.TimeoutError)
+    assert isinstance(result.errors[missing], OSError)
+
+
+def test_concurrency(nodes):
+    for node in nodes:
+        node.delay = 0.2
+
+    client = FleetClient([node.address for node in nodes], concurrency=3)
+    loop_time = asyncio.run(_timed(client.execute_async('show info')))
+    assert loop_time < 0.5
+
+    client = FleetClient([node.address for node in nodes], concurrency=1)
+    loop_time = asyncio.run(_timed(client.execute_async('show info')))
+    assert loop_time >= 0.6
+
+
+async def _timed(coroutine):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await coroutine
+    return loop.time() - start
+
+
+def test_from_configs(nodes):
+    configs = []
+    for node, timeout in zip(nodes, ('1s', '2s', '3000')):
+        config = Config()
+        config.globals.set_stats_socket(node.address)
+        config.globals.stats['timeout'] = timeout
+        configs.append(config)
+
+    client = FleetClient.from_configs(configs)
+    assert client.timeouts == dict(zip([node.address for node in nodes], (1, 2, 3)))
+    assert client.show_info().ok
+
+    configs[1].globals.set_stats_socket(nodes[0].address)
+    with pytest.raises(RuntimeApiError, match='several configs'):
+        FleetClient.from_configs(configs)
@@ -0,0 +1,231 @@
+# coding=utf-8
+import asyncio
+import socket
+
+from haproxy_health import HealthProber, parse_httpchk
+from haproxy_objects import BackendConfig, Config, ServerConfig
+
+
+class StandIn(object):
+    """
+    A local HTTP server answering checks with status, closing connections
+    without answering (status 'close') or never answering (status 'hang').
+    """
+    def __init__(self, status=200):
+        self.status = status
+        self.connections = 0
+        self.requests = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                self.requests += 1
+
+                if self.status == 'close':
+                    break
+
+                if self.status == 'hang':
+                    await asyncio.sleep(3600)
+
+                writer.write(b'HTTP/1.1 %d X\r\nContent-Length: 2\r\n\r\nok' % self.status)
+                await writer.drain()
+                if b'connection: close' in head.lower():
+                    break
+
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+
+        finally:
+            writer.close()
+
+    def close(self):
+        self._server.close()
+
+
+def _free_port():
+    # a port nothing listens on
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def _config(ports, mode='http', httpchk='GET /health HTTP/1.1\\r\\nHost:\\ test'):
+    backend = BackendConfig()
+    backend.name = 'app'
+    backend.mode = mode
+    backend.option['httpchk'] = httpchk
+    for name, port in sorted(ports.items()):
+        backend.add_server(ServerConfig.from_parts((name, '127.0.0.1:%d' % port, 'check', 'inter', '1000',
+                                                    'fall', '2')))
+
+    config = Config()
+    config.backends['app'] = backend
+    return config
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_parse_httpchk():
+    assert parse_httpchk('/ GET HTTP/1.0') == ('GET', '/', 'HTTP/1.0')
+    assert parse_httpchk('') == ('OPTIONS', '/', 'HTTP/1.0')
+    assert parse_httpchk('GET /health HTTP/1.1\\r\\nHost:\\ www') == ('GET', '/health', 'HTTP/1.1\r\nHost: www')
+
+
+def test_down_after_fall_and_up_after_rise():
+    async def scenario():
+        good, failing, closing = StandIn(200), StandIn(503), StandIn('close')
+        ports = {'good': await good.start(), 'failing': await failing.start(), 'closing': await closing.start(),
+                 'gone': _free_port()}
+        transitions = []
+        prober = HealthProber(_config(ports), callback=transitions.append, rise=2)
+
+        try:
+            # one failure is below fall
+            assert await prober.run_once_async() == []
+            assert all(prober.states().values())
+
+            down = await prober.run_once_async()
+            assert sorted(t.server for t in down) == ['closing', 'failing', 'gone']
+            assert not any(t.up for t in down)
+            assert prober.states()[('app', 'good')]
+
+            failing.status = 200
+            assert await prober.run_once_async() == []
+            up = await prober.run_once_async()
+            assert [(t.server, t.up, t.reason) for t in up] == [('failing', True, 'HTTP 200')]
+            # the callback runs as checks complete, not in the order of checks
+            assert sorted(transitions) == sorted(down + up)
+            assert list(prober.transitions) == transitions
+
+        finally:
+            prober.close()
+            for server in (good, failing, closing):
+                server.close()
+
+    _run(scenario())
+
+
+def test_keep_alive_reuses_the_connection():
+    async def scenario():
+        server = StandIn(200)
+        prober = HealthProber(_config({'web': await server.start()}))
+
+        try:
+            for _ in range(3):
+                await prober.run_once_async()
+
+            assert server.requests == 3
+            assert server.connections == 1
+
+        finally:
+            prober.close()
+            server.close()
+
+    _run(scenario())
+
+
+def test_http_1_0_checks_close_their_connection():
+    async def scenario():
+        server = StandIn(200)
+        prober = HealthProber(_config({'web': await server.start()}, httpchk='GET / HTTP/1.0'))
+
+        try:
+            for _ in range(2):
+                await prober.run_once_async()
+
+            assert server.requests == 2
+            assert server.connections == 2
+
+        finally:
+            prober.close()
+            server.close()
+
+    _run(scenario())
+
+
+def test_timeout():
+    async def scenario():
+        server = StandIn('hang')
+        prober = HealthProber(_config({'slow': await server.start()}), timeout=0.2)
+
+        try:
+            await prober.run_once_async()
+            transitions = await prober.run_once_async()
+
+            assert [(t.server, t.up, t.reason) for t in transitions] == [('slow', False, 'timeout')]
+
+        finally:
+            prober.close()
+            server.close()
+
+    _run(scenario())
+
+
+def test_tcp_checks():
+    async def scenario():
+        server = StandIn(503)
+        prober = HealthProber(_config({'db1': await server.start(), 'db2': _free_port()}, mode='tcp'))
+
+        try:
+            await prober.run_once_async()
+            transitions = await prober.run_once_async()
+
+            # a tcp check only connects, the 503 is never asked for
+            assert [(t.server, t.up) for t in transitions] == [('db2', False)]
+            assert server.requests == 0
+
+        finally:
+            prober.close()
+            server.close()
+
+    _run(scenario())
+
+
+def test_run_checks_at_the_server_interval():
+    async def scenario():
+        server = StandIn(200)
+        config = _config({'web': await server.start()})
+        config.backends['app'].server['web'].set_check_inter(100)
+        prober = HealthProber(config, spread=0)
+
+        try:
+            await prober.run_async(0.55)
+            assert 4 <= server.requests <= 6
+
+        finally:
+            server.close()
+
+    _run(scenario())
+
+
+def test_run_once_again_with_more_servers_than_concurrency():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    # connections are never accepted, the backlog holds all of them
+    listener.listen(64)
+    port = listener.getsockname()[1]
+
+    try:
+        ports = dict(('db%d' % i, port) for i in range(6))
+        prober = HealthProber(_config(ports, mode='tcp'), concurrency=2, timeout=1)
+
+        # every run has its own event loop
+        for _ in range(3):
+            assert prober.run_once() == []
+
+        assert all(check.last_reason == 'connected' for check in prober.checks)
+
+    finally:
+        listener.close()
+
+    prober.run_once()
+    assert len(prober.run_once()) == 6
@@ -0,0 +1,74 @@
+# coding=utf-8
+import os
+
+import pytest
+
+from haproxy_objects import Config, ConfigIsInvalid, ConfigLoader
+
+
+def _backend(name, weight=10):
+    return 'backend %s\n    server %s1 10.0.0.1:80 weight %d\n\n' % (name, name, weight)
+
+
+@pytest.fixture
+def conf_d(tmp_path):
+    (tmp_path / '00-global.cfg').write_text('global\n    daemon\n    maxconn 1000\n\n')
+    for i in range(20):
+        (tmp_path / ('%02d-app.cfg' % (i + 1))).write_text(_backend('a%d' % i) + _backend('b%d' % i))
+
+    (tmp_path / '.hidden.cfg').write_text(_backend('hidden'))
+    (tmp_path / 'notes.txt').write_text(_backend('notes'))
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize('cache_sections', [False, True])
+def test_first_load_in_the_pool(conf_d, cache_sections):
+    loader = ConfigLoader(conf_d, processes=2, pool_threshold=4, cache_sections=cache_sections)
+    config = loader.load()
+
+    assert config.globals.max_connections == 1000
+    assert list(config.backends) == ['a%d' % i if j == 0 else 'b%d' % i for i in range(20) for j in range(2)]
+    assert config.to_string() == ConfigLoader(conf_d, processes=1).load().to_string()
+
+
+def test_cached_sections_of_a_changed_file(conf_d):
+    loader = ConfigLoader(conf_d, processes=2, pool_threshold=4, cache_sections=True)
+    first = loader.load()
+
+    path = os.path.join(conf_d, '03-app.cfg')
+    with open(path, 'w') as handler:
+        handler.write(_backend('a2', weight=50) + _backend('b2'))
+
+    second = loader.load()
+    assert second.backends['a2'].server['a21'].weight == 50
+    assert second.backends['a2'] is not first.backends['a2']
+    # the unchanged section of the changed file comes from its cache
+    assert second.backends['b2'] is first.backends['b2']
+    assert second.backends['a0'] is first.backends['a0']
+    assert loader._caches[path].hits == 1
+
+
+def test_files_added_and_removed(conf_d):
+    loader = ConfigLoader(conf_d, cache_sections=True)
+    loader.load()
+
+    os.unlink(os.path.join(conf_d, '20-app.cfg'))
+    with open(os.path.join(conf_d, '21-app.cfg'), 'w') as handler:
+        handler.write(_backend('c0'))
+
+    config = loader.load()
+    assert 'a19' not in config.backends
+    assert 'c0' in config.backends
+    assert os.path.join(conf_d, '20-app.cfg') not in loader._caches
+
+
+def test_from_files(conf_d, tmp_path):
+    # not a .cfg, the directory scan leaves it out
+    extra = tmp_path / 'extra.conf'
+    extra.write_text(_backend('extra'))
+
+    config = Config.from_files([conf_d, str(extra)])
+    assert list(config.backends)[-1] == 'extra'
+
+    with pytest.raises(ConfigIsInvalid):
+        Config.from_files([str(tmp_path / 'missing.cfg')])
@@ -0,0 +1,163 @@
+# coding=utf-8
+import gzip
+import pickle
+import random
+
+import pytest
+
+from haproxy_logs import (LatencyHistogram, LogAggregate, LogStats, analyze_logs, iter_records, parse_line,
+                          read_lines, split_logs)
+
+HTTP_LINE = ('Oct 17 20:31:00 lb haproxy[1]: 10.0.1.2:33317 [17/Oct/2026:20:31:00.655] %s %s/%s '
+             '%d/0/%d/%d/%d %d %d - - %s 1/1/0/0/0 0/0 "GET /index.html HTTP/1.1"\n')
+TCP_LINE = ('Oct 17 20:31:00 lb haproxy[1]: 10.0.1.2:33313 [17/Oct/2026:20:31:00.443] db db/db1 0/%d/%d 212 %s '
+            '0/0/0/0/3 0/0\n')
+
+
+def _http(frontend='web', backend='app', server='app1', tq=10, tc=1, tr=30, tt=50, status=200, size=2750,
+          termination='----'):
+    return HTTP_LINE % (frontend, backend, server, tq, tc, tr, tt, status, size, termination)
+
+
+def _lines(count, seed=7):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        if i % 50 == 49:
+            lines.append('Oct 17 20:31:00 lb haproxy[1]: Proxy app started.\n')
+        elif i % 10 == 9:
+            lines.append(TCP_LINE % (rng.randint(0, 20), rng.randint(0, 5000), '--'))
+        else:
+            lines.append(_http(frontend=rng.choice(['web', 'web~']), server=rng.choice(['app1', 'app2']),
+                               tr=rng.choice([-1, rng.randint(0, 3000)]), tt=rng.randint(0, 5000),
+                               status=rng.choice([200, 200, 404, 503]), size=rng.randint(0, 10000),
+                               termination=rng.choice(['----', 'SC--'])))
+
+    return lines
+
+
+def _exported(aggregate):
+    return (aggregate.lines, aggregate.unparsed,
+            dict((key, stats.__dict__()) for key, stats in aggregate.routes.items()))
+
+
+def test_parse_http_line():
+    record = parse_line(_http(frontend='web~', tq=-1, tr=-1, status=503, termination='SC--'))
+
+    assert record.mode == 'http'
+    assert (record.frontend, record.backend, record.server) == ('web', 'app', 'app1')
+    assert (record.Tq, record.Tw, record.Tc, record.Tr, record.Tt) == (None, 0, 1, None, 50)
+    assert (record.status, record.bytes, record.termination) == (503, 2750, 'SC--')
+
+
+def test_parse_tcp_line():
+    record = parse_line(TCP_LINE % (3, 5007, 'cD'))
+
+    assert record.mode == 'tcp'
+    assert (record.frontend, record.backend, record.server) == ('db', 'db', 'db1')
+    assert (record.Tq, record.Tw, record.Tc, record.Tr, record.Tt) == (None, 0, 3, None, 5007)
+    assert (record.status, record.bytes, record.termination) == (None, 212, 'cD')
+
+
+def test_other_lines_are_not_parsed():
+    assert parse_line('Oct 17 20:31:00 lb haproxy[1]: Proxy app started.') is None
+    assert parse_line('') is None
+    assert list(iter_records([_http(), 'noise\n', _http()])) == [parse_line(_http())] * 2
+
+
+def test_buckets_are_within_three_percent():
+    # half a bucket is at most 1/32 of the values in it
+    for value in list(range(5000)) + [10 ** 5, 10 ** 6 + 7, 2 ** 31 - 1]:
+        middle = LatencyHistogram.bucket_value(LatencyHistogram.bucket(value))
+        assert abs(middle - value) <= value / 32.0
+
+
+def test_percentiles():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    assert histogram.mean() is None
+
+    rng = random.Random(1)
+    values = sorted(int(rng.expovariate(1 / 200.0)) for _ in range(10000))
+    for value in values:
+        histogram.add(value)
+
+    for percent in (50, 90, 99):
+        exact = values[int(round(len(values) * percent / 100.0)) - 1]
+        assert abs(histogram.percentile(percent) - exact) <= exact / 32.0
+
+    assert histogram.percentile(100) == histogram.max == values[-1]
+    assert histogram.mean() == pytest.approx(sum(values) / float(len(values)))
+
+    copy = pickle.loads(pickle.dumps(histogram))
+    assert copy.__dict__() == histogram.__dict__()
+
+
+def test_merged_histograms_are_the_histogram_of_all_values():
+    rng = random.Random(2)
+    values = [rng.randint(0, 100000) for _ in range(5000)]
+
+    whole = LatencyHistogram()
+    parts = [LatencyHistogram() for _ in range(3)]
+    for i, value in enumerate(values):
+        whole.add(value)
+        parts[i % 3].add(value)
+
+    merged = LatencyHistogram()
+    for part in parts:
+        merged.merge(part)
+
+    assert merged.__dict__() == whole.__dict__()
+    assert merged.counts == whole.counts
+
+
+def test_add_lines_counts_like_log_stats():
+    lines = _lines(500)
+    aggregate = LogAggregate().add_lines(lines)
+
+    expected = {}
+    for record in iter_records(lines):
+        expected.setdefault((record.frontend, record.backend, record.server), LogStats()).add(record)
+
+    assert aggregate.lines == 500
+    assert aggregate.unparsed == 10
+    assert sorted(aggregate.routes) == sorted(expected)
+    for key, stats in expected.items():
+        assert aggregate.routes[key].__dict__() == stats.__dict__()
+
+    rolled_up = aggregate.stats()
+    assert rolled_up[('app', 'BACKEND')].requests == \
+        rolled_up[('app', 'app1')].requests + rolled_up[('app', 'app2')].requests
+    assert rolled_up[('web', 'FRONTEND')].requests == rolled_up[('app', 'BACKEND')].requests
+
+
+def test_ranges_share_out_every_line_once(tmp_path):
+    path = str(tmp_path / 'haproxy.log')
+    lines = _lines(40)
+    with open(path, 'w') as handler:
+        handler.writelines(lines)
+
+    for chunk_size in (1, 7, 100, 333):
+        read = []
+        for chunk in split_logs([path], chunk_size):
+            read.extend(read_lines(*chunk))
+
+        assert read == lines
+
+
+def test_chunks_merge_to_the_whole_file(tmp_path):
+    lines = _lines(2000)
+    path = str(tmp_path / 'haproxy.log')
+    with open(path, 'w') as handler:
+        handler.writelines(lines[:1500])
+
+    rotated = str(tmp_path / 'haproxy.log.1.gz')
+    with gzip.open(rotated, 'wt') as handler:
+        handler.writelines(lines[1500:])
+
+    whole = _exported(LogAggregate().add_lines(lines))
+
+    assert len(split_logs([path, rotated], chunk_size=4096)) > 3
+    assert _exported(analyze_logs([path, rotated], processes=1, chunk_size=4096)) == whole
+    assert _exported(analyze_logs([path, rotated], processes=2, chunk_size=4096)) == whole
+    assert _exported(analyze_logs(path, processes=1)) == _exported(LogAggregate().add_lines(lines[:1500]))
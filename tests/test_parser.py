@@ -0,0 +1,69 @@
+# coding=utf-8
+import os
+
+import pytest
+
+from haproxy_objects import Config, ConfigLoader, SectionCache
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SOURCE = os.path.join(DATA, 'baseline.cfg')
+
+
+def _expected():
+    # rendered by the line by line parser the single pass replaced, which
+    # ignored the server weight keyword
+    with open(os.path.join(DATA, 'baseline.expected')) as handler:
+        text = handler.read()
+
+    return text.replace('app1 10.0.0.1:80 weight 1 ', 'app1 10.0.0.1:80 weight 10 ') \
+        .replace('app2 10.0.0.2:80 weight 1 ', 'app2 10.0.0.2:80 weight 20 ')
+
+
+def _parsed():
+    return Config.from_string(SOURCE)
+
+
+def _parsed_lazy():
+    config = Config.from_string(SOURCE, lazy=True)
+    # sections never read render as their source text
+    for sections in (config.frontends, config.backends, config.listens):
+        for name in sections:
+            sections[name]
+
+    return config
+
+
+def _parsed_from_cache():
+    cache = SectionCache()
+    Config.from_string(SOURCE, cache=cache)
+    return Config.from_string(SOURCE, cache=cache)
+
+
+def _loaded():
+    return ConfigLoader(SOURCE).load()
+
+
+@pytest.mark.parametrize('parse', [_parsed, _parsed_lazy, _parsed_from_cache, _loaded])
+def test_same_output_as_the_baseline_parser(parse):
+    assert parse().to_string() == _expected()
+
+
+def test_sections_and_fields():
+    config = _parsed()
+
+    assert list(config.frontends) == ['web']
+    assert list(config.backends) == ['app', 'api', 'static']
+    assert list(config.listens) == ['stats']
+    assert config.globals.max_connections == 4096
+    assert config.globals.number_processes == 2
+    assert config.defaults.retries == 3
+    assert config.frontends['web'].default_backend == 'app'
+    assert config.backends['app'].server['app3'].port == 8080
+    assert config.listens['stats'].server['stats1'].ip == '127.0.0.1'
+
+
+def test_from_lines_is_the_same_as_from_string():
+    with open(SOURCE) as handler:
+        lines = handler.read().splitlines()
+
+    assert Config.from_lines(lines).to_string() == _parsed().to_string()
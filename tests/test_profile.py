@@ -0,0 +1,56 @@
+# coding=utf-8
+import pytest
+
+import haproxy_objects
+from haproxy_objects import Config, ConfigIsInvalid, ParseProfile
+
+CONFIG = """global
+    daemon
+    maxconn 4096
+    some-new-keyword on
+
+backend app
+    balance roundrobin
+    server app1 10.0.0.1:80 weight 10 check
+    server app2 10.0.0.2:80 weight 20 check inter 2000 fall 3 new-option 5
+
+backend api
+    server api1 10.0.1.1:8080 check
+"""
+
+
+def test_profile_counts_the_real_handlers():
+    with ParseProfile() as profile:
+        profiled = Config.from_lines(CONFIG.splitlines())
+
+    assert haproxy_objects._profile is None
+    assert profiled.to_string() == Config.from_lines(CONFIG.splitlines()).to_string()
+
+    assert profile.sections['BackendConfig'][0] == 2
+    assert profile.sections['BackendConfig'][2] == sum(len(backend._raw) for backend in profiled.backends.values())
+    assert profile.directives[('BackendConfig', 'server')][0] == 3
+    assert profile.directives[('ServerConfig', 'weight')][0] == 2
+    assert profile.directives[('ServerConfig', 'check')][0] == 3
+    # inter and fall are consumed by the check handler
+    assert ('ServerConfig', 'inter') not in profile.directives
+    assert profile.unknown[('GlobalConfig', 'some-new-keyword')] == 1
+    assert profile.unknown[('ServerConfig', 'new-option')] == 1
+    assert profile.unknown[('ServerConfig', '5')] == 1
+
+    exported = profile.__dict__()
+    weight = exported['directives']['ServerConfig weight']
+    assert weight == {'count': 2, 'seconds': profile.directives[('ServerConfig', 'weight')][1]}
+    assert 'BackendConfig' in profile.to_string()
+
+
+def test_profile_checks_arity_like_the_parser():
+    lines = ['backend app', '    server app1 10.0.0.1:80 weight']
+
+    with pytest.raises(ConfigIsInvalid):
+        Config.from_lines(lines)
+
+    with ParseProfile():
+        with pytest.raises(ConfigIsInvalid):
+            Config.from_lines(lines)
+
+    assert haproxy_objects._profile is None
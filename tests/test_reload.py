@@ -0,0 +1,204 @@
+# coding=utf-8
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from haproxy_objects import BackendConfig, Config, ServerConfig
+from haproxy_reload import ReloadError, ReloadScheduler, command_reload
+
+
+def _config():
+    backend = BackendConfig()
+    backend.name = 'app'
+    backend.add_server(ServerConfig.from_parts(('app1', '10.0.0.1:80', 'weight', '10')))
+
+    config = Config()
+    config.backends['app'] = backend
+    return config
+
+
+@pytest.fixture
+def scheduler(tmp_path, clock):
+    reloads = []
+    scheduler = ReloadScheduler(_config(), str(tmp_path / 'haproxy.cfg'), reload=lambda: reloads.append(clock()),
+                                window=0.5, min_interval=5, max_delay=30, clock=clock)
+    scheduler.reload_times = reloads
+    return scheduler
+
+
+def _set_weight(scheduler, weight):
+    with scheduler.edit() as config:
+        config.backends['app'].server['app1'].set_weight(weight)
+
+
+def test_a_burst_of_changes_reloads_once(scheduler):
+    clock = scheduler.clock
+    for weight in range(5):
+        _set_weight(scheduler, weight)
+        clock.now += 0.1
+        assert scheduler.poll() is None
+
+    assert scheduler.due() == pytest.approx(clock.now + 0.4)
+    clock.now += 0.4
+    assert scheduler.poll() is True
+
+    assert scheduler.saves == 1
+    assert scheduler.reloads == 1
+    assert 'weight 4' in open(scheduler.filename).read()
+    assert not scheduler.pending
+    assert scheduler.poll() is None
+
+
+def test_max_delay_bounds_a_steady_stream(scheduler):
+    clock = scheduler.clock
+    start = clock.now
+    while scheduler.poll() is None:
+        _set_weight(scheduler, int(clock.now - start) + 1)
+        clock.now += 0.25
+
+    assert clock.now - start == pytest.approx(30)
+    assert scheduler.reloads == 1
+
+
+def test_reloads_are_min_interval_apart(scheduler):
+    clock = scheduler.clock
+    _set_weight(scheduler, 1)
+    assert scheduler.flush() is True
+
+    _set_weight(scheduler, 2)
+    clock.now += 1
+    assert scheduler.poll() is None
+    assert scheduler.due() == pytest.approx(scheduler.reload_times[0] + 5)
+
+    clock.now = scheduler.due()
+    assert scheduler.poll() is True
+    assert scheduler.reload_times[1] - scheduler.reload_times[0] == 5
+
+
+def test_unchanged_text_is_not_reloaded(scheduler):
+    _set_weight(scheduler, 10)
+    assert scheduler.flush() is True
+
+    # the same weight again renders the same file
+    _set_weight(scheduler, 10)
+    scheduler.clock.now += 10
+    assert scheduler.poll() is False
+    assert scheduler.saves == 2
+    assert scheduler.reloads == 1
+
+
+def test_a_failed_reload_is_retried_with_backoff(scheduler):
+    clock = scheduler.clock
+    failures = [ReloadError('haproxy -c failed')] * 4
+    attempts = []
+
+    def reload():
+        attempts.append(clock())
+        if failures:
+            raise failures.pop()
+
+    scheduler.reload = reload
+    _set_weight(scheduler, 1)
+    start = clock.now
+
+    with pytest.raises(ReloadError):
+        scheduler.flush()
+
+    assert scheduler.pending
+    assert scheduler.reloads == 0
+
+    # polled every 0.25s, the retries come 5, 10, 20 and then max_delay 30s apart
+    while scheduler.reloads == 0:
+        try:
+            scheduler.poll()
+        except ReloadError:
+            pass
+
+        clock.now += 0.25
+
+    assert [round(attempt - start, 1) for attempt in attempts] == [0, 5, 15, 35, 65]
+    assert scheduler.failures == 0
+    assert not scheduler.pending
+
+    # a new change is not held back once the reload went through
+    _set_weight(scheduler, 2)
+    clock.now += 5
+    assert scheduler.poll() is True
+
+
+def test_a_failed_save_is_retried_with_backoff(scheduler, tmp_path):
+    scheduler.filename = str(tmp_path / 'missing' / 'haproxy.cfg')
+    _set_weight(scheduler, 1)
+
+    scheduler.clock.now += 1
+    with pytest.raises(OSError):
+        scheduler.poll()
+
+    assert scheduler.failures == 1
+    assert scheduler.poll() is None
+    assert scheduler.due() == pytest.approx(scheduler.clock.now + 5)
+
+
+def test_edits_are_not_blocked_by_a_reload(scheduler):
+    edited = threading.Event()
+
+    def edit():
+        _set_weight(scheduler, 3)
+        edited.set()
+
+    def reload():
+        thread = threading.Thread(target=edit)
+        thread.start()
+        assert edited.wait(5)
+        thread.join()
+
+    scheduler.reload = reload
+    _set_weight(scheduler, 2)
+    assert scheduler.flush() is True
+
+    # the edit made during the reload is pending for the next one
+    assert edited.is_set()
+    assert scheduler.pending
+    assert 'weight 2' in open(scheduler.filename).read()
+
+
+def test_thread_saves_in_the_background(tmp_path):
+    reloads = []
+    scheduler = ReloadScheduler(_config(), str(tmp_path / 'haproxy.cfg'), reload=lambda: reloads.append(1),
+                                window=0.05, min_interval=0.1, max_delay=1)
+    scheduler.start()
+
+    try:
+        _set_weight(scheduler, 7)
+        deadline = time.monotonic() + 5
+        while not reloads and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert reloads == [1]
+        _set_weight(scheduler, 8)
+
+    finally:
+        scheduler.stop()
+
+    assert 'weight 8' in open(scheduler.filename).read()
+    assert reloads == [1, 1]
+
+
+def test_command_reload(tmp_path):
+    marker = tmp_path / 'reloaded'
+    command_reload([sys.executable, '-c', 'open(%r, "w").close()' % str(marker)])()
+    assert os.path.exists(str(marker))
+
+    with pytest.raises(ReloadError, match='exited with 3: broken'):
+        command_reload([sys.executable, '-c', 'import sys; print("broken"); sys.exit(3)'])()
+
+    with pytest.raises(ReloadError):
+        command_reload([str(tmp_path / 'missing')])()
+
+
+def test_min_interval_above_max_delay(tmp_path):
+    with pytest.raises(ValueError):
+        ReloadScheduler(_config(), str(tmp_path / 'haproxy.cfg'), min_interval=60, max_delay=30)
@@ -0,0 +1,130 @@
+# coding=utf-8
+import pickle
+
+from haproxy_objects import Config, RoutingGraph
+
+CONFIG = """
+frontend web
+    bind :80
+    acl is_api path_beg /api
+    use_backend api if is_api
+    use_backend static if is_static METH_GET
+    default_backend app
+
+frontend admin
+    bind :8080
+    use_backend app if TRUE
+    default_backend stats
+
+backend app
+    server app1 10.0.0.1:80
+
+backend api
+    server api1 10.0.1.1:80
+
+backend unused
+    server unused1 10.0.2.1:80
+
+listen stats
+    bind :8404
+"""
+
+NEW_FRONTEND = """
+frontend web
+    bind :80
+    default_backend gone
+"""
+
+
+def _config():
+    return Config.from_lines(CONFIG.splitlines())
+
+
+def _edges(graph):
+    return (graph.frontend_backends, graph.backend_frontends, graph.orphans, graph.undefined_backends,
+            graph.frontend_undefined_acls)
+
+
+def _assert_like_a_new_graph(config):
+    # the graph followed the changes to where building it again would get
+    assert _edges(config.routes) == _edges(RoutingGraph(config))
+
+
+def test_edges():
+    routes = _config().routes
+
+    assert routes.backends_of('web') == set(['api', 'static', 'app'])
+    assert routes.backends_of('admin') == set(['app', 'stats'])
+    assert routes.backends_of('missing') == frozenset()
+    assert routes.frontends_of('app') == set(['web', 'admin'])
+    assert routes.frontends_of('stats') == set(['admin'])
+    assert routes.frontends_of('unused') == frozenset()
+
+    assert routes.is_orphan('unused')
+    assert not routes.is_orphan('app')
+    assert routes.undefined_backends == set(['static'])
+    # predefined acls need no definition
+    assert routes.undefined_acls('web') == set(['is_static'])
+    assert routes.undefined_acls('admin') == set()
+
+
+def test_backends_added_and_removed():
+    config = _config()
+    routes = config.routes
+
+    config.backends['static'] = config.backends.pop('unused')
+    assert not routes.undefined_backends
+    assert not routes.is_orphan('static')
+    assert not routes.orphans
+    _assert_like_a_new_graph(config)
+
+    del config.backends['api']
+    assert routes.undefined_backends == set(['api'])
+    _assert_like_a_new_graph(config)
+
+    del config.listens['stats']
+    assert routes.undefined_backends == set(['api', 'stats'])
+    _assert_like_a_new_graph(config)
+
+
+def test_frontends_added_and_removed():
+    config = _config()
+    routes = config.routes
+
+    del config.frontends['web']
+    assert routes.frontends_of('app') == set(['admin'])
+    assert routes.is_orphan('api')
+    assert routes.undefined_backends == set()
+    _assert_like_a_new_graph(config)
+
+    config.frontends['web'] = Config.from_lines(NEW_FRONTEND.splitlines()).frontends['web']
+    assert routes.backends_of('web') == set(['gone'])
+    assert routes.undefined_backends == set(['gone'])
+    _assert_like_a_new_graph(config)
+
+
+def test_refresh_after_an_in_place_change():
+    config = _config()
+    routes = config.routes
+
+    config.frontends['admin'].default_backend = 'unused'
+    routes.refresh('admin')
+
+    assert routes.backends_of('admin') == set(['app', 'unused'])
+    assert not routes.is_orphan('unused')
+    assert routes.frontends_of('stats') == frozenset()
+    _assert_like_a_new_graph(config)
+
+
+def test_graph_is_rebuilt_after_pickling():
+    config = _config()
+    config.routes
+
+    copy = pickle.loads(pickle.dumps(config, pickle.HIGHEST_PROTOCOL))
+    assert copy.routes is not config.routes
+    assert copy.routes.config is copy
+    assert _edges(copy.routes) == _edges(config.routes)
+
+    del copy.backends['api']
+    assert copy.routes.undefined_backends == set(['static', 'api'])
+    assert config.routes.undefined_backends == set(['static'])
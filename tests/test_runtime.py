@@ -0,0 +1,178 @@
+# coding=utf-8
+import copy
+
+import pytest
+
+from haproxy_objects import BackendConfig, Config, ServerConfig
+from haproxy_runtime import RuntimeApiError, RuntimeClient, RuntimeConnectionLost, RuntimePool, parse_timeout
+
+
+def _config(socket_path):
+    backend = BackendConfig()
+    backend.name = 'app'
+    for name, address in (('app1', '10.0.0.1:80'), ('app2', '10.0.0.2:80')):
+        backend.add_server(ServerConfig.from_parts((name, address, 'weight', '10')))
+
+    config = Config()
+    config.backends['app'] = backend
+    config.globals.set_stats_socket(socket_path, ['level', 'admin'])
+    config.globals.stats['timeout'] = '2s'
+    return config
+
+
+def test_parse_timeout():
+    assert parse_timeout('2s') == 2
+    assert parse_timeout('1500') == 1.5
+    assert parse_timeout('1m') == 60
+
+    with pytest.raises(RuntimeApiError):
+        parse_timeout('soon')
+
+
+def test_from_config_uses_the_stats_socket(stats_socket):
+    config = _config(stats_socket.address)
+    client = RuntimeClient.from_config(config)
+
+    assert client.socket_path == stats_socket.address
+    assert client.timeout == 2
+    assert 'stats socket %s level admin' % stats_socket.address in config.globals.to_string()
+
+
+def test_set_commands_sync_the_config(stats_socket):
+    config = _config(stats_socket.address)
+    client = RuntimeClient.from_config(config)
+
+    client.set_weight('app', 'app1', 0)
+    client.set_max_connections('app', 'app1', 50)
+    client.set_server_state('app', 'app2', 'maint')
+
+    assert stats_socket.commands == ['set weight app/app1 0', 'set maxconn server app/app1 50',
+                                     'set server app/app2 state maint']
+    # one connection per command without a pool
+    assert stats_socket.connections == 3
+
+    servers = config.backends['app'].server
+    assert servers['app1'].weight == 0
+    assert servers['app1'].max_connections == 50
+    assert servers['app2'].disabled
+
+
+def test_refused_command_leaves_the_config(stats_socket):
+    config = _config(stats_socket.address)
+    client = RuntimeClient.from_config(config)
+
+    with pytest.raises(RuntimeApiError, match='No such server'):
+        client.set_weight('app', 'app3', 0)
+
+    with pytest.raises(RuntimeApiError):
+        client.set_server_state('app', 'app1', 'sleeping')
+
+    assert stats_socket.commands == ['set weight app/app3 0']
+
+
+def test_apply_returns_what_needs_a_reload(stats_socket):
+    config = _config(stats_socket.address)
+    target = copy.deepcopy(config)
+    target.backends['app'].server['app1'].set_weight(5)
+    target.backends['app'].server['app2'].set_disabled(True)
+    target.backends['app'].balance = 'leastconn'
+
+    pending = RuntimeClient.from_config(config).apply(config.diff(target))
+
+    assert sorted(stats_socket.commands) == ['disable server app/app2', 'set weight app/app1 5']
+    assert [change.field for change in pending] == ['balance']
+    assert config.backends['app'].server['app1'].weight == 5
+    assert config.backends['app'].server['app2'].disabled
+
+
+def test_missing_socket(socket_dir):
+    client = RuntimeClient(socket_dir + '/missing.sock', timeout=1)
+
+    with pytest.raises(RuntimeApiError, match='missing.sock'):
+        client.execute('show info')
+
+
+def test_pool_pipelines_on_one_session(stats_socket):
+    pool = RuntimePool(stats_socket.address, size=2, batch_size=3)
+    client = RuntimeClient(stats_socket.address, pool=pool)
+
+    try:
+        commands = ['set weight app/app1 %d' % weight for weight in range(7)] + ['set weight app/app3 1']
+        replies = client.execute_many(commands)
+
+        assert replies[:7] == [''] * 7
+        assert replies[7].strip() == 'No such server.'
+        assert client.execute('show info').startswith('Name: HAProxy')
+        assert stats_socket.commands == commands + ['show info']
+        assert stats_socket.connections == 1
+
+    finally:
+        pool.close()
+
+
+def test_pool_retries_idle_sessions_haproxy_closed(stats_socket):
+    pool = RuntimePool(stats_socket.address, size=2)
+
+    try:
+        assert pool.execute('set weight app/app1 1') == ''
+        stats_socket.drop()
+
+        assert pool.execute_many(['set weight app/app1 2', 'set weight app/app2 2']) == ['', '']
+        assert stats_socket.commands == ['set weight app/app1 1', 'set weight app/app1 2', 'set weight app/app2 2']
+        assert stats_socket.connections == 2
+
+    finally:
+        pool.close()
+
+
+def test_pool_drops_sessions_that_failed(stats_socket):
+    pool = RuntimePool(stats_socket.address, size=1)
+
+    try:
+        session = pool.acquire()
+        stats_socket.drop()
+
+        with pytest.raises(RuntimeConnectionLost):
+            session.execute_many(['set weight app/app1 1'])
+
+        assert session.closed
+        pool.release(session)
+
+        # the slot is free again and a new session is opened
+        assert pool.execute('set weight app/app1 1') == ''
+        assert stats_socket.connections == 2
+
+    finally:
+        pool.close()
+
+
+def test_session_lost_after_a_reply_is_not_retried(stats_socket):
+    # the first command ran, sending the batch again would run it twice
+    stats_socket.reply = lambda command: None if command.endswith(' 2') else ''
+    pool = RuntimePool(stats_socket.address, size=1)
+
+    try:
+        pool.execute('set weight app/app1 0')
+
+        with pytest.raises(RuntimeApiError) as error:
+            pool.execute_many(['set weight app/app1 1', 'set weight app/app1 2'])
+
+        assert not isinstance(error.value, RuntimeConnectionLost)
+        assert stats_socket.commands == ['set weight app/app1 0', 'set weight app/app1 1', 'set weight app/app1 2']
+        assert not pool._idle
+
+    finally:
+        pool.close()
+
+
+def test_pool_leaves_stats_slots_free(stats_socket):
+    config = _config(stats_socket.address)
+    assert RuntimePool.from_config(config).size == 4
+    assert RuntimePool.from_config(config).timeout == 2
+
+    config.globals.stats['maxconn'] = '3'
+    assert RuntimePool.from_config(config).size == 2
+
+    config.globals.stats['maxconn'] = '1'
+    assert RuntimePool.from_config(config).size == 1
+    assert RuntimePool.from_config(config, size=8).size == 8
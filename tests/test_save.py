@@ -0,0 +1,68 @@
+# coding=utf-8
+import os
+
+import pytest
+
+from haproxy_objects import Config
+
+CONFIG = """global
+    daemon
+
+backend app
+    server app1 10.0.0.1:80 weight 10
+"""
+
+
+@pytest.fixture
+def config():
+    return Config.from_lines(CONFIG.splitlines())
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    calls = []
+    fsync = os.fsync
+
+    def counting(fd):
+        calls.append(fd)
+        fsync(fd)
+
+    monkeypatch.setattr(os, 'fsync', counting)
+    return calls
+
+
+def test_new_file(config, tmp_path, fsyncs):
+    target = str(tmp_path / 'haproxy.cfg')
+
+    assert config.save(target)
+    assert os.stat(target).st_mode & 0o7777 == 0o644
+    assert Config.from_string(target).backends['app'].server['app1'].weight == 10
+    # the file and the directory
+    assert len(fsyncs) == 2
+
+
+def test_unchanged_file_is_kept(config, tmp_path, fsyncs):
+    target = str(tmp_path / 'haproxy.cfg')
+    config.save(target)
+    before = os.stat(target)
+    del fsyncs[:]
+
+    assert not config.save(target)
+
+    after = os.stat(target)
+    assert (after.st_ino, after.st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+    assert fsyncs == []
+    assert os.listdir(str(tmp_path)) == ['haproxy.cfg']
+
+
+def test_mode_is_kept(config, tmp_path):
+    target = str(tmp_path / 'haproxy.cfg')
+    config.save(target)
+    os.chmod(target, 0o640)
+
+    config.backends['app'].server['app1'].set_weight(20)
+    assert config.save(target)
+
+    assert os.stat(target).st_mode & 0o7777 == 0o640
+    assert Config.from_string(target).backends['app'].server['app1'].weight == 20
+    assert os.listdir(str(tmp_path)) == ['haproxy.cfg']
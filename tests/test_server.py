@@ -0,0 +1,26 @@
+# coding=utf-8
+import pickle
+
+from haproxy_objects import ServerConfig
+
+
+def test_only_the_unparsed_tail_is_kept():
+    server = ServerConfig.from_parts('app1 10.0.0.1:80 weight 10 check inter 500 fall 2 maxconn 100'.split())
+
+    assert (server.weight, server.check_inter, server.check_fall, server.max_connections) == (10, 500, 2, 100)
+    assert server._unparsed is None
+    assert server._raw == 'app1 10.0.0.1:80 weight 10 check inter 500 fall 2 maxconn 100'
+
+
+def test_unknown_tokens():
+    server = ServerConfig()
+    server.from_string('app1 10.0.0.1 ssl verify none weight 5 backup')
+
+    assert server.port == 80
+    assert (server.weight, server.backup) == (5, True)
+    assert server._unparsed == ('ssl', 'verify', 'none')
+    assert server._raw.endswith(' backup ssl verify none')
+
+    copy = pickle.loads(pickle.dumps(server, pickle.HIGHEST_PROTOCOL))
+    assert copy._unparsed == server._unparsed
+    assert copy.to_string() == server.to_string()
@@ -0,0 +1,132 @@
+# coding=utf-8
+import pickle
+
+import pytest
+
+from haproxy_objects import BackendConfig, ConfigIsInvalid, ServerConfig, ServerTable
+
+
+def _server(line):
+    return ServerConfig.from_parts(line.split())
+
+
+def _rebuilt(table):
+    # the indexes a fresh table builds for the same servers
+    fresh = ServerTable(dict(table))
+    return fresh.by_address, fresh.by_cookie
+
+
+def _assert_indexed(table):
+    assert (table.by_address, table.by_cookie) == _rebuilt(table)
+    assert sorted(table._indexed) == sorted(table)
+
+
+@pytest.fixture
+def backend():
+    backend = BackendConfig()
+    backend.name = 'app'
+    backend.add_servers(['app1 10.0.0.1:80 cookie a1', 'app2 10.0.0.2:80 cookie a2', 'app3 10.0.0.1:80'])
+    return backend
+
+
+def test_add_and_find(backend):
+    table = backend.server
+    _assert_indexed(table)
+
+    assert sorted(server.name for server in table.find_by_address('10.0.0.1:80')) == ['app1', 'app3']
+    assert backend.find_server('10.0.0.2:80').name == 'app2'
+    assert backend.find_server_by_cookie('a1').name == 'app1'
+    assert backend.find_server('10.0.0.9:80') is None
+    assert table.find_by_cookie('missing') == []
+
+
+def test_dict_operations(backend):
+    table = backend.server
+
+    table['app2'] = _server('app2 10.0.0.5:81 cookie b2')
+    assert table.find_by_address('10.0.0.2:80') == []
+    assert [server.name for server in table.find_by_cookie('b2')] == ['app2']
+    _assert_indexed(table)
+
+    del table['app1']
+    assert [server.name for server in table.find_by_address('10.0.0.1:80')] == ['app3']
+    assert 'a1' not in table.by_cookie
+
+    assert table.pop('app3').name == 'app3'
+    assert table.pop('app3', None) is None
+    assert '10.0.0.1:80' not in table.by_address
+
+    table.setdefault('app4', _server('app4 10.0.0.4:80'))
+    table.update({'app5': _server('app5 10.0.0.5:80 cookie c5')})
+    table.popitem()
+    _assert_indexed(table)
+
+    copy = table.copy()
+    assert isinstance(copy, ServerTable)
+    _assert_indexed(copy)
+
+    table.clear()
+    assert (table.by_address, table.by_cookie, table._indexed) == ({}, {}, {})
+
+
+def test_update_servers(backend):
+    table = backend.server
+    app1 = table['app1']
+
+    backend.update_servers({'app1': {'ip': '10.0.0.7', 'port': '8080', 'cookie': 'x1', 'weight': 5}})
+    assert backend.find_server('10.0.0.7:8080') is app1
+    assert backend.find_server_by_cookie('x1') is app1
+    assert backend.find_server_by_cookie('a1') is None
+    assert app1.weight == 5
+    _assert_indexed(table)
+
+    backend.update_servers({'app1': {'name': 'renamed'}})
+    assert table['renamed'] is app1
+    assert 'app1' not in table
+    assert backend.find_server('10.0.0.7:8080') is app1
+    _assert_indexed(table)
+
+
+@pytest.mark.parametrize('attributes', [{'weight': 'heavy'}, {'port': 'http'}, {'name': 'app2'}, {'name': ''},
+                                        {'unknown': 1}, {'ip': '10.0.0.9', 'weight': 'heavy'}])
+def test_invalid_update_changes_nothing(backend, attributes):
+    before = backend.server['app1'].to_string()
+
+    with pytest.raises(ConfigIsInvalid):
+        backend.update_servers({'app1': attributes})
+
+    assert backend.server['app1'].to_string() == before
+    assert backend.find_server('10.0.0.9:80') is None
+    _assert_indexed(backend.server)
+
+
+def test_replace_servers(backend):
+    table = backend.server
+    app2 = table['app2']
+
+    backend.replace_servers(['app2 10.0.0.2:80 cookie a2', 'app3 10.0.0.3:80 cookie a3', 'app6 10.0.0.6:80'])
+
+    assert sorted(table) == ['app2', 'app3', 'app6']
+    # unchanged servers are kept as they are
+    assert table['app2'] is app2
+    assert backend.find_server('10.0.0.1:80') is None
+    assert backend.find_server('10.0.0.3:80').name == 'app3'
+    assert backend.find_server_by_cookie('a3').name == 'app3'
+    _assert_indexed(table)
+
+
+def test_reindex_after_an_in_place_change(backend):
+    table = backend.server
+    table['app1'].ip = '10.0.0.8'
+    table.reindex('app1')
+
+    assert backend.find_server('10.0.0.8:80').name == 'app1'
+    _assert_indexed(table)
+
+
+def test_pickled_table_keeps_its_indexes(backend):
+    table = pickle.loads(pickle.dumps(backend.server, pickle.HIGHEST_PROTOCOL))
+
+    assert isinstance(table, ServerTable)
+    assert table.find_by_cookie('a2')[0] is table['app2']
+    _assert_indexed(table)
@@ -0,0 +1,133 @@
+# coding=utf-8
+import os
+
+import pytest
+
+import haproxy_objects
+from haproxy_objects import Config, _PickledSection
+
+CONFIG = """global
+    daemon
+    maxconn 4096
+    stats socket /run/haproxy.sock level admin
+
+defaults
+    mode http
+    timeout connect 5s
+
+frontend web
+    bind :80
+    acl is_api path_beg /api
+    use_backend api if is_api
+    default_backend app
+
+backend app
+    balance roundrobin
+    server app1 10.0.0.1:80 weight 10 check
+    server app2 10.0.0.2:80 weight 20 check
+
+backend api
+    server api1 10.0.1.1:8080 check
+"""
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'haproxy.cfg'
+    path.write_text(CONFIG)
+    return str(path)
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    return str(tmp_path / 'haproxy.snapshot')
+
+
+def _from_snapshot(config):
+    return isinstance(config.backends.stored('app'), _PickledSection)
+
+
+def test_round_trip(source, snapshot):
+    parsed = Config.from_string(source)
+    parsed.save_snapshot(snapshot, source)
+
+    loaded = Config.load_snapshot(snapshot, source)
+    assert _from_snapshot(loaded)
+    assert loaded.diff(parsed) == []
+    assert loaded.to_string() == parsed.to_string()
+    assert loaded.backends['app'].server['app2'].weight == 20
+    assert loaded.globals.stats_socket_options == ['level', 'admin']
+    assert loaded.source_digest == parsed.source_digest
+
+
+def test_changed_source_is_parsed(source, snapshot):
+    Config.from_string(source).save_snapshot(snapshot, source)
+
+    with open(source, 'a') as handler:
+        handler.write('    server api2 10.0.1.2:8080 check\n')
+
+    loaded = Config.load_snapshot(snapshot, source)
+    assert not _from_snapshot(loaded)
+    assert sorted(loaded.backends['api'].server) == ['api1', 'api2']
+
+
+def test_file_changed_between_parse_and_snapshot(source, snapshot):
+    parsed = Config.from_string(source)
+    with open(source, 'a') as handler:
+        handler.write('    server api2 10.0.1.2:8080 check\n')
+
+    parsed.save_snapshot(snapshot, source)
+
+    loaded = Config.load_snapshot(snapshot, source)
+    assert not _from_snapshot(loaded)
+    assert 'api2' in loaded.backends['api'].server
+
+
+def test_edited_config_is_not_taken_for_the_source(source, snapshot):
+    parsed = Config.from_string(source)
+    parsed.backends['app'].server['app1'].set_weight(0)
+    parsed.save_snapshot(snapshot, source)
+
+    loaded = Config.load_snapshot(snapshot, source)
+    assert not _from_snapshot(loaded)
+    assert loaded.backends['app'].server['app1'].weight == 10
+
+
+def test_built_config_saved_to_its_source(tmp_path, source, snapshot):
+    config = Config.from_string(source)
+    del config.backends['api']
+    target = str(tmp_path / 'built.cfg')
+    config.save(target)
+
+    config.save_snapshot(snapshot, target)
+    loaded = Config.load_snapshot(snapshot, target)
+    assert _from_snapshot(loaded)
+    assert sorted(loaded.backends) == ['app']
+
+
+def test_other_snapshot_version_is_ignored(source, snapshot, monkeypatch):
+    Config.from_string(source).save_snapshot(snapshot, source)
+    monkeypatch.setattr(haproxy_objects, 'SNAPSHOT_VERSION', haproxy_objects.SNAPSHOT_VERSION + 1)
+
+    loaded = Config.load_snapshot(snapshot, source)
+    assert not _from_snapshot(loaded)
+    assert sorted(loaded.backends) == ['api', 'app']
+
+
+@pytest.mark.parametrize('size', [0, 10, haproxy_objects.SNAPSHOT_HEADER.size + 20])
+def test_truncated_snapshot_is_ignored(source, snapshot, size):
+    Config.from_string(source).save_snapshot(snapshot, source)
+    with open(snapshot, 'r+b') as handler:
+        handler.truncate(size)
+
+    loaded = Config.load_snapshot(snapshot, source)
+    assert not _from_snapshot(loaded)
+    assert sorted(loaded.backends) == ['api', 'app']
+
+
+def test_missing_snapshot(source, snapshot):
+    assert not os.path.exists(snapshot)
+    assert sorted(Config.load_snapshot(snapshot, source).backends) == ['api', 'app']
+
+    with pytest.raises(haproxy_objects.ConfigIsInvalid):
+        Config.load_snapshot(snapshot, source + '.missing')
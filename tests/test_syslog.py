@@ -0,0 +1,127 @@
+# coding=utf-8
+import asyncio
+import os
+import socket
+
+import pytest
+
+from haproxy_syslog import OTHER_KEY, SyslogReceiver, parse_log_address
+
+HTTP_LINE = ('<134>Oct 17 20:31:00 haproxy[1]: 10.0.0.1:5000 [17/Oct/2026:20:31:00.123] web %s/app1 '
+             '0/0/1/%d/%d %d 512 - - ---- 1/1/0/0/0 0/0 "GET / HTTP/1.1"')
+TCP_LINE = '<134>Oct 17 20:31:00 haproxy[1]: 10.0.0.1:5000 [17/Oct/2026:20:31:00.123] db db/db1 0/0/%d 1024 -- 1/1/0/0/0 0/0'
+
+
+def _http(backend='app', tr=10, tt=12, status=200):
+    return (HTTP_LINE % (backend, tr, tt, status)).encode('utf-8')
+
+
+def test_parse_log_address():
+    assert parse_log_address('/dev/log') == ('unix', '/dev/log')
+    assert parse_log_address('unix@/var/run/log') == ('unix', '/var/run/log')
+    assert parse_log_address('127.0.0.1') == ('udp', ('127.0.0.1', 514))
+    assert parse_log_address('udp@10.0.0.1:5140') == ('udp', ('10.0.0.1', 5140))
+    assert parse_log_address('ipv6@[::1]:5140') == ('udp', ('::1', 5140))
+
+    with pytest.raises(ValueError):
+        parse_log_address('tcp@10.0.0.1:514')
+
+
+def test_receive_udp_datagrams():
+    async def scenario():
+        receiver = SyslogReceiver('127.0.0.1:0', slots=10)
+        await receiver.start()
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        try:
+            address = receiver._socket.getsockname()
+            for i in range(20):
+                sender.sendto(_http(tr=10, tt=20, status=503 if i % 4 == 0 else 200), address)
+
+            sender.sendto((TCP_LINE % 300).encode('utf-8'), address)
+            sender.sendto(b'<134>not a haproxy line', address)
+
+            for _ in range(500):
+                if receiver.received == 22:
+                    break
+
+                await asyncio.sleep(0.01)
+
+            return receiver.snapshot(), receiver.unparsed, receiver.dropped()
+
+        finally:
+            sender.close()
+            receiver.close()
+
+    snapshot, unparsed, dropped = asyncio.run(scenario())
+
+    assert snapshot['app']['requests'] == 20
+    assert snapshot['app']['errors'] == 5
+    assert snapshot['app']['bytes'] == 20 * 512
+    assert 8 <= snapshot['app']['Tr']['p50'] <= 12
+    assert snapshot['db']['requests'] == 1
+    assert snapshot['db']['Tr']['p50'] is None
+    assert unparsed == 1
+    assert dropped in (0, None)
+
+
+def test_rolling_window(clock):
+    receiver = SyslogReceiver('127.0.0.1:0', slots=10, slot_seconds=1.0, clock=clock)
+
+    receiver.add_datagrams([_http()] * 3)
+    clock.now += 5
+    receiver.add_datagrams([_http()] * 2)
+    assert receiver.snapshot()['app']['requests'] == 5
+
+    clock.now += 6
+    assert receiver.snapshot()['app']['requests'] == 2
+
+    clock.now += 60
+    assert receiver.snapshot()['app']['requests'] == 0
+    assert receiver.snapshot()['app']['Tr']['p50'] is None
+
+
+def test_max_keys():
+    receiver = SyslogReceiver('127.0.0.1:0', max_keys=3)
+    receiver.add_datagrams([_http('app%d' % i) for i in range(10)])
+
+    assert len(receiver.keys) == 3
+    assert receiver.snapshot()[OTHER_KEY.decode('utf-8')]['requests'] == 8
+
+
+def test_unix_socket_is_not_replaced(socket_dir):
+    path = os.path.join(socket_dir, 'log')
+    logger = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    logger.bind(path)
+
+    try:
+        receiver = SyslogReceiver(path)
+        with pytest.raises(FileExistsError):
+            receiver.open()
+
+        # the other receiver's socket is left alone, close() included
+        receiver.close()
+        assert os.path.exists(path)
+
+        receiver.open(replace=True)
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.sendto(_http(), path)
+        sender.close()
+        receiver._read()
+        assert receiver.received == 1
+
+        receiver.close()
+        assert not os.path.exists(path)
+
+    finally:
+        logger.close()
+
+
+def test_unix_socket_is_removed_on_close(socket_dir):
+    path = os.path.join(socket_dir, 'log')
+    receiver = SyslogReceiver('unix@' + path)
+    assert receiver.open() == path
+    assert receiver.dropped() is None
+
+    receiver.close()
+    assert not os.path.exists(path)
@@ -0,0 +1,183 @@
+# coding=utf-8
+import os
+import threading
+import time
+
+import pytest
+
+from haproxy_objects import Config
+from haproxy_watch import ConfigWatcher, diff_sections
+
+CONFIG = """global
+    daemon
+
+backend app
+    server app1 10.0.0.1:80 weight %d
+
+backend api
+    server api1 10.0.1.1:80 weight 10
+"""
+
+
+def _write(path, weight):
+    # written next to path and renamed over it, as editors and tools do
+    temp = path + '.tmp'
+    with open(temp, 'w') as handler:
+        handler.write(CONFIG % weight)
+
+    os.replace(temp, path)
+
+
+class Recorder(object):
+    def __init__(self):
+        self.calls = []
+        super(Recorder, self).__init__()
+
+    def __call__(self, config, changes):
+        self.calls.append((config, changes))
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / 'haproxy.cfg')
+    _write(path, 10)
+    return path
+
+
+def _changed(changes):
+    return [(change.action, change.section, change.name) for change in changes]
+
+
+def test_diff_sections(source):
+    old = Config.from_string(source)
+    new = Config.from_string(source)
+    new.backends['api'] = old.backends['api']
+    del new.backends['app']
+    new.backends['web'] = old.backends['app']
+
+    assert _changed(diff_sections(old, new)) == [('remove', 'backend', 'app'), ('add', 'backend', 'web')]
+
+    new.globals.max_connections = 10
+    assert _changed(diff_sections(old, new))[0] == ('change', 'global', None)
+
+
+def test_polling(source):
+    recorder = Recorder()
+    watcher = ConfigWatcher(source, recorder, delay=0, poll_interval=0.01, use_inotify=False)
+
+    try:
+        assert not watcher.uses_inotify
+        assert watcher.check(0.05) == []
+
+        time.sleep(0.01)
+        _write(source, 20)
+        changes = watcher.check(2)
+
+        # only the section whose text changed is parsed again
+        assert _changed(changes) == [('change', 'backend', 'app')]
+        assert watcher.config.backends['app'].server['app1'].weight == 20
+        assert recorder.calls == [(watcher.config, changes)]
+
+    finally:
+        watcher.close()
+
+
+def test_invalid_config_keeps_the_previous_one(source):
+    watcher = ConfigWatcher(source, Recorder(), delay=0, poll_interval=0.01, use_inotify=False)
+
+    try:
+        previous = watcher.config
+        with open(source, 'a') as handler:
+            handler.write('    server broken\n')
+
+        assert watcher.check(2) == []
+        assert watcher.last_error is not None
+        assert watcher.config is previous
+
+        # the same broken file is not loaded again on every poll
+        assert watcher.check(0.05) == []
+
+    finally:
+        watcher.close()
+
+
+def test_inotify_rename(source, tmp_path):
+    recorder = Recorder()
+    watcher = ConfigWatcher(source, recorder, delay=0.05)
+    if not watcher.uses_inotify:
+        watcher.close()
+        pytest.skip('inotify is not available')
+
+    try:
+        # other files of the directory don't count as a change
+        (tmp_path / 'other.log').write_text('noise')
+        assert watcher.check(0.2) == []
+
+        _write(source, 30)
+        assert _changed(watcher.check(2)) == [('change', 'backend', 'app')]
+        assert watcher.config.backends['app'].server['app1'].weight == 30
+
+    finally:
+        watcher.close()
+
+
+def test_files_rewritten_all_the_time_are_loaded_after_max_delay(source):
+    watcher = ConfigWatcher(source, Recorder(), delay=0.2, max_delay=0.5)
+    if not watcher.uses_inotify:
+        watcher.close()
+        pytest.skip('inotify is not available')
+
+    stop = threading.Event()
+
+    def churn():
+        weight = 100
+        while not stop.is_set():
+            weight += 1
+            _write(source, weight)
+            time.sleep(0.02)
+
+    thread = threading.Thread(target=churn)
+    thread.start()
+
+    try:
+        start = time.monotonic()
+        changes = watcher.check(2)
+        elapsed = time.monotonic() - start
+
+        assert _changed(changes) == [('change', 'backend', 'app')]
+        assert elapsed < 1.5
+
+    finally:
+        stop.set()
+        thread.join()
+        watcher.close()
+
+
+def test_configmap_data_swap(tmp_path):
+    # the layout of a Kubernetes ConfigMap volume
+    directory = str(tmp_path)
+    os.mkdir(os.path.join(directory, '..v1'))
+    with open(os.path.join(directory, '..v1', 'haproxy.cfg'), 'w') as handler:
+        handler.write(CONFIG % 10)
+
+    os.symlink('..v1', os.path.join(directory, '..data'))
+    os.symlink(os.path.join('..data', 'haproxy.cfg'), os.path.join(directory, 'haproxy.cfg'))
+
+    watcher = ConfigWatcher(os.path.join(directory, 'haproxy.cfg'), Recorder(), delay=0.05)
+    if not watcher.uses_inotify:
+        watcher.close()
+        pytest.skip('inotify is not available')
+
+    try:
+        os.mkdir(os.path.join(directory, '..v2'))
+        with open(os.path.join(directory, '..v2', 'haproxy.cfg'), 'w') as handler:
+            handler.write(CONFIG % 40)
+
+        os.symlink('..v2', os.path.join(directory, '..data_tmp'))
+        os.rename(os.path.join(directory, '..data_tmp'), os.path.join(directory, '..data'))
+
+        assert _changed(watcher.check(2)) == [('change', 'backend', 'app')]
+        assert watcher.config.backends['app'].server['app1'].weight == 40
+
+    finally:
+        watcher.close()